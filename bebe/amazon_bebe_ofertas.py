@@ -19,16 +19,44 @@ from shared.amazon_ofertas_core import (
     BASE_URL,
     PARTNER_TAG,
     obtener_pagina,
+    obtener_paginas,
+    descargar_paginas,
+    estado_limite_semanal,
+    recorrer_paginas_categoria,
+    ranking_reutilizable,
+    enriquecer_mejores,
+    log_resumen_transferencia,
+    ruta_cookies,
+    cargar_cookies,
+    guardar_cookies,
+    log_resumen_badges,
+    ruta_estadisticas_badges,
+    cargar_estadisticas_badges,
+    guardar_estadisticas_badges,
+    ruta_cache_items,
+    usar_cache_items,
+    ruta_huellas_categorias,
+    guardar_huellas_categorias,
+    cargar_cache_items,
+    guardar_cache_items,
+    PaginaBloqueada,
+    huella_resultados,
     extraer_productos_busqueda,
     normalizar_titulo,
     titulos_similares,
     titulo_similar_a_recientes,
+    IndiceTitulos,
+    DetectorReediciones,
+    DIAS_VENTANA_REEDICIONES,
+    MAX_TITULOS_RECIENTES,
     agrupar_variantes,
     format_telegram_message,
     obtener_prioridad_marca as _obtener_prioridad_marca_core,
     send_telegram_message as _send_telegram_message_core,
     send_telegram_photo as _send_telegram_photo_core,
     load_posted_deals as _load_posted_deals_core,
+    cargar_huellas_categorias as _cargar_huellas_categorias_core,
+    cargar_firmas_titulos as _cargar_firmas_titulos_core,
     save_posted_deals as _save_posted_deals_core,
 )
 
@@ -51,6 +79,18 @@ DEV_MODE = False
 # Archivo para guardar ofertas ya publicadas
 POSTED_BEBE_DEALS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "posted_bebe_deals.json")
 
+# Cookies de la sesion con Amazon, conservadas entre ejecuciones
+COOKIES_BEBE_FILE = ruta_cookies("bebe")
+
+# Aciertos acumulados de los selectores de badge
+BADGES_BEBE_FILE = ruta_estadisticas_badges("bebe")
+
+# Productos ya extraidos por resultado de busqueda (no se re-extraen si no cambian)
+ITEMS_BEBE_FILE = ruta_cache_items("bebe")
+
+# Huella y ranking de cada categoria en la ultima ejecucion (reutilizado si no cambia)
+HUELLAS_BEBE_FILE = ruta_huellas_categorias("bebe")
+
 
 def _effective_token():
     return DEV_TELEGRAM_BOT_TOKEN if DEV_MODE and DEV_TELEGRAM_BOT_TOKEN else TELEGRAM_BOT_TOKEN
@@ -112,16 +152,35 @@ def load_posted_deals():
     return _load_posted_deals_core(POSTED_BEBE_DEALS_FILE)
 
 
-def save_posted_deals(deals_dict, ultimas_categorias=None, ultimos_titulos=None, categorias_semanales=None):
+def save_posted_deals(deals_dict, ultimas_categorias=None, ultimos_titulos=None, categorias_semanales=None,
+                      firmas_titulos=None):
     """Guarda el diccionario de ofertas publicadas en un archivo JSON."""
-    return _save_posted_deals_core(deals_dict, POSTED_BEBE_DEALS_FILE, ultimas_categorias, ultimos_titulos, categorias_semanales)
+    return _save_posted_deals_core(
+        deals_dict, POSTED_BEBE_DEALS_FILE, ultimas_categorias, ultimos_titulos, categorias_semanales,
+        firmas_titulos=firmas_titulos
+    )
 
 
-def buscar_y_publicar_ofertas():
+def cargar_huellas_categorias():
+    """Carga las huellas y rankings de la ultima ejecucion por categoria."""
+    return _cargar_huellas_categorias_core(HUELLAS_BEBE_FILE)
+
+
+def cargar_firmas_titulos():
+    """Carga del historial las firmas MinHash de los titulos publicados."""
+    return _cargar_firmas_titulos_core(POSTED_BEBE_DEALS_FILE)
+
+
+def buscar_y_publicar_ofertas(descargar=None):
     """
     Busca la mejor oferta de cada categoria y publica solo la que tenga
     mayor descuento de entre todas.
+
+    Args:
+        descargar: Funcion opcional lista de URLs -> lista de HTML. Por defecto se
+            usa obtener_paginas (los tests inyectan aqui su descargador).
     """
+    usar_cache_items("bebe")
     if not _effective_token() or not _effective_chat_id():
         if DEV_MODE:
             log.error(
@@ -147,10 +206,17 @@ def buscar_y_publicar_ofertas():
     # En DEV_MODE se ignora el historial para no contaminar el JSON de produccion
     if DEV_MODE:
         posted_deals, ultimas_categorias, ultimos_titulos, categorias_semanales = {}, [], [], {}
+        huellas_categorias = {}
+        firmas_titulos = {}
         log.info("DEV_MODE: historial de publicaciones ignorado (posted_bebe_deals.json no se leerá ni escribirá)")
     else:
         posted_deals, ultimas_categorias, ultimos_titulos, categorias_semanales = load_posted_deals()
+        huellas_categorias = cargar_huellas_categorias()
+        firmas_titulos = cargar_firmas_titulos()
     posted_asins = set(posted_deals.keys())
+    nuevas_huellas = {}
+    indice_titulos = IndiceTitulos(ultimos_titulos)
+    detector_reediciones = DetectorReediciones.desde_json(firmas_titulos)
 
     if ultimas_categorias:
         log.info(
@@ -166,6 +232,19 @@ def buscar_y_publicar_ofertas():
     now = datetime.now()
     una_semana = timedelta(days=7)
 
+    # Descargar de golpe las paginas de todas las categorias elegibles; el ritmo
+    # contra Amazon lo marca el limitador compartido del core
+    estados_semanales = {
+        c['nombre']: estado_limite_semanal(c, categorias_semanales, now, CATEGORIAS_LIMITE_SEMANAL)
+        for c in CATEGORIAS_BEBE
+    }
+    urls_elegibles = [
+        BASE_URL + c['url'] for c in CATEGORIAS_BEBE
+        if not (estados_semanales[c['nombre']] and estados_semanales[c['nombre']][0])
+    ]
+    # Las paginas 2..N de cada categoria salen por el mismo motor que la primera
+    paginas, obtener_extra = descargar_paginas(urls_elegibles, descargar, obtener_pagina, obtener_paginas)
+
     # Recopilar la mejor oferta de cada categoria
     mejores_por_categoria = []
 
@@ -174,53 +253,69 @@ def buscar_y_publicar_ofertas():
         log.info("--- Categoria: %s ---", categoria['nombre'])
 
         # Verificar limite semanal para ciertas categorias
-        if categoria['nombre'] in CATEGORIAS_LIMITE_SEMANAL:
-            ultima_pub_str = categorias_semanales.get(categoria['nombre'])
-            if ultima_pub_str:
-                try:
-                    ultima_pub = datetime.fromisoformat(ultima_pub_str)
-                    tiempo_transcurrido = now - ultima_pub
-                    if tiempo_transcurrido < una_semana:
-                        dias_restantes = (una_semana - tiempo_transcurrido).days + 1
-                        log.info(
-                            "  SALTADA por limite semanal: ultima publicacion el %s (hace %d dias, faltan ~%d dias)",
-                            ultima_pub.strftime('%d/%m %H:%M'), tiempo_transcurrido.days, dias_restantes
-                        )
-                        continue
-                    else:
-                        log.debug(
-                            "  Limite semanal OK: ultima publicacion hace %d dias (supera los 7 requeridos)",
-                            tiempo_transcurrido.days
-                        )
-                except (ValueError, TypeError):
-                    pass
+        estado_semanal = estados_semanales[categoria['nombre']]
+        if estado_semanal:
+            bloqueada, ultima_pub, tiempo_transcurrido = estado_semanal
+            if bloqueada:
+                dias_restantes = (una_semana - tiempo_transcurrido).days + 1
+                log.info(
+                    "  SALTADA por limite semanal: ultima publicacion el %s (hace %d dias, faltan ~%d dias)",
+                    ultima_pub.strftime('%d/%m %H:%M'), tiempo_transcurrido.days, dias_restantes
+                )
+                continue
+            log.debug(
+                "  Limite semanal OK: ultima publicacion hace %d dias (supera los 7 requeridos)",
+                tiempo_transcurrido.days
+            )
 
         url = BASE_URL + categoria['url']
-        html_content = obtener_pagina(url)
+        html_content = paginas.get(url)
+
+        if isinstance(html_content, PaginaBloqueada):
+            log.warning("  Pagina bloqueada por Amazon (%s), saltando categoria", html_content.motivo)
+            continue
 
         if not html_content:
             log.warning("  No se pudo obtener la pagina, saltando categoria")
             continue
 
-        productos = extraer_productos_busqueda(html_content)
-        ofertas = [p for p in productos if p['tiene_oferta']]
-        sin_oferta = len(productos) - len(ofertas)
-        log.info(
-            "  Scraped: %d productos (%d con oferta, %d sin descuento)",
-            len(productos), len(ofertas), sin_oferta
-        )
+        # Si los resultados no han cambiado desde la ultima ejecucion, el ranking
+        # guardado sigue valiendo: no se extrae ni se ordena de nuevo
+        huella = huella_resultados(html_content)
+        es_candidato = lambda p: p['asin'] not in posted_asins
+        paginas_extra = []
+        ofertas_ordenadas = ranking_reutilizable(huellas_categorias.get(categoria['nombre']), huella, es_candidato)
+        if ofertas_ordenadas is not None:
+            log.info("  Resultados sin cambios desde la ultima ejecucion: ranking reutilizado (%d con oferta)", len(ofertas_ordenadas))
+        else:
+            productos = recorrer_paginas_categoria(
+                url, html_content, obtener_extra, extraer_productos_busqueda,
+                es_candidato=es_candidato, pedidas=paginas_extra
+            )
+            ofertas = [p for p in productos if p['tiene_oferta']]
+            sin_oferta = len(productos) - len(ofertas)
+            log.info(
+                "  Scraped: %d productos (%d con oferta, %d sin descuento)",
+                len(productos), len(ofertas), sin_oferta
+            )
 
-        if not ofertas:
+            # Ordenar ofertas: primero por mayor descuento, luego marca prioritaria, luego valoraciones, luego ventas
+            ofertas_ordenadas = sorted(
+                ofertas,
+                key=lambda x: (x['descuento'], obtener_prioridad_marca(x['titulo']), x['valoraciones'], x['ventas']),
+                reverse=True
+            )
+        if huella:
+            nuevas_huellas[categoria['nombre']] = {
+                'huella': huella,
+                'paginas': 1 + len(paginas_extra),
+                'ofertas': [dict(p) for p in ofertas_ordenadas],
+            }
+
+        if not ofertas_ordenadas:
             log.info("  No hay productos con descuento en esta categoria")
             continue
 
-        # Ordenar ofertas: primero por mayor descuento, luego marca prioritaria, luego valoraciones, luego ventas
-        ofertas_ordenadas = sorted(
-            ofertas,
-            key=lambda x: (x['descuento'], obtener_prioridad_marca(x['titulo']), x['valoraciones'], x['ventas']),
-            reverse=True
-        )
-
         # Log de los top candidatos antes de filtrar
         log.debug("  Top candidatos antes de filtros anti-duplicacion:")
         for i, p in enumerate(ofertas_ordenadas[:5], 1):
@@ -246,13 +341,23 @@ def buscar_y_publicar_ofertas():
                 )
                 continue
 
-            if verificar_titulos and titulo_similar_a_recientes(producto['titulo'], ultimos_titulos):
+            if verificar_titulos and titulo_similar_a_recientes(producto['titulo'], indice_titulos):
                 log.info(
                     "  DESCARTADO [titulo similar a reciente] %s... (%.0f%% dto)",
                     titulo_corto, producto['descuento']
                 )
                 continue
 
+            reedicion = verificar_titulos and detector_reediciones.reedicion_de(
+                producto['titulo'], desde=now - timedelta(days=DIAS_VENTANA_REEDICIONES), excluir_asin=asin
+            )
+            if reedicion:
+                log.info(
+                    "  DESCARTADO [reedicion de %s, publicado en <%dd] %s... (%.0f%% dto, ASIN: %s)",
+                    reedicion, DIAS_VENTANA_REEDICIONES, titulo_corto, producto['descuento'], asin
+                )
+                continue
+
             candidato_elegido = producto
             marca_flag = " [marca prioritaria]" if obtener_prioridad_marca(producto['titulo']) else ""
             log.info(
@@ -268,6 +373,19 @@ def buscar_y_publicar_ofertas():
         if candidato_elegido is None:
             log.info("  Sin candidatos validos: todos descartados por duplicacion o similitud de titulo")
 
+    # Las huellas se guardan aunque no haya nada que publicar; las categorias que no se
+    # han mirado en esta ejecucion conservan las suyas
+    if not DEV_MODE:
+        nombres = {c['nombre'] for c in CATEGORIAS_BEBE}
+        huellas_categorias.update(nuevas_huellas)
+        guardar_huellas_categorias(
+            HUELLAS_BEBE_FILE, {n: h for n, h in huellas_categorias.items() if n in nombres}
+        )
+
+    # Completar los ganadores con su pagina de producto (solo con ENRIQUECER_DETALLE);
+    # los que segun ella ya no son oferta salen de la lista
+    mejores_por_categoria = enriquecer_mejores(mejores_por_categoria, descargar)
+
     # Agrupar variantes del mismo producto antes de la selección global
     mejores_por_categoria = agrupar_variantes(mejores_por_categoria)
 
@@ -353,6 +471,10 @@ def buscar_y_publicar_ofertas():
         # Guardar también ASINs de variantes agrupadas para evitar republicarlas
         for variante in producto.get('variantes_adicionales', []):
             posted_deals[variante['asin']] = datetime.now().isoformat()
+        # Firmas de los titulos publicados para descartar reediciones con otro ASIN
+        detector_reediciones.agregar(producto['asin'], producto['titulo'])
+        for variante in producto.get('variantes_adicionales', []):
+            detector_reediciones.agregar(variante['asin'], variante['titulo'])
         # Añadir categoria al inicio de la lista y mantener solo las ultimas 4
         ultimas_categorias.insert(0, categoria['nombre'])
         ultimas_categorias = ultimas_categorias[:4]
@@ -361,7 +483,7 @@ def buscar_y_publicar_ofertas():
         # Si es categoria con verificacion de titulos, guardar el titulo
         if categoria['nombre'] in CATEGORIAS_VERIFICAR_TITULOS:
             ultimos_titulos.insert(0, producto['titulo'])
-            ultimos_titulos = ultimos_titulos[:4]
+            ultimos_titulos = ultimos_titulos[:MAX_TITULOS_RECIENTES]
             log.debug("Titulo guardado en anti-similitud (total: %d)", len(ultimos_titulos))
 
         # Si es categoria con limite semanal, guardar el timestamp
@@ -378,7 +500,10 @@ def buscar_y_publicar_ofertas():
     if DEV_MODE:
         log.info("DEV_MODE: historial no guardado (posted_bebe_deals.json sin cambios)")
     else:
-        save_posted_deals(posted_deals, ultimas_categorias, ultimos_titulos, categorias_semanales)
+        save_posted_deals(
+            posted_deals, ultimas_categorias, ultimos_titulos, categorias_semanales,
+            firmas_titulos=detector_reediciones.a_json()
+        )
 
     log.info("")
     log.info("=" * 60)
@@ -394,11 +519,22 @@ def main(modo_continuo=False):
     - modo_continuo=False: ejecuta una vez y termina (para cron)
     - modo_continuo=True: ejecuta cada 15 minutos en bucle infinito
     """
+    # Reutilizar la sesion de la ejecucion anterior evita las redirecciones de
+    # arranque de sesion de Amazon en las primeras peticiones
+    cargar_cookies(COOKIES_BEBE_FILE)
+    cargar_estadisticas_badges(BADGES_BEBE_FILE)
+    cargar_cache_items(ITEMS_BEBE_FILE, "bebe")
+
     if modo_continuo:
         log.info("Modo continuo activado - Ejecutando cada 15 minutos (Ctrl+C para detener)")
         while True:
             try:
                 buscar_y_publicar_ofertas()
+                log_resumen_transferencia()
+                log_resumen_badges()
+                guardar_cookies(COOKIES_BEBE_FILE)
+                guardar_estadisticas_badges(BADGES_BEBE_FILE)
+                guardar_cache_items(ITEMS_BEBE_FILE, "bebe")
                 log.info("Proxima ejecucion en 15 minutos...")
                 log.info("-" * 60)
                 time.sleep(900)  # 15 minutos = 900 segundos
@@ -408,6 +544,11 @@ def main(modo_continuo=False):
     else:
         # Ejecutar una sola vez (ideal para cron)
         buscar_y_publicar_ofertas()
+        log_resumen_transferencia()
+        log_resumen_badges()
+        guardar_cookies(COOKIES_BEBE_FILE)
+        guardar_estadisticas_badges(BADGES_BEBE_FILE)
+        guardar_cache_items(ITEMS_BEBE_FILE, "bebe")
 
 
 if __name__ == "__main__":
@@ -22,6 +22,12 @@ import bebe.amazon_bebe_ofertas as bot
 import shared.amazon_ofertas_core as core
 
 
+@pytest.fixture(autouse=True)
+def huellas_en_tmp(tmp_path, monkeypatch):
+    """Las huellas por categoria van a CACHE_DIR: cada test usa las suyas."""
+    monkeypatch.setattr(bot, 'HUELLAS_BEBE_FILE', str(tmp_path / 'huellas.json'))
+
+
 # ---------------------------------------------------------------------------
 # Helpers de fixtures
 # ---------------------------------------------------------------------------
@@ -90,6 +96,39 @@ class TestNormalizarTitulo:
         result = bot.normalizar_titulo("de para con sin el la los las")
         assert result == set()
 
+    def test_normaliza_cada_titulo_una_vez(self, monkeypatch):
+        llamadas = []
+        findall_real = core._RE_PALABRA_TITULO.findall
+        monkeypatch.setattr(core, '_palabras_titulos', core.OrderedDict())
+        monkeypatch.setattr(core, '_RE_PALABRA_TITULO', MagicMock(findall=lambda t: llamadas.append(t) or findall_real(t)))
+        titulo = "Chupete Suavinex Anatómico Silicona"
+        assert core.titulos_similares(titulo, titulo + " rosa")
+        assert core.son_variantes(titulo, titulo + " rosa")
+        resultado = bot.normalizar_titulo(titulo)
+        resultado.add('modificado')
+        assert 'modificado' not in bot.normalizar_titulo(titulo)
+        assert len(llamadas) == 2
+
+    def test_memo_acotada(self, monkeypatch):
+        monkeypatch.setattr(core, '_palabras_titulos', core.OrderedDict())
+        monkeypatch.setattr(core, 'CACHE_TITULOS_MAX', 3)
+        for n in range(10):
+            core.normalizar_titulo(f"Producto modelo{chr(97 + n)}")
+        assert len(core._palabras_titulos) == 3
+
+    def test_palabras_de_ultimos_titulos_en_el_historial(self, tmp_path, monkeypatch):
+        ruta = str(tmp_path / 'deals.json')
+        titulos = ["Chupete Suavinex Silicona", "Pañales Dodot Talla 4"]
+        core.save_posted_deals({}, ruta, ultimos_titulos=titulos)
+        with open(ruta) as f:
+            assert json.load(f)['_palabras_titulos'] == [sorted(core.normalizar_titulo(t)) for t in titulos]
+
+        monkeypatch.setattr(core, '_palabras_titulos', core.OrderedDict())
+        monkeypatch.setattr(core, '_RE_PALABRA_TITULO', MagicMock(findall=lambda t: pytest.fail("recalculado")))
+        _, _, cargados, _ = core.load_posted_deals(ruta)
+        assert cargados == titulos
+        assert bot.normalizar_titulo(titulos[0]) == {'chupete', 'suavinex', 'silicona'}
+
 
 # ---------------------------------------------------------------------------
 # titulos_similares
@@ -1012,3 +1051,1706 @@ class TestFormatTelegramMessageConVariantes:
         # Todos los precios presentes
         assert '60€' in mensaje
         assert '65€' in mensaje
+
+
+# ---------------------------------------------------------------------------
+# obtener_paginas / LimitadorTokens - Descarga paralela de categorias
+# ---------------------------------------------------------------------------
+
+class TestObtenerPaginas:
+    def test_lista_vacia_devuelve_vacia(self):
+        assert core.obtener_paginas([], lambda url: "x") == []
+
+    def test_respeta_orden_original(self):
+        import time as _time
+
+        def obtener_lento(url):
+            # La primera URL tarda más: aun así debe quedar primera
+            _time.sleep(0.05 if url.endswith('/0') else 0)
+            return f"html {url}"
+
+        urls = [f"https://www.amazon.es/{i}" for i in range(5)]
+        assert core.obtener_paginas(urls, obtener_lento) == [f"html {u}" for u in urls]
+
+    def test_descargas_en_paralelo_acotadas(self):
+        import threading
+        import time as _time
+
+        lock = threading.Lock()
+        en_vuelo = {'actual': 0, 'max': 0}
+
+        def obtener(url):
+            with lock:
+                en_vuelo['actual'] += 1
+                en_vuelo['max'] = max(en_vuelo['max'], en_vuelo['actual'])
+            _time.sleep(0.02)
+            with lock:
+                en_vuelo['actual'] -= 1
+            return url
+
+        core.obtener_paginas([str(i) for i in range(8)], obtener, max_workers=3)
+        assert 1 < en_vuelo['max'] <= 3
+
+    def test_propaga_none_de_paginas_fallidas(self):
+        resultado = core.obtener_paginas(['a', 'b'], lambda url: None if url == 'a' else "ok")
+        assert resultado == [None, "ok"]
+
+    def test_descargar_paginas_con_y_sin_motor(self):
+        paginas, extra = core.descargar_paginas(['a', 'b'], obtener=lambda url: f"html {url}")
+        assert paginas == {'a': "html a", 'b': "html b"}
+        assert extra('c') == "html c"
+
+        lotes = []
+        paginas, extra = core.descargar_paginas(['a'], lambda urls: lotes.append(urls) or [u * 2 for u in urls])
+        assert paginas == {'a': "aa"}
+        assert extra('b') == "bb"
+        assert lotes == [['a'], ['b']]
+
+    def test_estado_limite_semanal(self):
+        now = datetime.now()
+        semanales = {'Tronas': (now - timedelta(days=2)).isoformat(), 'Chupetes': 'no-fecha'}
+        estado = core.estado_limite_semanal({'nombre': 'Tronas'}, semanales, now, ['Tronas', 'Chupetes'])
+        assert estado[0] is True and estado[2].days == 2
+        assert core.estado_limite_semanal({'nombre': 'Tronas'}, semanales, now + timedelta(days=6), ['Tronas'])[0] is False
+        assert core.estado_limite_semanal({'nombre': 'Tronas'}, semanales, now, []) is None
+        assert core.estado_limite_semanal({'nombre': 'Chupetes'}, semanales, now, ['Chupetes']) is None
+
+
+class RelojFalso:
+    def __init__(self):
+        self.t = 1000.0
+
+    def __call__(self):
+        return self.t
+
+
+class TestLimitadorTokens:
+    def test_rafaga_sale_sin_esperar(self):
+        limitador = core.LimitadorTokens(tasa=0.5, rafaga=2, jitter=0, reloj=RelojFalso())
+        assert limitador.reservar_turno() == 0
+        assert limitador.reservar_turno() == 0
+
+    def test_sin_presupuesto_reserva_huecos_sucesivos(self):
+        limitador = core.LimitadorTokens(tasa=0.5, rafaga=1, jitter=0, reloj=RelojFalso())
+        assert limitador.reservar_turno() == 0
+        assert limitador.reservar_turno() == pytest.approx(2.0)
+        assert limitador.reservar_turno() == pytest.approx(4.0)
+
+    def test_se_rellena_con_el_tiempo(self):
+        reloj = RelojFalso()
+        limitador = core.LimitadorTokens(tasa=0.5, rafaga=1, jitter=0, reloj=reloj)
+        limitador.reservar_turno()
+        reloj.t += 2.0  # tiempo de parseo entre peticiones
+        assert limitador.reservar_turno() == 0
+
+    def test_rafaga_no_se_acumula_por_encima_del_maximo(self):
+        reloj = RelojFalso()
+        limitador = core.LimitadorTokens(tasa=1, rafaga=2, jitter=0, reloj=reloj)
+        reloj.t += 3600
+        esperas = [limitador.reservar_turno() for _ in range(3)]
+        assert esperas[:2] == [0, 0]
+        assert esperas[2] > 0
+
+    def test_jitter_solo_cuando_se_espera(self):
+        limitador = core.LimitadorTokens(tasa=1, rafaga=1, jitter=5, reloj=RelojFalso())
+        assert limitador.reservar_turno() == 0
+        assert 1.0 <= limitador.reservar_turno() <= 6.0
+
+    def test_penalizar_retrasa_a_todos(self):
+        limitador = core.LimitadorTokens(tasa=1, rafaga=2, jitter=0, reloj=RelojFalso())
+        limitador.penalizar(10)
+        assert limitador.reservar_turno() == pytest.approx(11.0)
+
+    def test_turnos_espaciados_entre_hilos(self):
+        import threading
+        import time as _time
+
+        limitador = core.LimitadorTokens(tasa=40, rafaga=1, jitter=0)
+        tiempos = []
+        lock = threading.Lock()
+
+        def pedir():
+            limitador.esperar_turno()
+            with lock:
+                tiempos.append(_time.monotonic())
+
+        hilos = [threading.Thread(target=pedir) for _ in range(4)]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+
+        tiempos.sort()
+        assert tiempos[-1] - tiempos[0] >= 0.06
+
+
+class TestBuscarYPublicarOfertasParalelo:
+    def test_no_descarga_categorias_con_limite_semanal(self, monkeypatch, tmp_path):
+        """La fase de descarga solo pide las categorías elegibles, en su orden original."""
+        hace_2_dias = (datetime.now() - timedelta(days=2)).isoformat()
+        deals_file = tmp_path / 'deals.json'
+        deals_file.write_text(json.dumps({'_categorias_semanales': {'Tronas': hace_2_dias}}))
+        monkeypatch.setattr(bot, 'POSTED_BEBE_DEALS_FILE', str(deals_file))
+        monkeypatch.setattr(bot, 'TELEGRAM_BOT_TOKEN', 'mock_token')
+        monkeypatch.setattr(bot, 'TELEGRAM_CHAT_ID', 'mock_chat_id')
+
+        urls_pedidas = []
+
+        def mock_obtener_paginas(urls, obtener):
+            urls_pedidas.extend(urls)
+            return ["<html>mock</html>"] * len(urls)
+
+        monkeypatch.setattr(bot, 'obtener_paginas', mock_obtener_paginas)
+        monkeypatch.setattr(bot, 'obtener_pagina', lambda url: "<html>mock</html>")
+        monkeypatch.setattr(bot, 'extraer_productos_busqueda', lambda html: [make_producto(descuento=30.0)])
+        monkeypatch.setattr(bot, 'send_telegram_photo', lambda url, msg: True)
+        monkeypatch.setattr(bot, 'send_telegram_message', lambda msg: True)
+
+        bot.buscar_y_publicar_ofertas()
+
+        esperadas = [bot.BASE_URL + c['url'] for c in bot.CATEGORIAS_BEBE if c['nombre'] != 'Tronas']
+        assert urls_pedidas == esperadas
+
+
+# ---------------------------------------------------------------------------
+# Motor asincrono - obtener_pagina_async / obtener_paginas_async
+# ---------------------------------------------------------------------------
+
+class TestMotorAsync:
+    @pytest.fixture(autouse=True)
+    def _limitador_rapido(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(core, 'limitador', core.LimitadorTokens(tasa=1000, rafaga=1000, jitter=0))
+        monkeypatch.setattr(core, 'CACHE_HTTP_DIR', str(tmp_path / 'http'))
+        monkeypatch.setattr(core, '_cliente_async', None)
+        monkeypatch.setattr(core, '_semaforos_host', {})
+
+    def test_sin_httpx_delega_en_obtener_pagina(self, monkeypatch):
+        import asyncio
+        monkeypatch.setattr(core, 'httpx', None)
+        monkeypatch.setattr(core, 'obtener_pagina', lambda url, reintentos=3, max_resultados=None, usar_cache=True: f"html {url}")
+        assert asyncio.run(core.obtener_pagina_async("https://www.amazon.es/s?k=x")) == "html https://www.amazon.es/s?k=x"
+
+    def test_limita_peticiones_simultaneas_por_host(self, monkeypatch):
+        import asyncio
+        httpx = pytest.importorskip('httpx')
+        monkeypatch.setattr(core, 'MAX_PETICIONES_POR_HOST', 2)
+        en_vuelo = {'actual': 0, 'max': 0}
+
+        async def handler(request):
+            en_vuelo['actual'] += 1
+            en_vuelo['max'] = max(en_vuelo['max'], en_vuelo['actual'])
+            await asyncio.sleep(0.01)
+            en_vuelo['actual'] -= 1
+            return httpx.Response(200, text=f"pagina {request.url.params['k']}")
+
+        async def principal():
+            core._cliente_async = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            try:
+                urls = [f"https://www.amazon.es/s?k={i}" for i in range(6)]
+                return await core.obtener_paginas_async(urls)
+            finally:
+                await core.cerrar_cliente_async()
+
+        resultado = asyncio.run(principal())
+        assert resultado == [f"pagina {i}" for i in range(6)]
+        assert en_vuelo['max'] == 2
+
+    def test_error_http_devuelve_none_tras_reintentos(self, monkeypatch):
+        import asyncio
+        httpx = pytest.importorskip('httpx')
+        monkeypatch.setattr(core.random, 'uniform', lambda a, b: 0)
+
+        async def principal():
+            core._cliente_async = httpx.AsyncClient(
+                transport=httpx.MockTransport(lambda request: httpx.Response(503))
+            )
+            try:
+                return await core.obtener_pagina_async("https://www.amazon.es/s?k=x", reintentos=2)
+            finally:
+                await core.cerrar_cliente_async()
+
+        assert asyncio.run(principal()) is None
+
+
+def _respuesta_streaming(texto, status=200, headers=None, tam_bloque=None):
+    """Respuesta requests simulada que entrega el cuerpo por bloques via iter_content."""
+    cuerpo = texto.encode('utf-8')
+    tam = tam_bloque or max(len(cuerpo), 1)
+    response = MagicMock()
+    response.status_code = status
+    response.encoding = 'utf-8'
+    response.headers = headers or {}
+    response.raise_for_status = MagicMock()
+    response.bloques_leidos = 0
+    response.content = cuerpo
+    # Sin compresion simulada: los bytes de red son los bytes de cuerpo entregados
+    response.raw.tell = lambda: min(response.bloques_leidos * tam, len(cuerpo))
+
+    def iter_content(chunk_size=1):
+        for inicio in range(0, len(cuerpo), tam):
+            response.bloques_leidos += 1
+            yield cuerpo[inicio:inicio + tam]
+
+    response.iter_content = iter_content
+    return response
+
+
+# ---------------------------------------------------------------------------
+# Cache HTTP en disco - obtener_pagina con TTL y revalidación condicional
+# ---------------------------------------------------------------------------
+
+class TestCacheHTTP:
+    URL = "https://www.amazon.es/s?k=panales"
+    CLAVE = core._clave_cache_http(URL, core.MAX_RESULTADOS_BUSQUEDA)
+
+    @pytest.fixture(autouse=True)
+    def _entorno(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(core, 'CACHE_HTTP_DIR', str(tmp_path / 'http'))
+        monkeypatch.setattr(core, 'CACHE_HTTP_TTL', 600)
+        self.esperas = []
+        monkeypatch.setattr(core, 'limitador', core.LimitadorTokens(tasa=1000, rafaga=1000, jitter=0))
+        monkeypatch.setattr(core.limitador, 'esperar_turno', lambda: self.esperas.append(1))
+
+    def _respuesta(self, status=200, texto="<html>pagina</html>", headers=None):
+        return _respuesta_streaming(texto, status=status, headers=headers)
+
+    def test_guarda_y_sirve_desde_cache_sin_red(self, monkeypatch):
+        mock_get = MagicMock(return_value=self._respuesta(texto="<html>uno</html>"))
+        monkeypatch.setattr(core.session, 'get', mock_get)
+
+        assert core.obtener_pagina(self.URL) == "<html>uno</html>"
+        assert core.obtener_pagina(self.URL) == "<html>uno</html>"
+
+        assert mock_get.call_count == 1
+        assert len(self.esperas) == 1  # el acierto de cache no espera turno
+
+    def test_entrada_caducada_revalida_con_etag_y_last_modified(self, monkeypatch):
+        core.guardar_cache_http(self.CLAVE, "<html>viejo</html>", etag='"abc"', last_modified="Mon, 01 Jan 2026 00:00:00 GMT")
+        ruta = core._ruta_cache_http(self.CLAVE)
+        entrada = json.loads(open(ruta).read())
+        entrada['obtenido'] -= 3600
+        open(ruta, 'w').write(json.dumps(entrada))
+
+        mock_get = MagicMock(return_value=self._respuesta(status=304, texto=""))
+        monkeypatch.setattr(core.session, 'get', mock_get)
+
+        assert core.obtener_pagina(self.URL) == "<html>viejo</html>"
+        headers = mock_get.call_args.kwargs['headers']
+        assert headers['If-None-Match'] == '"abc"'
+        assert headers['If-Modified-Since'] == "Mon, 01 Jan 2026 00:00:00 GMT"
+        # El 304 refresca la fecha: la siguiente llamada ya no toca la red
+        core.obtener_pagina(self.URL)
+        assert mock_get.call_count == 1
+
+    def test_entrada_caducada_con_200_sustituye_cuerpo(self, monkeypatch):
+        core.guardar_cache_http(self.CLAVE, "<html>viejo</html>")
+        monkeypatch.setattr(core, 'CACHE_HTTP_TTL', 1)
+        monkeypatch.setattr(core, 'reloj_pared', lambda: 10 ** 10)
+        mock_get = MagicMock(return_value=self._respuesta(texto="<html>nuevo</html>", headers={'ETag': '"n"'}))
+        monkeypatch.setattr(core.session, 'get', mock_get)
+
+        assert core.obtener_pagina(self.URL) == "<html>nuevo</html>"
+        assert 'If-None-Match' not in mock_get.call_args.kwargs['headers']
+        assert core.leer_cache_http(self.CLAVE)['etag'] == '"n"'
+
+    def test_ttl_cero_desactiva_cache(self, monkeypatch):
+        monkeypatch.setattr(core, 'CACHE_HTTP_TTL', 0)
+        mock_get = MagicMock(return_value=self._respuesta())
+        monkeypatch.setattr(core.session, 'get', mock_get)
+
+        core.obtener_pagina(self.URL)
+        core.obtener_pagina(self.URL)
+        assert mock_get.call_count == 2
+
+    def test_fallo_no_se_cachea(self, monkeypatch):
+        import requests
+        monkeypatch.setattr(core.time, 'sleep', lambda s: None)
+        monkeypatch.setattr(core.session, 'get', MagicMock(side_effect=requests.ConnectionError("caida")))
+
+        assert core.obtener_pagina(self.URL, reintentos=2) is None
+        assert core.leer_cache_http(self.CLAVE) is None
+
+    def test_entrada_corrupta_se_ignora(self, tmp_path):
+        import os as _os
+        _os.makedirs(core.CACHE_HTTP_DIR, exist_ok=True)
+        open(core._ruta_cache_http(self.CLAVE), 'w').write("{no json")
+        assert core.leer_cache_http(self.CLAVE) is None
+
+    def test_al_guardar_poda_las_entradas_mas_antiguas(self, monkeypatch):
+        import os as _os
+        cuerpo = "x" * 1000
+        for i in range(3):
+            core.guardar_cache_http(f"url{i}", cuerpo)
+            ruta = core._ruta_cache_http(f"url{i}")
+            _os.utime(ruta, (1000 + i, 1000 + i))
+        monkeypatch.setattr(core, 'CACHE_HTTP_MAX_BYTES', 2500)
+        core.guardar_cache_http("url3", cuerpo)
+        assert [core.leer_cache_http(f"url{i}") is not None for i in range(4)] == [False, False, True, True]
+
+
+# ---------------------------------------------------------------------------
+# Detección de bloqueos (captcha / robot check)
+# ---------------------------------------------------------------------------
+
+HTML_CAPTCHA = textwrap.dedent("""
+<html><head><title dir="ltr">Amazon.es</title></head><body>
+<h4>Introduce los caracteres que ves a continuación</h4>
+<form method="get" action="/errors/validateCaptcha" name="">
+  <input type=text id="captchacharacters" name="field-keywords">
+</form>
+</body></html>
+""")
+
+
+class TestDeteccionBloqueo:
+    @pytest.fixture(autouse=True)
+    def _entorno(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(core, 'CACHE_HTTP_DIR', str(tmp_path / 'http'))
+        monkeypatch.setattr(core, 'limitador', core.LimitadorTokens(tasa=1000, rafaga=1000, jitter=0))
+        monkeypatch.setattr(core, '_ultimo_bloqueo', None)
+
+    def test_detecta_captcha(self):
+        assert core.detectar_bloqueo(HTML_CAPTCHA) == 'captcha'
+
+    def test_detecta_pagina_sorry(self):
+        assert core.detectar_bloqueo("<html><title>Sorry! Something went wrong!</title></html>") == 'sorry'
+
+    def test_pagina_de_resultados_no_es_bloqueo(self):
+        assert core.detectar_bloqueo(_html_con_producto()) is None
+        assert core.detectar_bloqueo(None) is None
+
+    def test_pagina_bloqueada_es_falsy(self):
+        resultado = core.PaginaBloqueada("https://www.amazon.es/s?k=x", 'captcha')
+        assert not resultado
+        assert resultado.motivo == 'captcha'
+
+    def test_obtener_pagina_no_reintenta_ni_cachea_bloqueos(self, monkeypatch):
+        mock_get = MagicMock(return_value=_respuesta_streaming(HTML_CAPTCHA))
+        monkeypatch.setattr(core.session, 'get', mock_get)
+
+        resultado = core.obtener_pagina("https://www.amazon.es/s?k=x")
+
+        assert isinstance(resultado, core.PaginaBloqueada)
+        assert resultado.motivo == 'captcha'
+        assert mock_get.call_count == 1
+        assert core.leer_cache_http("https://www.amazon.es/s?k=x") is None
+
+    def test_bloqueo_frena_el_limitador(self, monkeypatch):
+        monkeypatch.setattr(core.session, 'get', MagicMock(return_value=_respuesta_streaming(HTML_CAPTCHA)))
+        core.obtener_pagina("https://www.amazon.es/s?k=x")
+        assert core.limitador.reservar_turno() > 0
+
+    def test_obtener_paginas_abandona_las_restantes(self):
+        llamadas = []
+
+        def obtener(url):
+            llamadas.append(url)
+            return core.PaginaBloqueada(url, 'captcha') if url == 'u0' else "<html>ok</html>"
+
+        resultado = core.obtener_paginas([f'u{i}' for i in range(5)], obtener, max_workers=1)
+
+        assert llamadas == ['u0']
+        assert all(isinstance(r, core.PaginaBloqueada) for r in resultado)
+        assert resultado[1].motivo == 'omitida tras bloqueo'
+
+    def test_canal_no_parsea_paginas_bloqueadas(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(bot, 'POSTED_BEBE_DEALS_FILE', str(tmp_path / 'deals.json'))
+        monkeypatch.setattr(bot, 'TELEGRAM_BOT_TOKEN', 'mock_token')
+        monkeypatch.setattr(bot, 'TELEGRAM_CHAT_ID', 'mock_chat_id')
+        monkeypatch.setattr(
+            bot, 'obtener_paginas',
+            lambda urls, obtener: [core.PaginaBloqueada(u, 'captcha') for u in urls]
+        )
+        extraer = MagicMock(return_value=[make_producto()])
+        monkeypatch.setattr(bot, 'extraer_productos_busqueda', extraer)
+
+        assert bot.buscar_y_publicar_ofertas() == 0
+        extraer.assert_not_called()
+
+
+# ---------------------------------------------------------------------------
+# Lectura en streaming - corte tras los primeros resultados de busqueda
+# ---------------------------------------------------------------------------
+
+def _html_con_resultados(n):
+    """Pagina de busqueda con n resultados, cada uno con divs anidados y etiquetas vacias."""
+    items = "".join(
+        f'<div data-component-type="s-search-result" data-asin="B{i:09d}">'
+        f'<div class="s-card"><div><h2><a><span>Producto {i}</span></a></h2></div>'
+        f'<span class="a-price" data-a-color="base"><span class="a-offscreen">{10 + i},00€</span></span>'
+        f'<span class="a-price a-text-price" data-a-strike="true"><span class="a-offscreen">{20 + i},00€</span></span>'
+        f'<span class="savingsPercentage">-30%</span><img class="s-image" src="https://x/{i}.jpg"><br>'
+        f'</div></div>'
+        for i in range(n)
+    )
+    return f"<html><body><div class='s-main-slot'>{items}</div><footer>pie</footer></body></html>"
+
+
+class TestStreamingResultados:
+    URL = "https://www.amazon.es/s?k=panales"
+
+    @pytest.fixture(autouse=True)
+    def _entorno(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(core, 'CACHE_HTTP_DIR', str(tmp_path / 'http'))
+        monkeypatch.setattr(core, 'limitador', core.LimitadorTokens(tasa=1000, rafaga=1000, jitter=0))
+        monkeypatch.setattr(core, '_ultimo_bloqueo', None)
+
+    def test_lector_cuenta_solo_resultados_cerrados(self):
+        lector = core.LectorResultados(max_resultados=2)
+        html = _html_con_resultados(3)
+        corte = html.index('data-asin="B000000001"')
+        assert not lector.alimentar(html[:corte + 200])
+        assert lector.resultados == 1
+        assert lector.alimentar(html[corte + 200:])
+
+    def test_prefijo_extrae_lo_mismo_que_la_pagina_completa(self):
+        html = _html_con_resultados(30)
+        lector = core.LectorResultados()
+        for inicio in range(0, len(html), 100):
+            if lector.alimentar(html[inicio:inicio + 100]):
+                break
+
+        prefijo = lector.texto()
+        assert len(prefijo) < len(html)
+        assert core.extraer_productos_busqueda(prefijo) == core.extraer_productos_busqueda(html)
+
+    def test_obtener_pagina_corta_la_descarga(self, monkeypatch):
+        html = _html_con_resultados(60)
+        response = _respuesta_streaming(html, tam_bloque=512)
+        monkeypatch.setattr(core.session, 'get', MagicMock(return_value=response))
+
+        resultado = core.obtener_pagina(self.URL)
+
+        assert core.session.get.call_args.kwargs['stream'] is True
+        assert response.bloques_leidos < len(html) // 512
+        response.close.assert_called_once()
+        assert len(core.extraer_productos_busqueda(resultado)) == core.MAX_RESULTADOS_BUSQUEDA
+
+    def test_sin_limite_lee_el_documento_completo(self, monkeypatch):
+        html = _html_con_resultados(30)
+        response = _respuesta_streaming(html)
+        response.text = html
+        monkeypatch.setattr(core.session, 'get', MagicMock(return_value=response))
+
+        assert core.obtener_pagina(self.URL, max_resultados=None) == html
+
+    def test_utf8_partido_entre_bloques(self, monkeypatch):
+        html = "<html><body><h2>Pañales bebé</h2></body></html>"
+        monkeypatch.setattr(core.session, 'get', MagicMock(return_value=_respuesta_streaming(html, tam_bloque=3)))
+
+        assert core.obtener_pagina(self.URL) == html
+
+    def test_cache_separa_lectura_parcial_y_completa(self, monkeypatch):
+        monkeypatch.setattr(core, 'CACHE_HTTP_TTL', 600)
+        core.guardar_cache_http(self.URL, "<html>completa</html>")
+        monkeypatch.setattr(core.session, 'get', MagicMock(return_value=_respuesta_streaming("<html>parcial</html>")))
+
+        assert core.obtener_pagina(self.URL) == "<html>parcial</html>"
+        assert core.obtener_pagina(self.URL, max_resultados=None) == "<html>completa</html>"
+
+    def test_async_corta_la_descarga(self, monkeypatch):
+        import asyncio
+        httpx = pytest.importorskip('httpx')
+        html = _html_con_resultados(60).encode('utf-8')
+        enviados = []
+
+        class Cuerpo(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                for inicio in range(0, len(html), 512):
+                    enviados.append(inicio)
+                    yield html[inicio:inicio + 512]
+
+        monkeypatch.setattr(core, '_semaforos_host', {})
+
+        async def principal():
+            core._cliente_async = httpx.AsyncClient(transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, stream=Cuerpo(), headers={'Content-Type': 'text/html; charset=utf-8'})
+            ))
+            try:
+                return await core.obtener_pagina_async(self.URL)
+            finally:
+                await core.cerrar_cliente_async()
+
+        resultado = asyncio.run(principal())
+
+        assert len(enviados) < len(html) // 512
+        assert len(core.extraer_productos_busqueda(resultado)) == core.MAX_RESULTADOS_BUSQUEDA
+
+
+# ---------------------------------------------------------------------------
+# Recorrido paginado de categorias
+# ---------------------------------------------------------------------------
+
+class TestRecorrerPaginasCategoria:
+    URL = "https://www.amazon.es/s?k=tronas"
+
+    def _paginas(self, contenido):
+        """Simula descarga + extraccion: contenido es {pagina: [productos]}."""
+        pedidas = []
+
+        def obtener(url):
+            pedidas.append(url)
+            pagina = int(url.rsplit('page=', 1)[1]) if 'page=' in url else 1
+            return f"<html>{pagina}</html>" if pagina in contenido else None
+
+        def extraer(html):
+            return list(contenido[int(html[6:-7])])
+
+        return pedidas, obtener, extraer
+
+    def test_url_pagina(self):
+        assert core.url_pagina_busqueda(self.URL, 1) == self.URL
+        assert core.url_pagina_busqueda(self.URL, 3) == self.URL + "&page=3"
+        assert core.url_pagina_busqueda("https://x/s", 2) == "https://x/s?page=2"
+
+    def test_no_pagina_si_la_primera_basta(self):
+        pedidas, obtener, extraer = self._paginas(
+            {1: [make_producto(asin=f"A{i}") for i in range(5)], 2: [make_producto(asin="B0")]}
+        )
+        productos = core.recorrer_paginas_categoria(self.URL, "<html>1</html>", obtener, extraer, objetivo=5)
+        assert len(productos) == 5
+        assert pedidas == []
+
+    def test_pagina_cuando_la_primera_no_tiene_ofertas(self):
+        pedidas, obtener, extraer = self._paginas({
+            1: [make_producto(asin="A0", tiene_oferta=False)],
+            2: [make_producto(asin="B0"), make_producto(asin="B1")],
+            3: [make_producto(asin="C0")],
+        })
+        productos = core.recorrer_paginas_categoria(
+            self.URL, "<html>1</html>", obtener, extraer, objetivo=3, max_paginas=5
+        )
+        assert [p['asin'] for p in productos] == ["A0", "B0", "B1", "C0"]
+        # Con B0, B1 y C0 ya hay 3 candidatos: la pagina 4 no se pide
+        assert pedidas == [self.URL + "&page=2", self.URL + "&page=3"]
+
+    def test_para_cuando_una_pagina_no_aporta_ofertas_nuevas(self):
+        pedidas, obtener, extraer = self._paginas({
+            1: [make_producto(asin="A0")],
+            2: [make_producto(asin="A0"), make_producto(asin="B1", tiene_oferta=False)],
+            3: [make_producto(asin="C0")],
+        })
+        productos = core.recorrer_paginas_categoria(self.URL, "<html>1</html>", obtener, extraer, objetivo=5)
+        assert [p['asin'] for p in productos] == ["A0", "B1"]
+        assert len(pedidas) == 1
+
+    def test_es_candidato_descarta_ya_publicados(self):
+        pedidas, obtener, extraer = self._paginas({
+            1: [make_producto(asin="PUBLICADO")],
+            2: [make_producto(asin="NUEVO")],
+        })
+        productos = core.recorrer_paginas_categoria(
+            self.URL, "<html>1</html>", obtener, extraer,
+            es_candidato=lambda p: p['asin'] != "PUBLICADO", objetivo=1
+        )
+        assert [p['asin'] for p in productos] == ["PUBLICADO", "NUEVO"]
+        assert len(pedidas) == 1
+
+    def test_bloqueo_corta_el_recorrido(self):
+        pedidas = []
+
+        def obtener(url):
+            pedidas.append(url)
+            return core.PaginaBloqueada(url, 'captcha')
+
+        productos = core.recorrer_paginas_categoria(
+            self.URL, "<html>1</html>", obtener, lambda html: [], max_paginas=4
+        )
+        assert productos == []
+        assert len(pedidas) == 1
+
+    def test_canal_usa_paginas_extra_en_categoria_sin_ofertas(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(bot, 'POSTED_BEBE_DEALS_FILE', str(tmp_path / 'deals.json'))
+        monkeypatch.setattr(bot, 'TELEGRAM_BOT_TOKEN', 'mock_token')
+        monkeypatch.setattr(bot, 'TELEGRAM_CHAT_ID', 'mock_chat_id')
+        monkeypatch.setattr(bot, 'CATEGORIAS_BEBE', [{"nombre": "Tronas", "emoji": "🪑", "url": "/s?k=tronas"}])
+        monkeypatch.setattr(bot, 'obtener_paginas', lambda urls, obtener: ["<html>p1</html>"] * len(urls))
+        monkeypatch.setattr(bot, 'obtener_pagina', lambda url: "<html>p2</html>" if url.endswith("page=2") else None)
+        monkeypatch.setattr(bot, 'extraer_productos_busqueda', lambda html: (
+            [make_producto(asin="SIN", tiene_oferta=False)] if html == "<html>p1</html>"
+            else [make_producto(asin="PAG2", descuento=40.0)]
+        ))
+        enviados = []
+        monkeypatch.setattr(bot, 'send_telegram_photo', lambda url, msg: enviados.append(msg) or True)
+        monkeypatch.setattr(bot, 'send_telegram_message', lambda msg: enviados.append(msg) or True)
+
+        assert bot.buscar_y_publicar_ofertas() == 1
+        assert len(enviados) == 1
+
+
+# ---------------------------------------------------------------------------
+# Negociacion de Content-Encoding y estadisticas de transferencia
+# ---------------------------------------------------------------------------
+
+class TestTransferencia:
+    URL = "https://www.amazon.es/s?k=panales"
+
+    @pytest.fixture(autouse=True)
+    def _entorno(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(core, 'CACHE_HTTP_DIR', str(tmp_path / 'http'))
+        monkeypatch.setattr(core, 'limitador', core.LimitadorTokens(tasa=1000, rafaga=1000, jitter=0))
+        monkeypatch.setattr(core, '_ultimo_bloqueo', None)
+        core.resumen_transferencia(reiniciar=True)
+
+    def test_accept_encoding_solo_ofrece_lo_decodificable(self, monkeypatch):
+        monkeypatch.setattr(core, 'ACCEPT_ENCODING', 'gzip,deflate')
+        assert core._accept_encoding() == 'gzip, deflate;q=0.9'
+
+    def test_accept_encoding_prefiere_la_mas_compacta(self, monkeypatch):
+        monkeypatch.setattr(core, 'ACCEPT_ENCODING', 'gzip,deflate,br,zstd')
+        assert core._accept_encoding() == 'zstd, br;q=0.9, gzip;q=0.8, deflate;q=0.7'
+
+    def test_headers_no_anuncian_codificaciones_sin_soporte(self):
+        from urllib3.util.request import ACCEPT_ENCODING
+        anunciadas = {c.split(';')[0].strip() for c in core.HEADERS['Accept-Encoding'].split(',')}
+        assert anunciadas <= {c.strip() for c in ACCEPT_ENCODING.split(',')}
+
+    def test_obtener_pagina_registra_bytes(self, monkeypatch):
+        response = _respuesta_streaming("<html>" + "x" * 1000 + "</html>", headers={'Content-Encoding': 'gzip'})
+        response.raw.tell = lambda: 300
+        monkeypatch.setattr(core.session, 'get', MagicMock(return_value=response))
+
+        core.obtener_pagina(self.URL)
+
+        assert core.resumen_transferencia() == {'peticiones': 1, 'bytes_red': 300, 'bytes_html': 1013}
+
+    def test_acierto_de_cache_no_cuenta(self, monkeypatch):
+        monkeypatch.setattr(core, 'CACHE_HTTP_TTL', 600)
+        core.guardar_cache_http(core._clave_cache_http(self.URL, core.MAX_RESULTADOS_BUSQUEDA), "<html>c</html>")
+        core.obtener_pagina(self.URL)
+        assert core.resumen_transferencia()['peticiones'] == 0
+
+    def test_async_registra_bytes_comprimidos(self, monkeypatch):
+        import asyncio
+        import gzip
+        httpx = pytest.importorskip('httpx')
+        html = ("<html>" + "oferta " * 500 + "</html>").encode('utf-8')
+        comprimido = gzip.compress(html)
+        monkeypatch.setattr(core, '_cliente_async', None)
+        monkeypatch.setattr(core, '_semaforos_host', {})
+
+        class Cuerpo(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                yield comprimido
+
+        async def principal():
+            core._cliente_async = httpx.AsyncClient(transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, stream=Cuerpo(), headers={'Content-Encoding': 'gzip'})
+            ))
+            try:
+                return await core.obtener_pagina_async(self.URL)
+            finally:
+                await core.cerrar_cliente_async()
+
+        assert asyncio.run(principal()) == html.decode('utf-8')
+        resumen = core.resumen_transferencia()
+        assert resumen['bytes_red'] == len(comprimido)
+        assert resumen['bytes_html'] == len(html)
+
+    def test_log_resumen_reinicia_contadores(self):
+        core.registrar_transferencia(self.URL, 100, 400, 'gzip')
+        assert core.log_resumen_transferencia()['bytes_red'] == 100
+        assert core.resumen_transferencia() == {'peticiones': 0, 'bytes_red': 0, 'bytes_html': 0}
+
+
+# ---------------------------------------------------------------------------
+# Cookies persistentes entre ejecuciones
+# ---------------------------------------------------------------------------
+
+class TestCookiesPersistentes:
+    def _jar(self, *cookies):
+        import requests
+        jar = requests.cookies.RequestsCookieJar()
+        for nombre, expires in cookies:
+            jar.set_cookie(requests.cookies.create_cookie(
+                nombre, f"valor-{nombre}", domain='.amazon.es', path='/', expires=expires
+            ))
+        return jar
+
+    def test_guarda_y_recarga(self, tmp_path):
+        import requests
+        ruta = str(tmp_path / 'cookies.json')
+        futuro = int(core.time.time()) + 3600
+        assert core.guardar_cookies(ruta, self._jar(('session-id', futuro), ('ubid-acbes', futuro))) == 2
+
+        jar = requests.cookies.RequestsCookieJar()
+        assert core.cargar_cookies(ruta, jar) == 2
+        assert jar.get('session-id', domain='.amazon.es') == 'valor-session-id'
+        assert next(iter(jar)).expires == futuro
+
+    def test_no_guarda_cookies_de_sesion_ni_caducadas(self, tmp_path):
+        ruta = str(tmp_path / 'cookies.json')
+        pasado = int(core.time.time()) - 10
+        assert core.guardar_cookies(ruta, self._jar(('sin-expires', None), ('caducada', pasado))) == 0
+
+    def test_descarta_al_cargar_las_que_han_caducado(self, tmp_path, monkeypatch):
+        import requests
+        ruta = str(tmp_path / 'cookies.json')
+        ahora = core.time.time()
+        core.guardar_cookies(ruta, self._jar(('corta', int(ahora) + 60), ('larga', int(ahora) + 7200)))
+
+        monkeypatch.setattr(core, 'reloj_pared', lambda: ahora + 600)
+        jar = requests.cookies.RequestsCookieJar()
+        assert core.cargar_cookies(ruta, jar) == 1
+        assert [c.name for c in jar] == ['larga']
+
+    def test_fichero_inexistente_o_corrupto(self, tmp_path):
+        assert core.cargar_cookies(str(tmp_path / 'no_existe.json')) == 0
+        corrupto = tmp_path / 'cookies.json'
+        corrupto.write_text("{no json")
+        assert core.cargar_cookies(str(corrupto)) == 0
+
+    def test_main_carga_y_guarda_cookies(self, monkeypatch, tmp_path):
+        llamadas = []
+        monkeypatch.setattr(bot, 'COOKIES_BEBE_FILE', str(tmp_path / 'cookies_bebe.json'))
+        monkeypatch.setattr(bot, 'BADGES_BEBE_FILE', str(tmp_path / 'badges_bebe.json'))
+        monkeypatch.setattr(bot, 'ITEMS_BEBE_FILE', str(tmp_path / 'items_bebe.json'))
+        monkeypatch.setattr(bot, 'cargar_cookies', lambda ruta: llamadas.append(('cargar', ruta)))
+        monkeypatch.setattr(bot, 'guardar_cookies', lambda ruta: llamadas.append(('guardar', ruta)))
+        monkeypatch.setattr(bot, 'buscar_y_publicar_ofertas', lambda: llamadas.append(('buscar', None)))
+
+        bot.main()
+
+        ruta = str(tmp_path / 'cookies_bebe.json')
+        assert llamadas == [('cargar', ruta), ('buscar', None), ('guardar', ruta)]
+
+
+# ---------------------------------------------------------------------------
+# Huella de resultados por categoria
+# ---------------------------------------------------------------------------
+
+class TestHuellaResultados:
+    def test_misma_pagina_misma_huella(self):
+        assert core.huella_resultados(_html_con_resultados(5)) == core.huella_resultados(_html_con_resultados(5))
+
+    def test_ignora_cambios_fuera_de_asin_precio_y_descuento(self):
+        html = _html_con_resultados(5)
+        otra = html.replace('class="s-card"', 'class="s-card s-card-nueva"').replace('/1.jpg', '/1b.jpg')
+        assert core.huella_resultados(html) == core.huella_resultados(otra)
+
+    def test_cambia_con_precio_descuento_u_orden(self):
+        html = _html_con_resultados(5)
+        base = core.huella_resultados(html)
+        assert core.huella_resultados(html.replace('12,00€', '11,50€')) != base
+        assert core.huella_resultados(html.replace('-30%', '-35%', 1)) != base
+        assert core.huella_resultados(html.replace('B000000000', 'BXXXXXXXXX')) != base
+
+    def test_solo_cuenta_los_primeros_resultados(self):
+        html = _html_con_resultados(30)
+        cambiado = html.replace('B000000025', 'BXXXXXXXXX')
+        assert core.huella_resultados(html) == core.huella_resultados(cambiado)
+
+    def test_sin_resultados(self):
+        assert core.huella_resultados("<html>mock</html>") is None
+        assert core.huella_resultados(None) is None
+
+    def test_se_guardan_fuera_del_historial(self, tmp_path):
+        ruta = str(tmp_path / 'cache' / 'huellas_bebe.json')
+        huellas = {'Panales': {'huella': 'abc', 'ofertas': [make_producto()]}}
+        core.guardar_huellas_categorias(ruta, huellas)
+        assert core.cargar_huellas_categorias(ruta) == huellas
+        assert core.cargar_huellas_categorias(str(tmp_path / 'no_existe.json')) == {}
+        assert core.ruta_huellas_categorias('bebe').startswith(core.CACHE_DIR)
+
+        # Los historiales de antes, con las huellas dentro, siguen cargando
+        deals_file = tmp_path / 'deals.json'
+        ts = datetime.now().isoformat()
+        deals_file.write_text(json.dumps({'B001': ts, '_huellas_categorias': huellas}))
+        deals, _, _, _ = core.load_posted_deals(str(deals_file))
+        assert deals == {'B001': ts}
+
+    def test_escritura_fallida_conserva_el_fichero_anterior(self, monkeypatch, tmp_path):
+        ruta = str(tmp_path / 'huellas_bebe.json')
+        core.guardar_huellas_categorias(ruta, {'Panales': {'huella': 'abc', 'ofertas': []}})
+
+        def replace_fallido(origen, destino):
+            raise OSError("disco lleno")
+
+        monkeypatch.setattr(core.os, 'replace', replace_fallido)
+        core.guardar_huellas_categorias(ruta, {'Panales': {'huella': 'def', 'ofertas': []}})
+        assert core.cargar_huellas_categorias(ruta)['Panales']['huella'] == 'abc'
+        assert [p.name for p in tmp_path.iterdir()] == ['huellas_bebe.json']
+
+    def test_cambia_con_la_configuracion_de_extraccion(self, monkeypatch):
+        html = _html_con_resultados(3)
+        base = core.huella_resultados(html)
+        monkeypatch.setattr(core, 'VERSION_EXTRACCION', core.VERSION_EXTRACCION + 1)
+        assert core.huella_resultados(html) != base
+        monkeypatch.undo()
+        monkeypatch.setattr(core, 'EXTRACCION_PEREZOSA', not core.EXTRACCION_PEREZOSA)
+        assert core.huella_resultados(html) != base
+
+    def _canal(self, monkeypatch, tmp_path, html):
+        monkeypatch.setattr(bot, 'POSTED_BEBE_DEALS_FILE', str(tmp_path / 'deals.json'))
+        monkeypatch.setattr(bot, 'TELEGRAM_BOT_TOKEN', 'mock_token')
+        monkeypatch.setattr(bot, 'TELEGRAM_CHAT_ID', 'mock_chat_id')
+        monkeypatch.setattr(bot, 'CATEGORIAS_BEBE', [make_categoria()])
+        monkeypatch.setattr(bot, 'obtener_paginas', lambda urls, obtener: [html] * len(urls))
+        monkeypatch.setattr(bot, 'obtener_pagina', lambda url: None)
+        monkeypatch.setattr(bot, 'send_telegram_photo', lambda url, msg: True)
+        monkeypatch.setattr(bot, 'send_telegram_message', lambda msg: True)
+
+    def test_canal_reutiliza_ranking_si_no_cambian_los_resultados(self, monkeypatch, tmp_path):
+        # Suficientes candidatos en la primera pagina para no pedir la segunda
+        html = _html_con_resultados(core.CANDIDATOS_POR_CATEGORIA + 2)
+        self._canal(monkeypatch, tmp_path, html)
+        extracciones = []
+        extraer_real = bot.extraer_productos_busqueda
+        monkeypatch.setattr(bot, 'extraer_productos_busqueda', lambda h: extracciones.append(h) or extraer_real(h))
+
+        assert bot.buscar_y_publicar_ofertas() == 1
+        assert len(extracciones) == 1
+        guardadas = core.cargar_huellas_categorias(bot.HUELLAS_BEBE_FILE)
+        assert guardadas['Panales']['huella'] == core.huella_resultados(html)
+        with open(bot.POSTED_BEBE_DEALS_FILE) as f:
+            assert '_huellas_categorias' not in json.load(f)
+
+        # Segunda ejecucion con la misma pagina: no se extrae, y el ya publicado se descarta
+        assert bot.buscar_y_publicar_ofertas() == 1
+        assert len(extracciones) == 1
+        publicados, _, _, _ = bot.load_posted_deals()
+        assert len(publicados) == 2
+
+    def test_no_reutiliza_rankings_con_paginas_extra(self, monkeypatch, tmp_path):
+        html = _html_con_resultados(3)
+        self._canal(monkeypatch, tmp_path, html)
+        extracciones = []
+        extraer_real = bot.extraer_productos_busqueda
+        monkeypatch.setattr(bot, 'extraer_productos_busqueda', lambda h: extracciones.append(h) or extraer_real(h))
+
+        bot.buscar_y_publicar_ofertas()
+        assert core.cargar_huellas_categorias(bot.HUELLAS_BEBE_FILE)['Panales']['paginas'] == 2
+        bot.buscar_y_publicar_ofertas()
+        assert len(extracciones) == 2
+
+    def test_ranking_reutilizable_exige_candidatos_suficientes(self):
+        ofertas = [make_producto(asin=f"B{i:09d}") for i in range(3)]
+        previa = {'huella': 'h', 'paginas': 1, 'ofertas': ofertas}
+        assert core.ranking_reutilizable(previa, 'h', objetivo=3) == ofertas
+        assert core.ranking_reutilizable(previa, 'otra', objetivo=3) is None
+        assert core.ranking_reutilizable({**previa, 'paginas': 2}, 'h', objetivo=3) is None
+        # Con un candidato ya publicado ahora tocaria pedir la pagina 2
+        assert core.ranking_reutilizable(previa, 'h', lambda p: p['asin'] != "B000000000", objetivo=3) is None
+        assert core.ranking_reutilizable(previa, 'h', lambda p: False, objetivo=3, max_paginas=1) == ofertas
+
+    def test_huellas_se_guardan_sin_nada_que_publicar(self, monkeypatch, tmp_path):
+        html = _html_con_resultados(3)
+        self._canal(monkeypatch, tmp_path, html)
+        monkeypatch.setattr(bot, 'CATEGORIAS_BEBE', [make_categoria(), make_categoria(nombre="Toallitas", url="/s?k=toallitas")])
+        core.guardar_huellas_categorias(bot.HUELLAS_BEBE_FILE, {
+            'Toallitas': {'huella': 'vieja', 'paginas': 1, 'ofertas': []},
+            'Borrada': {'huella': 'vieja', 'paginas': 1, 'ofertas': []},
+        })
+        monkeypatch.setattr(bot, 'obtener_paginas', lambda urls, obtener: [html, None])
+        # Todos los productos ya publicados: "No hay ofertas nuevas"
+        ts = datetime.now().isoformat()
+        core.save_posted_deals({f"B{i:09d}": ts for i in range(3)}, bot.POSTED_BEBE_DEALS_FILE)
+
+        assert bot.buscar_y_publicar_ofertas() == 0
+        guardadas = core.cargar_huellas_categorias(bot.HUELLAS_BEBE_FILE)
+        assert guardadas['Panales']['huella'] == core.huella_resultados(html)
+        assert guardadas['Toallitas']['huella'] == 'vieja'
+        assert 'Borrada' not in guardadas
+
+
+# ---------------------------------------------------------------------------
+# Backends de parseo (lxml / html.parser)
+# ---------------------------------------------------------------------------
+
+class TestBackendsParser:
+    @pytest.fixture(autouse=True)
+    def sin_cache_items(self, monkeypatch):
+        # Sin la cache de resultados, la segunda extraccion saldria de la primera
+        monkeypatch.setattr(core, 'CACHE_ITEMS_MAX', 0)
+
+    def _paginas(self):
+        return [
+            _html_con_producto(),
+            _html_con_producto(descuento_badge=None, precio_actual="9,99€", precio_anterior="19,99€"),
+            _html_con_producto(titulo="Crema &amp; toallitas &quot;bebé&quot;&nbsp;pack", valoraciones="12.345"),
+            _html_con_resultados(25),
+            # HTML descuidado: etiquetas sin cerrar, atributos sin comillas, comentarios y scripts
+            '<html><body><div data-component-type="s-search-result" data-asin="B0SUCIO001"><p>intro'
+            '<h2><a href=/dp/x><span>Biberón anticólicos <b>260ml</span></a></h2>'
+            '<!-- comentario --><script>var a = "<div>";</script>'
+            '<span class="a-price" data-a-color=base><span class="a-offscreen">7,49€</span></span>'
+            '<span class="a-price a-text-price" data-a-strike=true><span class=a-offscreen>9,99€</span></span>'
+            '<img class=s-image src="https://x/y.jpg"></div></body></html>',
+            # Fragmento suelto, como el que pasan las prereservas de PS
+            str(core.parsear_html(_html_con_producto(), 'html.parser').select_one('[data-asin]')),
+        ]
+
+    def test_por_defecto_lxml_si_esta_instalado(self):
+        assert core.PARSER_HTML in ('lxml', 'html.parser')
+        if core.lxml is not None and not os.getenv('PARSER_HTML'):
+            assert core.PARSER_HTML == 'lxml'
+
+    def test_lxml_y_html_parser_extraen_lo_mismo(self):
+        pytest.importorskip('lxml')
+        for html in self._paginas():
+            assert core.extraer_productos_busqueda(html, parser='lxml') == \
+                core.extraer_productos_busqueda(html, parser='html.parser')
+
+    def test_filtro_de_resultados_no_cambia_los_nodos(self):
+        for parser in ('lxml', 'html.parser') if core.lxml is not None else ('html.parser',):
+            for html in self._paginas():
+                completos = core.parsear_html(html, parser).select(core.SELECTOR_RESULTADO)
+                filtrados = core.obtener_items_busqueda(html, parser)
+                assert [str(n) for n in filtrados] == [str(n) for n in completos]
+
+    def test_filtro_descarta_el_resto_de_la_pagina(self):
+        html = '<html><head><script>x()</script></head><body><nav><a>menu</a></nav>' + \
+            _html_con_resultados(2) + '<footer>pie</footer></body></html>'
+        soup = core.parsear_html(html, parse_only=core.FILTRO_RESULTADOS)
+        assert soup.find('nav') is None and soup.find('script') is None and soup.find('footer') is None
+        assert len(soup.select(core.SELECTOR_RESULTADO)) == 2
+
+
+# ---------------------------------------------------------------------------
+# Extractor rapido (selectolax) con vuelta a BeautifulSoup por item
+# ---------------------------------------------------------------------------
+
+class TestExtractorRapido:
+    @pytest.fixture(autouse=True)
+    def _requiere_selectolax(self):
+        if core.LexborHTMLParser is None:
+            pytest.skip("selectolax no instalado")
+
+    def _paginas(self):
+        html_largo = _html_con_resultados(30)
+        lector = core.LectorResultados()
+        lector.alimentar(html_largo[:len(html_largo) // 2])
+        return TestBackendsParser()._paginas() + [
+            _html_con_producto(titulo="T" * 150, valoraciones="1,234"),
+            _html_con_producto(descuento_badge=None, precio_anterior="12,99€"),
+            # Prefijo cortado a mitad de un resultado, como el que deja la lectura en streaming
+            lector.texto(),
+            HTML_ITEM_ENREVESADO,
+            '<html><body><div data-component-type="s-search-result" data-asin="B0CUPON001">'
+            '<h2><span>Leche en polvo</span></h2><span class="s-coupon-unclipped">Cupón</span>'
+            '<span class="a-price"><span class="a-offscreen">20,00€</span></span>'
+            '<span class="a-price" data-a-strike="true"><span class="a-offscreen">25,00€</span></span>'
+            '<span class="a-badge-text">Oferta</span><span class="s-coupon-highlight-color">Ahorra 15 %</span>'
+            '<span class="a-size-base a-color-secondary">2K+ comprados el mes pasado</span>'
+            '</div></body></html>',
+        ]
+
+    def test_misma_salida_que_beautifulsoup(self):
+        parsers = ('lxml', 'html.parser') if core.lxml is not None else ('html.parser',)
+        for html in self._paginas():
+            rapido = core.extraer_productos_busqueda_rapido(html)
+            for parser in parsers:
+                assert rapido == core.extraer_productos_busqueda_bs4(html, parser)
+
+    def test_es_el_extractor_por_defecto(self, monkeypatch):
+        monkeypatch.setattr(core, 'EXTRACCION_RAPIDA', True)
+        monkeypatch.setattr(core, 'extraer_productos_busqueda_rapido', lambda html, claves=None: ['rapido'])
+        assert core.extraer_productos_busqueda("<html></html>") == ['rapido']
+        assert core.extraer_productos_busqueda("<html></html>", parser='html.parser') == []
+        monkeypatch.setattr(core, 'EXTRACCION_RAPIDA', False)
+        assert core.extraer_productos_busqueda("<html></html>") == []
+
+    def test_item_dudoso_se_reparsea_con_beautifulsoup(self, monkeypatch):
+        html = _html_con_producto(asin="B0BUENO001") + \
+            '<div data-component-type="s-search-result" data-asin="B0SINPRE01"><h2><span>Sin precio</span></h2></div>'
+        reparseados = []
+        original = core.obtener_items_busqueda
+
+        def espia(html_content, parser=None):
+            reparseados.append(html_content)
+            return original(html_content, parser)
+
+        monkeypatch.setattr(core, 'obtener_items_busqueda', espia)
+        productos = core.extraer_productos_busqueda_rapido(html)
+
+        assert [p['asin'] for p in productos] == ["B0BUENO001", "B0SINPRE01"]
+        assert len(reparseados) == 1 and 'B0SINPRE01' in reparseados[0]
+        assert productos[1]['precio'] == "N/A"
+
+
+# ---------------------------------------------------------------------------
+# Recorrido de una sola pasada por item
+# ---------------------------------------------------------------------------
+
+HTML_ITEM_ENREVESADO = """
+<div data-component-type="s-search-result" data-asin="B0ENREV001">
+  <span class="a-size-base a-color-secondary">Patrocinado</span>
+  <h2><span>Marca</span><a href="/dp/B0ENREV001"><span>Título <b>real</b></span></a></h2>
+  <div class="a-price" data-a-color="secondary"><span class="a-offscreen">5,00€</span></div>
+  <div class="a-row">
+    <span class="a-price"><span class="a-offscreen">8,99€</span></span>
+    <span class="a-price" data-a-color="base"><span><span class="a-offscreen">9,99€</span></span></span>
+    <span class="a-price a-text-price" data-a-strike="true"><span class="a-offscreen">14,99€</span></span>
+  </div>
+  <span class="a-badge-text">Oferta flash</span>
+  <span class="xsavingsPercentageBadge">-33 %</span>
+  <span class="s-coupon-clipped">Cupón</span>
+  <i aria-label="4,5 de 5 estrellas"></i>text<span>1.234</span>
+  <span class="a-size-base a-color-secondary">5K+ comprados el mes pasado</span>
+  <img class="s-image" src="https://x/img.jpg">
+</div>
+"""
+
+
+class TestRecorrerItem:
+    def _items(self):
+        paginas = TestBackendsParser()._paginas() + [HTML_ITEM_ENREVESADO]
+        for html in paginas:
+            for parser in ('lxml', 'html.parser') if core.lxml is not None else ('html.parser',):
+                yield from core.obtener_items_busqueda(html, parser)
+
+    def test_equivale_a_select_one(self):
+        selectores = [
+            core.SEL_TITULO, core.SEL_TITULO_ALT, core.SEL_PRECIO, core.SEL_PRECIO_ALT,
+            core.SEL_PRECIO_ANTERIOR, core.SEL_CUPON, core.SEL_VALORACIONES,
+            core.SEL_VALORACIONES_ALT, core.SEL_VENTAS, core.SEL_IMAGEN, *core.BADGE_SELECTORS,
+        ]
+        for item in self._items():
+            campos = core._recorrer_item(item)
+            for selector in selectores:
+                assert campos.get(selector) is item.select_one(selector), selector
+
+    def test_item_enrevesado(self, monkeypatch):
+        monkeypatch.setattr(core, 'EXTRACCION_PEREZOSA', False)
+        productos = core.extraer_productos_busqueda_bs4(HTML_ITEM_ENREVESADO, 'html.parser')
+        assert len(productos) == 1
+        p = productos[0]
+        assert p['titulo'] == "Títuloreal"
+        assert p['precio'] == "9,99€"
+        assert p['precio_anterior'] == "14,99€"
+        assert p['descuento'] == 33.0
+        assert p['valoraciones'] == 1234
+        assert p['tiene_oferta'] is False  # cupon
+
+
+# ---------------------------------------------------------------------------
+# Producto compacto con precios en centimos
+# ---------------------------------------------------------------------------
+
+class TestProducto:
+    def _producto(self, **cambios):
+        campos = dict(
+            asin="B0PROD0001", titulo="Cuna de viaje", precio="1.299,99€", precio_anterior="1.599,00€",
+            descuento=19.0, valoraciones=10, ventas=0, imagen="", url="https://x/dp/B0PROD0001",
+            tiene_oferta=True,
+        )
+        campos.update(cambios)
+        return core.Producto(**campos)
+
+    @pytest.mark.parametrize("texto,esperado", [
+        ("29,99€", 2999),
+        ("1.299,00 €", 129900),
+        ("5€", 500),
+        ("12,5\xa0€", 1250),
+        ("N/A", None),
+        (None, None),
+    ])
+    def test_precio_a_centimos(self, texto, esperado):
+        assert core.precio_a_centimos(texto) == esperado
+
+    def test_se_comporta_como_dict(self):
+        p = self._producto()
+        assert p['precio'] == "1.299,99€"
+        assert p.get('variantes_adicionales', []) == []
+        assert p == dict(p)
+        assert list(p) == list(core.Producto.CAMPOS)
+        assert json.loads(json.dumps(dict(p)))['asin'] == "B0PROD0001"
+        assert p.precio_cent == 129999 and p.precio_anterior_cent == 159900
+        with pytest.raises(AttributeError):
+            p.otro = 1  # __slots__: sin __dict__
+
+    def test_copia_y_claves_extra(self):
+        p = self._producto()
+        copia = p.copy()
+        copia['variantes_adicionales'] = [{'asin': 'B0OTRA0001'}]
+        copia['precio'] = "9,99€"
+        assert 'variantes_adicionales' not in p and p['precio'] == "1.299,99€"
+        assert copia['variantes_adicionales'][0]['asin'] == 'B0OTRA0001'
+        assert copia.precio_cent == 999 and len(copia) == len(core.Producto.CAMPOS) + 1
+
+    def test_extractor_devuelve_productos_con_centimos(self, monkeypatch):
+        monkeypatch.setattr(core, 'EXTRACCION_PEREZOSA', False)
+        p = core.extraer_productos_busqueda_bs4(HTML_ITEM_ENREVESADO, 'html.parser')[0]
+        assert isinstance(p, core.Producto)
+        assert p.precio_cent == 999 and p.precio_anterior_cent == 1499
+
+    def test_formato_usa_precios_en_centimos(self, monkeypatch):
+        # Con un Producto el formateador no vuelve a parsear los precios
+        p = self._producto()
+        monkeypatch.setattr(core, 'precio_a_centimos', lambda texto: pytest.fail("precio reparseado"))
+        mensaje = core.format_telegram_message(p, {'nombre': 'Bebe', 'emoji': '👶'})
+        assert "(-19%)" in mensaje
+
+    def test_prioridad_marca_memorizada(self):
+        core._prioridad_marca.cache_clear()
+        for _ in range(3):
+            assert core.obtener_prioridad_marca("Pañales DODOT talla 3", ["Dodot"]) == 1
+        info = core._prioridad_marca.cache_info()
+        assert info.misses == 1 and info.hits == 2
+
+
+# ---------------------------------------------------------------------------
+# Estadisticas de los selectores de badge
+# ---------------------------------------------------------------------------
+
+HTML_DOS_BADGES = """
+<div data-component-type="s-search-result" data-asin="B0BADGE001">
+  <h2><a href="/dp/B0BADGE001"><span>Producto con dos badges</span></a></h2>
+  <span class="a-price" data-a-color="base"><span class="a-offscreen">10,00€</span></span>
+  <span class="a-price" data-a-strike="true"><span class="a-offscreen">14,00€</span></span>
+  <span class="a-badge-text">-20%</span>
+  <span class="s-coupon-highlight-color">-30%</span>
+</div>
+"""
+
+
+class TestEstadisticasBadges:
+    @pytest.fixture(autouse=True)
+    def estadisticas_limpias(self, monkeypatch):
+        monkeypatch.setattr(core, '_estadisticas_badges', {'items': 0, 'aciertos': dict.fromkeys(core.BADGE_SELECTORS, 0)})
+        monkeypatch.setattr(core, '_badges_ejecucion', {'items': 0, 'aciertos': dict.fromkeys(core.BADGE_SELECTORS, 0)})
+        monkeypatch.setattr(core, 'CACHE_ITEMS_MAX', 0)
+
+    def test_vale_el_primer_selector_con_porcentaje(self):
+        assert core.extraer_productos_busqueda_bs4(HTML_DOS_BADGES, 'html.parser')[0]['descuento'] == 20.0
+        resumen = core.resumen_badges()
+        assert resumen['items'] == 1
+        assert resumen['aciertos']['.a-badge-text'] == 1
+        assert resumen['aciertos']['.s-coupon-highlight-color'] == 0
+
+    def test_para_al_primer_acierto(self, monkeypatch):
+        probados = []
+        producto_real = core._producto_desde_item
+
+        def producto_desde_item(asin, texto, *args, **kwargs):
+            return producto_real(asin, lambda sel: probados.append(sel) or texto(sel), *args, **kwargs)
+
+        monkeypatch.setattr(core, '_producto_desde_item', producto_desde_item)
+        core.extraer_productos_busqueda_bs4(HTML_DOS_BADGES, 'html.parser')
+        assert [sel for sel in probados if sel in core.BADGE_SELECTORS] == ['.savingsPercentage', '.a-badge-text']
+
+    def test_selectolax_anota_cada_item_una_vez(self):
+        if core.LexborHTMLParser is None:
+            pytest.skip("selectolax no instalado")
+        sin_precio = HTML_DOS_BADGES.replace(
+            '<span class="a-price" data-a-color="base"><span class="a-offscreen">10,00€</span></span>', '')
+        assert sin_precio != HTML_DOS_BADGES
+        core.extraer_productos_busqueda_rapido(HTML_DOS_BADGES)
+        # La via rapida no encuentra el precio y el item se repite con BeautifulSoup
+        core.extraer_productos_busqueda_rapido(sin_precio)
+        resumen = core.resumen_badges()
+        assert resumen['items'] == 2
+        assert resumen['aciertos']['.a-badge-text'] == 2
+
+    def test_persistencia_y_decaimiento(self, tmp_path, monkeypatch):
+        ruta = str(tmp_path / 'badges.json')
+        monkeypatch.setattr(core, 'MAX_ITEMS_BADGES', 10)
+        core._estadisticas_badges.update({'items': 40, 'aciertos': {**dict.fromkeys(core.BADGE_SELECTORS, 0), '.a-badge-text': 30}})
+        assert core.guardar_estadisticas_badges(ruta) == 20
+
+        core._estadisticas_badges.update({'items': 0, 'aciertos': dict.fromkeys(core.BADGE_SELECTORS, 0)})
+        assert core.cargar_estadisticas_badges(ruta) == 20
+        assert core._estadisticas_badges['aciertos']['.a-badge-text'] == 15
+
+    def test_fichero_corrupto_se_ignora(self, tmp_path):
+        corrupto = tmp_path / 'badges.json'
+        corrupto.write_text('{"items": "x"}')
+        assert core.cargar_estadisticas_badges(str(corrupto)) == 0
+        assert core.cargar_estadisticas_badges(str(tmp_path / 'no_existe.json')) == 0
+
+    def test_resumen_avisa_si_ningun_badge(self, caplog):
+        core._badges_ejecucion['items'] = core.MIN_ITEMS_AVISO_BADGES
+        with caplog.at_level('WARNING'):
+            resumen = core.log_resumen_badges()
+        assert resumen['items'] == core.MIN_ITEMS_AVISO_BADGES
+        assert "Ningun selector de badge" in caplog.text
+        assert core.resumen_badges()['items'] == 0
+
+    def test_main_carga_y_guarda_estadisticas(self, monkeypatch, tmp_path):
+        llamadas = []
+        ruta = str(tmp_path / 'badges_bebe.json')
+        monkeypatch.setattr(bot, 'BADGES_BEBE_FILE', ruta)
+        monkeypatch.setattr(bot, 'ITEMS_BEBE_FILE', str(tmp_path / 'items_bebe.json'))
+        monkeypatch.setattr(bot, 'cargar_cookies', lambda r: None)
+        monkeypatch.setattr(bot, 'guardar_cookies', lambda r: None)
+        monkeypatch.setattr(bot, 'cargar_estadisticas_badges', lambda r: llamadas.append(('cargar', r)))
+        monkeypatch.setattr(bot, 'guardar_estadisticas_badges', lambda r: llamadas.append(('guardar', r)))
+        monkeypatch.setattr(bot, 'buscar_y_publicar_ofertas', lambda: llamadas.append(('buscar', None)))
+
+        bot.main()
+
+        assert llamadas == [('cargar', ruta), ('buscar', None), ('guardar', ruta)]
+
+
+# ---------------------------------------------------------------------------
+# Extraccion desde datos estructurados (JSON embebido y aria-label)
+# ---------------------------------------------------------------------------
+
+HTML_ITEM_ESTRUCTURADO = """
+<div data-component-type="s-search-result" data-asin="B0JSON0001">
+  <h2><a href="/dp/B0JSON0001"><span>Trona evolutiva</span></a></h2>
+  <script type="application/json">{"asin": "B0JSON0001", "offer": {"priceAmount": 1299.9, "basisPrice": {"amount": 1599}}}</script>
+  <script type="application/json">{no es json</script>
+  <span class="a-price" data-a-color="base"><span class="a-offscreen">1,00€</span></span>
+  <span class="a-price" data-a-strike="true"><span class="a-offscreen">2,00€</span></span>
+  <a aria-label="2.345 valoraciones" href="#"><span class="a-size-base s-underline-text">9</span></a>
+</div>
+"""
+
+
+class TestDatosEstructurados:
+    def _extraer(self):
+        productos = [core.extraer_productos_busqueda_bs4(HTML_ITEM_ESTRUCTURADO, 'html.parser')[0]]
+        if core.LexborHTMLParser is not None:
+            productos.append(core.extraer_productos_busqueda_rapido(HTML_ITEM_ESTRUCTURADO)[0])
+        return productos
+
+    def test_precio_del_dom_primero_y_valoraciones_del_aria_label(self):
+        for p in self._extraer():
+            assert p['precio'] == "1,00€" and p['precio_anterior'] == "2,00€"
+            assert p['valoraciones'] == 2345
+
+    def test_sin_precio_en_el_dom_usa_el_json(self):
+        html = HTML_ITEM_ESTRUCTURADO.replace(
+            '<span class="a-price" data-a-color="base"><span class="a-offscreen">1,00€</span></span>', '')
+        p = core.extraer_productos_busqueda_bs4(html, 'html.parser')[0]
+        assert p['precio'] == "1.299,90€" and p.precio_cent == 129990
+        assert p['precio_anterior'] == "1.599,00€"
+        assert p['descuento'] == pytest.approx(18.7, abs=0.1)
+
+        # Sin tachado en el JSON, el del DOM (2,00€) no es descuento sobre 1.299,90€
+        p = core.extraer_productos_busqueda_bs4(html.replace(', "basisPrice": {"amount": 1599}', ''), 'html.parser')[0]
+        assert p['precio'] == "1.299,90€"
+        assert p['precio_anterior'] is None
+
+    def test_ofertas_de_otros_vendedores_no_crean_descuento(self):
+        html = HTML_ITEM_ESTRUCTURADO.replace(
+            '{"asin": "B0JSON0001", "offer": {"priceAmount": 1299.9, "basisPrice": {"amount": 1599}}}',
+            '{"asin": "B0JSON0001", "offers": [{"price": 7.0, "listPrice": 15}], "listPrice": 15}',
+        ).replace('<span class="a-price" data-a-strike="true"><span class="a-offscreen">2,00€</span></span>', '')
+        p = core.extraer_productos_busqueda_bs4(html, 'html.parser')[0]
+        assert p['precio'] == "1,00€" and not p['tiene_oferta']
+
+    def test_desactivada_usa_solo_selectores(self, monkeypatch):
+        monkeypatch.setattr(core, 'EXTRACCION_ESTRUCTURADA', False)
+        for p in self._extraer():
+            assert p['precio'] == "1,00€" and p['precio_anterior'] == "2,00€" and p['valoraciones'] == 9
+
+    @pytest.mark.parametrize("bloques,aria,asin,esperado", [
+        (['{"displayPrice": "29,99 €"}'], None, None, {'precio_cent': 2999}),
+        (['[{"asin": "B1", "ratingCount": "1.024"}]'], None, None, {'valoraciones': 1024}),
+        (['{"x": {"ratingCount": 5}, "listPrice": 15, "price": 9}'], None, None, {}),
+        (['{"asin": "B2", "priceAmount": 9}'], None, "B1", {}),
+        (['{"priceAmount": true}', 'null'], "87 valoraciones", None, {'valoraciones': 87}),
+        ([], "4,5 de 5 estrellas", None, {}),
+    ])
+    def test_datos_estructurados(self, bloques, aria, asin, esperado):
+        assert core.datos_estructurados(bloques, aria, asin) == esperado
+
+    def test_centimos_a_texto(self):
+        assert core.centimos_a_texto(2999) == "29,99€"
+        assert core.centimos_a_texto(129905) == "1.299,05€"
+        assert core.precio_a_centimos(core.centimos_a_texto(129905)) == 129905
+
+
+# ---------------------------------------------------------------------------
+# Enriquecimiento de los ganadores con la pagina /dp/
+# ---------------------------------------------------------------------------
+
+HTML_DETALLE = """
+<html><body>
+<div id="corePriceDisplay_desktop_feature_div">
+  <span class="savingsPercentage">-40%</span>
+  <span class="a-price priceToPay"><span class="a-offscreen">11,99€</span></span>
+  <span class="basisPrice"><span class="a-price"><span class="a-offscreen">19,99€</span></span></span>
+</div>
+<span id="acrCustomerReviewText">2.001 valoraciones</span>
+<span id="social-proofing-faceout-title-tk_bought">5K+ comprados el mes pasado</span>
+</body></html>
+"""
+
+
+class TestEnriquecimientoDetalle:
+    @pytest.fixture(autouse=True)
+    def cache_temporal(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(core, 'CACHE_DETALLE_DIR', str(tmp_path / 'detalle'))
+        monkeypatch.setattr(core, 'ENRIQUECER_DETALLE', True)
+
+    def _mejores(self, **kwargs):
+        return [{'producto': make_producto(**kwargs), 'categoria': make_categoria()}]
+
+    def _descargar(self, paginas):
+        pedidas = []
+
+        def descargar(urls, max_resultados=core.MAX_RESULTADOS_BUSQUEDA, usar_cache=True):
+            # Las paginas /dp/ se piden enteras, sin el corte de las busquedas ni la cache HTTP
+            assert max_resultados == 0 and not usar_cache
+            pedidas.extend(urls)
+            return [paginas.get(u) for u in urls]
+        return descargar, pedidas
+
+    def test_extraer_detalle(self):
+        assert core.extraer_detalle_producto(HTML_DETALLE) == {
+            'precio': '11,99€', 'precio_anterior': '19,99€', 'descuento': 40.0,
+            'valoraciones': 2001, 'ventas': 5000,
+        }
+        assert core.extraer_detalle_producto("<html></html>") == {}
+
+    def test_completa_y_cachea_por_asin(self):
+        url = f"{core.BASE_URL}/dp/B000TEST01"
+        descargar, pedidas = self._descargar({url: HTML_DETALLE})
+        mejores = self._mejores(precio_anterior=None, descuento=6.0, ventas=0)
+
+        resultado = core.enriquecer_mejores(mejores, descargar)
+
+        p = resultado[0]['producto']
+        assert (p['precio'], p['precio_anterior'], p['descuento']) == ('11,99€', '19,99€', 40.0)
+        assert p['valoraciones'] == 1500 and p['ventas'] == 5000
+        assert mejores[0]['producto']['precio_anterior'] is None  # no muta la entrada original
+        assert pedidas == [url]
+
+        # Segunda vez: la cache esta caliente, no hay peticiones
+        assert core.enriquecer_mejores(mejores, descargar)[0]['producto']['descuento'] == 40.0
+        assert pedidas == [url]
+
+    def test_cache_caducada_vuelve_a_descargar(self, monkeypatch):
+        descargar, pedidas = self._descargar({f"{core.BASE_URL}/dp/B000TEST01": HTML_DETALLE})
+        core.enriquecer_mejores(self._mejores(), descargar)
+        monkeypatch.setattr(core, 'CACHE_DETALLE_TTL', 0)
+        core.enriquecer_mejores(self._mejores(), descargar)
+        assert len(pedidas) == 2
+
+    def test_fallo_o_bloqueo_deja_la_entrada(self):
+        url = f"{core.BASE_URL}/dp/B000TEST01"
+        for pagina in (None, core.PaginaBloqueada(url, 'captcha')):
+            descargar, pedidas = self._descargar({url: pagina})
+            mejores = self._mejores()
+            assert core.enriquecer_mejores(mejores, descargar) == mejores
+            assert core.leer_cache_detalle('B000TEST01') is None
+
+    def test_motor_async_pide_la_pagina_entera(self, monkeypatch):
+        import asyncio
+        llamadas = []
+
+        async def mock_obtener_pagina_async(url, reintentos=3, max_resultados=core.MAX_RESULTADOS_BUSQUEDA,
+                                            usar_cache=True):
+            llamadas.append((url, max_resultados, usar_cache))
+            return HTML_DETALLE
+
+        monkeypatch.setattr(core, 'obtener_pagina_async', mock_obtener_pagina_async)
+
+        def descargar(urls, max_resultados, usar_cache):
+            return asyncio.run(core.obtener_paginas_async(urls, max_resultados, usar_cache))
+
+        resultado = core.enriquecer_mejores(self._mejores(), descargar)
+        assert resultado[0]['producto']['descuento'] == 40.0
+        assert llamadas == [(f"{core.BASE_URL}/dp/B000TEST01", 0, False)]
+
+    def test_detalle_sin_descuento_descarta_la_entrada(self):
+        # En la busqueda 10/20 con badge del 50%; en /dp/ 19,50/20 sin badge
+        html = HTML_DETALLE.replace('<span class="savingsPercentage">-40%</span>', '').replace(
+            '11,99€', '19,50€').replace('19,99€', '20,00€')
+        mejores = self._mejores(precio='10,00€', precio_anterior='20,00€', descuento=50.0)
+        mejores.append({'producto': make_producto(asin='B000TEST02'), 'categoria': make_categoria()})
+        descargar, _ = self._descargar({f"{core.BASE_URL}/dp/B000TEST01": html, f"{core.BASE_URL}/dp/B000TEST02": None})
+
+        resultado = core.enriquecer_mejores(mejores, descargar)
+        assert [e['producto']['asin'] for e in resultado] == ['B000TEST02']
+
+        p = core._aplicar_detalle(mejores[0]['producto'], core.extraer_detalle_producto(html))
+        assert p['precio'] == '19,50€' and p['descuento'] == 0 and not p['tiene_oferta']
+
+    def test_detalle_sin_badge_recalcula_el_descuento(self):
+        html = HTML_DETALLE.replace('<span class="savingsPercentage">-40%</span>', '').replace('11,99€', '15,99€')
+        p = core._aplicar_detalle(make_producto(descuento=50.0), core.extraer_detalle_producto(html))
+        assert p['precio'] == '15,99€' and p['tiene_oferta']
+        assert p['descuento'] == pytest.approx(20.0, abs=0.1)
+
+    def test_no_pasa_por_la_cache_http(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(core, 'CACHE_HTTP_DIR', str(tmp_path / 'http'))
+        monkeypatch.setattr(core, 'limitador', core.LimitadorTokens(tasa=1000, rafaga=1000, jitter=0))
+        respuesta = _respuesta_streaming(HTML_DETALLE)
+        respuesta.text = HTML_DETALLE
+        monkeypatch.setattr(core.session, 'get', MagicMock(return_value=respuesta))
+        assert core.enriquecer_mejores(self._mejores())[0]['producto']['descuento'] == 40.0
+        assert not (tmp_path / 'http').exists()
+
+    def test_desactivado_no_descarga(self, monkeypatch):
+        monkeypatch.setattr(core, 'ENRIQUECER_DETALLE', False)
+        descargar, pedidas = self._descargar({})
+        mejores = self._mejores()
+        assert core.enriquecer_mejores(mejores, descargar) is mejores
+        assert pedidas == []
+
+
+# ---------------------------------------------------------------------------
+# Extraccion perezosa: esbozos para los resultados que no pueden ser oferta
+# ---------------------------------------------------------------------------
+
+class TestExtraccionPerezosa:
+    def _html(self):
+        # Resultado 1 sin precio tachado, resultado 2 con cupon
+        return _html_con_resultados(4).replace(
+            'data-a-strike="true"><span class="a-offscreen">21,00€', 'data-a-color="x"><span class="a-offscreen">21,00€'
+        ).replace('<span>Producto 2</span></a></h2>', '<span>Producto 2</span></a></h2><span class="s-coupon-unclipped">Cupón</span>')
+
+    def _extractores(self):
+        yield lambda html: core.extraer_productos_busqueda_bs4(html, 'html.parser')
+        if core.LexborHTMLParser is not None:
+            yield core.extraer_productos_busqueda_rapido
+
+    def test_esbozos_sin_campos_caros(self):
+        html = HTML_ITEM_ENREVESADO  # con cupon: nunca es oferta
+        for extraer in self._extractores():
+            p = extraer(html)[0]
+            assert p['tiene_oferta'] is False
+            assert (p['asin'], p['titulo'], p['precio']) == ("B0ENREV001", "Títuloreal", "9,99€")
+            assert (p['precio_anterior'], p['descuento'], p['valoraciones'], p['ventas'], p['imagen']) == (None, 0, 0, 0, "")
+
+    def test_mismas_ofertas_que_la_extraccion_completa(self, monkeypatch):
+        html = self._html()
+        for extraer in self._extractores():
+            perezosos = extraer(html)
+            monkeypatch.setattr(core, 'EXTRACCION_PEREZOSA', False)
+            completos = extraer(html)
+            monkeypatch.setattr(core, 'EXTRACCION_PEREZOSA', True)
+
+            assert [p['asin'] for p in perezosos] == [p['asin'] for p in completos]
+            assert [p for p in perezosos if p['tiene_oferta']] == [p for p in completos if p['tiene_oferta']]
+            assert sum(not p['tiene_oferta'] for p in perezosos) == sum(not p['tiene_oferta'] for p in completos)
+
+    def test_esbozos_no_cuentan_para_los_badges(self, monkeypatch):
+        monkeypatch.setattr(core, '_badges_ejecucion', {'items': 0, 'aciertos': dict.fromkeys(core.BADGE_SELECTORS, 0)})
+        core.extraer_productos_busqueda_bs4(HTML_ITEM_ENREVESADO, 'html.parser')
+        assert core.resumen_badges()['items'] == 0
+
+
+# ---------------------------------------------------------------------------
+# Cache de resultados ya extraidos
+# ---------------------------------------------------------------------------
+
+class TestCacheItems:
+    @pytest.fixture(autouse=True)
+    def cache_vacia(self, monkeypatch):
+        monkeypatch.setattr(core, '_caches_items', {})
+        monkeypatch.setattr(core, 'CACHE_ITEMS_MAX', 100)
+        token = core._canal_cache_items.set('')
+        yield
+        core._canal_cache_items.reset(token)
+
+    def _contar_extracciones(self, monkeypatch):
+        extraidos = []
+        original = core._producto_desde_item
+
+        def espia(asin, *args, **kwargs):
+            extraidos.append(asin)
+            return original(asin, *args, **kwargs)
+        monkeypatch.setattr(core, '_producto_desde_item', espia)
+        return extraidos
+
+    def test_pagina_sin_cambios_no_se_parsea(self, monkeypatch):
+        html = _html_con_resultados(5)
+        primera = core.extraer_productos_busqueda(html)
+        monkeypatch.setattr(core, 'obtener_items_busqueda', lambda *a, **k: pytest.fail("pagina parseada"))
+        monkeypatch.setattr(core, 'LexborHTMLParser', None)
+
+        segunda = core.extraer_productos_busqueda(html)
+
+        assert segunda == primera and len(segunda) == 5
+        assert all(isinstance(p, core.Producto) for p in segunda)
+        assert segunda[0] is not primera[0]
+
+    def test_solo_se_extraen_los_resultados_nuevos_o_cambiados(self, monkeypatch):
+        html = _html_con_resultados(4)
+        core.extraer_productos_busqueda(html)
+        extraidos = self._contar_extracciones(monkeypatch)
+
+        # Cambia el precio del resultado 2 y el uuid/qid (volatiles) de todos
+        cambiado = html.replace('12,00€', '11,00€').replace('data-asin=', 'data-uuid="x-1" data-asin=')
+        productos = core.extraer_productos_busqueda(cambiado)
+
+        assert extraidos == ["B000000002"]
+        assert productos[2]['precio'] == "11,00€"
+
+    def test_lru_con_tope(self, monkeypatch):
+        monkeypatch.setattr(core, 'CACHE_ITEMS_MAX', 3)
+        core.extraer_productos_busqueda(_html_con_resultados(5))
+        assert len(core._cache_items_canal()) == 3
+        claves = [clave for _, clave in core.claves_items(_html_con_resultados(5))]
+        assert list(core._cache_items_canal()) == claves[2:]
+
+    def test_configuracion_distinta_no_reutiliza(self, monkeypatch):
+        html = _html_con_resultados(2)
+        core.extraer_productos_busqueda(html)
+        monkeypatch.setattr(core, 'EXTRACCION_PEREZOSA', False)
+        extraidos = self._contar_extracciones(monkeypatch)
+        core.extraer_productos_busqueda(html)
+        assert len(extraidos) == 2
+
+    def test_persistencia(self, tmp_path):
+        ruta = str(tmp_path / 'items.json')
+        primera = core.extraer_productos_busqueda(_html_con_resultados(3))
+        assert core.guardar_cache_items(ruta) == 3
+
+        core._cache_items_canal().clear()
+        assert core.cargar_cache_items(ruta) == 3
+        assert core.extraer_productos_busqueda(_html_con_resultados(3)) == primera
+
+        (tmp_path / 'corrupto.json').write_text('[1, 2')
+        assert core.cargar_cache_items(str(tmp_path / 'corrupto.json')) == 0
+        assert core.cargar_cache_items(str(tmp_path / 'no_existe.json')) == 0
+
+    def test_desactivada(self, monkeypatch):
+        monkeypatch.setattr(core, 'CACHE_ITEMS_MAX', 0)
+        core.extraer_productos_busqueda(_html_con_resultados(2))
+        assert len(core._cache_items_canal()) == 0
+
+    def test_una_cache_por_canal(self, tmp_path, monkeypatch):
+        ruta_bebe, ruta_ps = str(tmp_path / 'items_bebe.json'), str(tmp_path / 'items_ps.json')
+        core.usar_cache_items('bebe')
+        core.extraer_productos_busqueda(_html_con_resultados(3))
+        core.usar_cache_items('ps')
+        core.extraer_productos_busqueda(_html_con_resultados(2).replace('B0000', 'BPS00'))
+        assert core.guardar_cache_items(ruta_bebe, 'bebe') == 3
+        assert core.guardar_cache_items(ruta_ps, 'ps') == 2
+
+        # Cargar la de un canal no pisa la del otro
+        assert core.cargar_cache_items(ruta_bebe, 'bebe') == 3
+        assert core.cargar_cache_items(ruta_ps, 'ps') == 2
+        assert len(core._cache_items_canal('bebe')) == 3
+        assert len(core._cache_items_canal('ps')) == 2
+
+        # Las extracciones usan la cache del canal del hilo actual
+        extraidos = self._contar_extracciones(monkeypatch)
+        core.extraer_productos_busqueda(_html_con_resultados(3))
+        assert len(extraidos) == 3
+        core.usar_cache_items('bebe')
+        core.extraer_productos_busqueda(_html_con_resultados(3))
+        assert len(extraidos) == 3
+
+
+# ---------------------------------------------------------------------------
+# Indice invertido de titulos
+# ---------------------------------------------------------------------------
+
+TITULOS_HISTORIAL = [
+    "Chupete Suavinex Anatómico Silicona 0-6 meses",
+    "Chupete Philips Avent Ultra Air 6-18 meses",
+    "Juguete Fisher-Price Perrito Aprendizaje",
+    "Pañales Dodot Sensitive Talla 3",
+    "Set de 2 chupetes Suavinex Silicona",
+    "de la para con",
+]
+
+
+class TestIndiceTitulos:
+    CANDIDATOS = [
+        "Chupete Suavinex Anatómico Silicona 6-18 meses",
+        "Perrito Aprendizaje Fisher-Price Juguete",
+        "Pañales Dodot Activity Talla 4",
+        "Biberón Philips Avent Natural",
+        "para con de",
+        "",
+    ]
+
+    def test_equivale_a_comparar_uno_a_uno(self):
+        indice = core.IndiceTitulos(TITULOS_HISTORIAL)
+        for candidato in self.CANDIDATOS:
+            for umbral in (0.3, 0.5, 0.8):
+                esperado = [t for t in TITULOS_HISTORIAL if core.titulos_similares(candidato, t, umbral)]
+                assert indice.similares(candidato, umbral) == esperado, (candidato, umbral)
+            assert core.titulo_similar_a_recientes(candidato, indice) == \
+                core.titulo_similar_a_recientes(candidato, TITULOS_HISTORIAL)
+
+    def test_solo_compara_con_titulos_que_comparten_palabras(self, monkeypatch):
+        indice = core.IndiceTitulos([f"Producto numero {n} modelo{chr(97 + n % 26)}x" for n in range(2000)])
+        indice.agregar("Chupete Suavinex Silicona")
+        monkeypatch.setattr(core, 'titulos_similares', lambda *a: pytest.fail("comparacion uno a uno"))
+        assert indice.similares("Chupete Suavinex Silicona Rosa") == ["Chupete Suavinex Silicona"]
+        assert len(indice) == 2001
+
+
+# ---------------------------------------------------------------------------
+# Deteccion de reediciones (MinHash + LSH)
+# ---------------------------------------------------------------------------
+
+class TestDetectorReediciones:
+    TITULO = "Pañales Dodot Sensitive Talla 3 Recién Nacido Pack Mensual 204 unidades"
+
+    def test_estimacion_cercana_al_jaccard(self):
+        a = core.normalizar_titulo(self.TITULO)
+        b = core.normalizar_titulo("Pañales Dodot Sensitive Talla 3 Recién Nacido Pack Ahorro")
+        fa, fb = core.firma_minhash(a), core.firma_minhash(b)
+        estimado = sum(x == y for x, y in zip(fa, fb)) / core.PERMUTACIONES_MINHASH
+        assert abs(estimado - len(a & b) / len(a | b)) < 0.25
+        assert core.firma_minhash(a) == fa
+        assert core.firma_minhash(set()) is None
+
+    def test_detecta_reedicion_con_otro_asin(self):
+        detector = core.DetectorReediciones()
+        detector.agregar('B0VIEJO001', self.TITULO)
+        assert detector.reedicion_de(self.TITULO + " ") == 'B0VIEJO001'
+        assert detector.reedicion_de(self.TITULO, excluir_asin='B0VIEJO001') is None
+        assert detector.reedicion_de("Chupete Suavinex Anatómico Silicona 6-18 meses") is None
+        assert detector.reedicion_de("para con de") is None
+
+    def test_ventana_y_horizonte(self):
+        detector = core.DetectorReediciones()
+        detector.agregar('B0VIEJO001', self.TITULO, instante=datetime.now() - timedelta(days=40))
+        detector.agregar('B0ANTIGUO1', "Biberón Philips Avent Natural 260ml",
+                         instante=datetime.now() - timedelta(days=core.HORIZONTE_FIRMAS_DIAS + 1))
+        assert detector.reedicion_de(self.TITULO, desde=datetime.now() - timedelta(days=30)) is None
+        assert detector.reedicion_de(self.TITULO, desde=datetime.now() - timedelta(days=60)) == 'B0VIEJO001'
+        assert set(detector.a_json()) == {'B0VIEJO001'}
+
+    def test_se_guarda_con_el_historial(self, tmp_path):
+        ruta = str(tmp_path / 'deals.json')
+        detector = core.DetectorReediciones()
+        detector.agregar('B0VIEJO001', self.TITULO)
+        core.save_posted_deals({'B001': datetime.now().isoformat()}, ruta, firmas_titulos=detector.a_json())
+
+        deals, _, _, _ = core.load_posted_deals(ruta)
+        assert list(deals) == ['B001']
+        firmas = core.cargar_firmas_titulos(ruta)
+        assert len(firmas['B0VIEJO001'][1]) < 400
+        cargado = core.DetectorReediciones.desde_json(firmas)
+        assert cargado.reedicion_de(self.TITULO) == 'B0VIEJO001'
+        assert len(core.DetectorReediciones.desde_json({'X': ['no-fecha', '???'], 'Y': []})) == 0
+        assert core.cargar_firmas_titulos(str(tmp_path / 'no_existe.json')) == {}
+
+    def test_tallas_plataformas_y_ediciones_no_son_reedicion(self):
+        detector = core.DetectorReediciones()
+        detector.agregar('B0A', "Dodot Sensitive Pañales Talla 3 (6-10 kg), 204 Pañales, Pack Mensual")
+        detector.agregar('B1A', "EA SPORTS FC 25 Standard Edition PS5 | Videojuego | Castellano")
+        assert detector.reedicion_de("Dodot Sensitive Pañales Talla 5 (11-16 kg), 204 Pañales, Pack Mensual") is None
+        assert detector.reedicion_de("EA SPORTS FC 25 Standard Edition PS4 | Videojuego | Castellano") is None
+        assert detector.reedicion_de("EA SPORTS FC 26 Standard Edition PS5 | Videojuego | Castellano") is None
+        # Mismas tallas y cifras con otro ASIN: si es reedicion
+        assert detector.reedicion_de("EA SPORTS FC 25 Standard Edition PS5 | Videojuego | Castellano ") == 'B1A'
+        assert core.numeros_titulo("FC 25 Edition PS5, 2 mandos") == "2 25 ps5"
+
+    def test_canal_solo_descarta_en_categorias_con_verificacion_de_titulos(self, monkeypatch, tmp_path):
+        titulo = "Chupete Suavinex Anatómico Silicona Pack Rosa"
+        firmas = core.DetectorReediciones()
+        firmas.agregar('B0VIEJO001', titulo)
+        core.save_posted_deals({}, str(tmp_path / 'deals.json'), firmas_titulos=firmas.a_json())
+        monkeypatch.setattr(bot, 'POSTED_BEBE_DEALS_FILE', str(tmp_path / 'deals.json'))
+        monkeypatch.setattr(bot, 'TELEGRAM_BOT_TOKEN', 'mock_token')
+        monkeypatch.setattr(bot, 'TELEGRAM_CHAT_ID', 'mock_chat_id')
+        monkeypatch.setattr(bot, 'obtener_paginas', lambda urls, obtener: ["<html>mock</html>"] * len(urls))
+        monkeypatch.setattr(bot, 'obtener_pagina', lambda url: None)
+        monkeypatch.setattr(bot, 'extraer_productos_busqueda', lambda h: [make_producto(titulo=titulo, descuento=30.0)])
+        monkeypatch.setattr(bot, 'send_telegram_photo', lambda url, msg: True)
+        monkeypatch.setattr(bot, 'send_telegram_message', lambda msg: True)
+
+        monkeypatch.setattr(bot, 'CATEGORIAS_BEBE', [make_categoria(nombre='Chupetes')])
+        monkeypatch.setattr(bot, 'CATEGORIAS_LIMITE_SEMANAL', [])
+        assert bot.buscar_y_publicar_ofertas() == 0
+        monkeypatch.setattr(bot, 'CATEGORIAS_BEBE', [make_categoria(nombre='Panales')])
+        assert bot.buscar_y_publicar_ofertas() == 1
+
+    def test_parametros_lsh_segun_umbral(self):
+        for umbral in (0.5, 0.8, 0.9):
+            bandas, filas = core._parametros_lsh(umbral)
+            assert bandas * filas == core.PERMUTACIONES_MINHASH
+            assert (1 / bandas) ** (1 / filas) <= umbral
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark de backends de parseo para extraer_productos_busqueda
+===============================================================
+Compara, por pagina, el tiempo de parseo + extraccion y el pico de memoria
+de cada backend de BeautifulSoup instalado (lxml, html.parser, html5lib), y
+comprueba que todos devuelven exactamente los mismos productos. Incluye la
+via rapida con selectolax (extraer_productos_busqueda_rapido). Tambien mide
+la construccion del arbol completo frente a la filtrada con SoupStrainer
+(solo nodos s-search-result) que usa extraer_productos_busqueda.
+
+Ejecutar:
+  python3 benchmarks/bench_parser_html.py                    # pagina sintetica
+  python3 benchmarks/bench_parser_html.py pagina1.html ...   # paginas guardadas de Amazon
+  python3 benchmarks/bench_parser_html.py -n 20              # repeticiones por pagina
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+# Raiz del proyecto en el path para importar shared/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4.builder import builder_registry  # noqa: E402
+
+import shared.amazon_ofertas_core as core  # noqa: E402
+from shared.amazon_ofertas_core import (  # noqa: E402
+    LexborHTMLParser,
+    SELECTOR_RESULTADO,
+    extraer_productos_busqueda,
+    extraer_productos_busqueda_rapido,
+    obtener_items_busqueda,
+    parsear_html,
+)
+
+BACKENDS = ['lxml', 'html.parser', 'html5lib']
+
+# html5lib no admite parse_only: siempre construye el arbol completo
+BACKENDS_CON_FILTRO = ['lxml', 'html.parser']
+
+
+def pagina_sintetica(resultados=60, relleno_kb=300):
+    """
+    Pagina de busqueda con la estructura que espera el extractor y el peso de una
+    real: resultados con marcado anidado y bloques de script/estilos alrededor.
+    """
+    items = []
+    for i in range(resultados):
+        badge = f'<span class="savingsPercentage">-{10 + i % 40}%</span>' if i % 3 else ''
+        items.append(
+            f'<div data-component-type="s-search-result" data-asin="B0{i:08d}" class="s-result-item">'
+            f'<div class="sg-col-inner"><div class="s-widget-container"><div class="puis-card-container">'
+            f'<h2 class="a-size-base-plus"><a class="a-link-normal" href="/dp/B0{i:08d}">'
+            f'<span>Producto de prueba número {i} con un título largo como los de Amazon.es</span></a></h2>'
+            f'<div class="a-row"><span class="a-price" data-a-color="base"><span class="a-offscreen">'
+            f'{10 + i},99€</span><span aria-hidden="true">{10 + i},99€</span></span>'
+            f'<span class="a-price a-text-price" data-a-strike="true"><span class="a-offscreen">'
+            f'{30 + i},99€</span></span>{badge}</div>'
+            f'<span class="a-size-base s-underline-text">{1000 + i * 37:,}</span>'
+            f'<span class="a-size-base a-color-secondary">{i * 10}+ comprados el mes pasado</span>'
+            f'<img class="s-image" src="https://m.media-amazon.com/images/I/{i:08d}.jpg" '
+            f'srcset="https://m.media-amazon.com/images/I/{i:08d}._AC_UL320_.jpg 1x">'
+            f'</div></div></div></div>'
+        )
+    script = '<script type="text/javascript">' + ('var x = {"a": [1, 2, 3], "b": "<div>"};' * 20) + '</script>'
+    relleno = []
+    while sum(len(r) for r in relleno) < relleno_kb * 1024:
+        relleno.append(script)
+        relleno.append('<style>.a-row{margin:0}.s-image{width:100%}</style>' * 10)
+    mitad = len(relleno) // 2
+    return (
+        '<!doctype html><html lang="es-es"><head><meta charset="utf-8">' + ''.join(relleno[:mitad]) +
+        '</head><body><div class="s-main-slot s-result-list">' + ''.join(items) + '</div>' +
+        ''.join(relleno[mitad:]) + '</body></html>'
+    )
+
+
+def _medir_funcion(funcion, repeticiones):
+    """Devuelve (mediana en ms, pico de memoria en MB, resultado) de llamar a funcion()."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(tiempos) * 1000, pico / (1024 * 1024), resultado
+
+
+def medir(html_content, parser, repeticiones):
+    """Devuelve (mediana en ms, pico de memoria en MB, productos) de extraer con un backend."""
+    if parser == 'selectolax':
+        return _medir_funcion(lambda: extraer_productos_busqueda_rapido(html_content), repeticiones)
+    return _medir_funcion(lambda: extraer_productos_busqueda(html_content, parser=parser), repeticiones)
+
+
+def medir_construccion(html_content, parser, repeticiones):
+    """Compara construir el arbol completo con construir solo los nodos de resultado."""
+    completo = _medir_funcion(lambda: parsear_html(html_content, parser).select(SELECTOR_RESULTADO), repeticiones)
+    filtrado = _medir_funcion(lambda: obtener_items_busqueda(html_content, parser), repeticiones)
+    return completo[:2], filtrado[:2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de backends de parseo HTML')
+    parser.add_argument('paginas', nargs='*', help='Ficheros HTML guardados de paginas de busqueda')
+    parser.add_argument('-n', '--repeticiones', type=int, default=10, help='Repeticiones por pagina y backend')
+    args = parser.parse_args()
+
+    # Se mide la extraccion: sin la cache de resultados las repeticiones saldrian de ella
+    core.CACHE_ITEMS_MAX = 0
+
+    backends = [b for b in BACKENDS if builder_registry.lookup(b) is not None]
+    extractores = backends + (['selectolax'] if LexborHTMLParser is not None else [])
+    if args.paginas:
+        paginas = []
+        for ruta in args.paginas:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                paginas.append((os.path.basename(ruta), f.read()))
+    else:
+        paginas = [('sintetica', pagina_sintetica())]
+
+    print(f"Extractores disponibles: {', '.join(extractores)} | repeticiones: {args.repeticiones}")
+    print(f"{'pagina':<24} {'KB':>6} {'backend':<12} {'ms/pagina':>10} {'pico MB':>8} {'productos':>9}")
+    iguales = True
+    for nombre, html_content in paginas:
+        referencia = None
+        for backend in extractores:
+            ms, mb, productos = medir(html_content, backend, args.repeticiones)
+            if referencia is None:
+                referencia = productos
+            elif productos != referencia:
+                iguales = False
+            print(f"{nombre[:24]:<24} {len(html_content) // 1024:>6} {backend:<12} {ms:>10.1f} {mb:>8.1f} {len(productos):>9}")
+
+    print()
+    print(f"{'pagina':<24} {'backend':<12} {'arbol completo':>22} {'solo resultados':>22}")
+    for nombre, html_content in paginas:
+        for backend in backends:
+            if backend not in BACKENDS_CON_FILTRO:
+                continue
+            (ms_c, mb_c), (ms_f, mb_f) = medir_construccion(html_content, backend, args.repeticiones)
+            print(
+                f"{nombre[:24]:<24} {backend:<12} {ms_c:>9.1f} ms {mb_c:>6.1f} MB"
+                f" {ms_f:>9.1f} ms {mb_f:>6.1f} MB (x{ms_c / ms_f:.1f})"
+            )
+
+    if not iguales:
+        print("AVISO: los backends no devuelven los mismos productos")
+        return 1
+    print("Todos los backends devuelven los mismos productos")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
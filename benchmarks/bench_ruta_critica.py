@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la ruta critica del scraping sobre el corpus grabado
+=================================================================
+Mide sin red, sobre las paginas guardadas por grabar_corpus.py (una por cada
+categoria de CATEGORIAS_BEBE, CATEGORIAS_PS y CATEGORIAS_PRERESERVAS):
+
+  - extraer_productos_busqueda: latencia por pagina, productos/s y pico de memoria
+  - _es_prereserva_item sobre los resultados de las paginas de preórdenes
+  - agrupar_variantes sobre la mejor oferta de cada categoria
+  - format_telegram_message sobre todos los productos extraidos
+
+Si falta alguna categoria en el corpus el benchmark falla y lista las que
+faltan. Con --sintetica se miden solo las grabadas y, en lugar de las que
+faltan, una unica fila con la pagina sintetica de bench_parser_html.py. Con --guardar escribe la linea base; sin el, compara con la linea base
+existente y sale con codigo 1 si alguna medida empeora mas que --tolerancia.
+Solo se comparan medidas hechas sobre las mismas paginas (mismo sha256).
+
+Ejecutar:
+  python3 benchmarks/bench_ruta_critica.py                  # medir y comparar con la linea base
+  python3 benchmarks/bench_ruta_critica.py --guardar        # medir y guardar la linea base
+  python3 benchmarks/bench_ruta_critica.py -n 20 --tolerancia 0.1
+  python3 benchmarks/bench_ruta_critica.py --sintetica      # sin corpus grabado
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import sys
+from datetime import datetime
+
+# Raiz del proyecto en el path para importar shared/ y los canales
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_parser_html import _medir_funcion, pagina_sintetica  # noqa: E402
+from grabar_corpus import CORPUS_DIR, cargar_manifest, categorias_corpus, nombre_fichero, sha256_texto  # noqa: E402
+from ps.amazon_ps_ofertas import _es_prereserva_item  # noqa: E402
+import shared.amazon_ofertas_core as core  # noqa: E402
+from shared.amazon_ofertas_core import (  # noqa: E402
+    agrupar_variantes,
+    extraer_productos_busqueda,
+    format_telegram_message,
+    obtener_items_busqueda,
+)
+
+LINEA_BASE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "linea_base_ruta_critica.json")
+
+
+def cargar_paginas(sintetica=False):
+    """
+    Una entrada por categoria grabada: {archivo, canal, categoria, html, sha256, origen}.
+    origen es 'corpus' o 'modificada' (el sha256 no coincide con el manifest).
+
+    Si faltan categorias lanza FileNotFoundError con la lista, salvo con `sintetica`:
+    entonces se añade una sola entrada con la pagina sintetica (origen 'sintetica').
+    """
+    manifest = cargar_manifest()
+    paginas = []
+    faltan = []
+    for canal, categoria in categorias_corpus():
+        archivo = nombre_fichero(canal, categoria)
+        ruta = os.path.join(CORPUS_DIR, archivo)
+        if not os.path.exists(ruta):
+            faltan.append((archivo, categoria))
+            continue
+        with open(ruta, 'r', encoding='utf-8') as f:
+            html_content = f.read()
+        sha = sha256_texto(html_content)
+        origen = 'corpus' if manifest.get(archivo, {}).get('sha256') == sha else 'modificada'
+        paginas.append({
+            'archivo': archivo, 'canal': canal, 'categoria': categoria,
+            'html': html_content, 'sha256': sha, 'origen': origen,
+        })
+    if faltan and not sintetica:
+        raise FileNotFoundError(
+            f"Faltan {len(faltan)} pagina(s) en {CORPUS_DIR} (grabar con grabar_corpus.py "
+            f"o ejecutar con --sintetica): " + ", ".join(archivo for archivo, _ in faltan)
+        )
+    if faltan:
+        html_content = pagina_sintetica()
+        paginas.append({
+            'archivo': 'sintetica', 'canal': 'sintetica', 'categoria': faltan[0][1],
+            'html': html_content, 'sha256': sha256_texto(html_content), 'origen': 'sintetica',
+        })
+    return paginas
+
+
+def _sha_conjunto(paginas):
+    return hashlib.sha256(''.join(p['sha256'] for p in paginas).encode()).hexdigest()
+
+
+def medir_corpus(paginas, repeticiones):
+    """Devuelve (filas por pagina, medidas {clave: {'ms', 'sha256'}})."""
+    filas = []
+    medidas = {}
+    mejores = []
+    todos = []
+    for pagina in paginas:
+        ms, mb, productos = _medir_funcion(lambda: extraer_productos_busqueda(pagina['html']), repeticiones)
+        fila = {
+            'archivo': pagina['archivo'], 'kb': len(pagina['html']) // 1024, 'ms': ms, 'mb': mb,
+            'productos': len(productos), 'por_segundo': len(productos) / (ms / 1000) if ms else 0.0,
+            'origen': pagina['origen'], 'ms_prereserva': None,
+        }
+        medidas[f"extraer:{pagina['archivo']}"] = {'ms': ms, 'sha256': pagina['sha256']}
+
+        if pagina['canal'] == 'prereservas':
+            items = obtener_items_busqueda(pagina['html'])
+            ms_pre, _, _ = _medir_funcion(lambda: [i for i in items if _es_prereserva_item(i)], repeticiones)
+            fila['ms_prereserva'] = ms_pre
+            medidas[f"prereserva:{pagina['archivo']}"] = {'ms': ms_pre, 'sha256': pagina['sha256']}
+        else:
+            ofertas = [p for p in productos if p['tiene_oferta']]
+            if ofertas:
+                mejor = max(ofertas, key=lambda p: (p['descuento'], p['valoraciones']))
+                mejores.append({'producto': mejor, 'categoria': pagina['categoria']})
+
+        todos.extend((p, pagina['categoria']) for p in productos)
+        filas.append(fila)
+
+    sha = _sha_conjunto(paginas)
+    ms, _, _ = _medir_funcion(lambda: agrupar_variantes(mejores), repeticiones)
+    medidas['agrupar_variantes'] = {'ms': ms, 'sha256': sha, 'n': len(mejores)}
+    ms, _, _ = _medir_funcion(lambda: [format_telegram_message(p, c) for p, c in todos], repeticiones)
+    medidas['format_telegram_message'] = {'ms': ms, 'sha256': sha, 'n': len(todos)}
+    return filas, medidas
+
+
+def comparar(medidas, linea_base, tolerancia):
+    """Lista de (clave, ms_base, ms_actual) de las medidas que empeoran mas que la tolerancia."""
+    regresiones = []
+    for clave, medida in medidas.items():
+        base = linea_base.get(clave)
+        if not base or base.get('sha256') != medida['sha256'] or not base.get('ms'):
+            continue
+        if medida['ms'] > base['ms'] * (1 + tolerancia):
+            regresiones.append((clave, base['ms'], medida['ms']))
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la ruta critica del scraping')
+    parser.add_argument('-n', '--repeticiones', type=int, default=10, help='Repeticiones por medida')
+    parser.add_argument('--guardar', action='store_true', help='Guardar las medidas como nueva linea base')
+    parser.add_argument('--linea-base', default=LINEA_BASE_FILE, help='Fichero JSON de la linea base')
+    parser.add_argument('--tolerancia', type=float, default=0.25,
+                        help='Empeoramiento relativo admitido antes de marcar regresion (0.25 = 25%%)')
+    parser.add_argument('--sintetica', action='store_true',
+                        help='Medir la pagina sintetica en lugar de las categorias que falten en el corpus')
+    args = parser.parse_args()
+
+    # Los canales configuran logging a DEBUG en fichero al importarse: no medir el coste de los logs
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Se mide la extraccion: sin la cache de resultados las repeticiones saldrian de ella
+    core.CACHE_ITEMS_MAX = 0
+
+    try:
+        paginas = cargar_paginas(args.sintetica)
+    except FileNotFoundError as e:
+        print(f"ERROR: {e}")
+        return 2
+    filas, medidas = medir_corpus(paginas, args.repeticiones)
+
+    print(f"Paginas: {len(paginas)} | repeticiones: {args.repeticiones}")
+    print(f"{'pagina':<34} {'KB':>5} {'ms/pagina':>10} {'productos':>9} {'prod/s':>8} {'pico MB':>8} {'prereserva ms':>13}  origen")
+    for f in filas:
+        pre = f"{f['ms_prereserva']:>13.2f}" if f['ms_prereserva'] is not None else f"{'-':>13}"
+        print(
+            f"{f['archivo'][:34]:<34} {f['kb']:>5} {f['ms']:>10.1f} {f['productos']:>9} "
+            f"{f['por_segundo']:>8.0f} {f['mb']:>8.1f} {pre}  {f['origen']}"
+        )
+    for clave in ('agrupar_variantes', 'format_telegram_message'):
+        print(f"{clave:<34} {medidas[clave]['ms']:>10.2f} ms ({medidas[clave]['n']} entradas)")
+
+    modificadas = sum(1 for p in paginas if p['origen'] == 'modificada')
+    if modificadas:
+        print(f"AVISO: {modificadas} pagina(s) modificadas respecto al manifest del corpus")
+    if any(p['origen'] == 'sintetica' for p in paginas):
+        print("AVISO: faltan categorias en el corpus; se ha medido la pagina sintetica en su lugar")
+
+    if args.guardar:
+        with open(args.linea_base, 'w', encoding='utf-8') as f:
+            json.dump({
+                'fecha': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'maquina': platform.platform(),
+                'repeticiones': args.repeticiones,
+                'medidas': medidas,
+            }, f, indent=2)
+            f.write('\n')
+        print(f"Linea base guardada en {args.linea_base}")
+        return 0
+
+    try:
+        with open(args.linea_base, 'r', encoding='utf-8') as f:
+            linea_base = json.load(f).get('medidas', {})
+    except FileNotFoundError:
+        print("Sin linea base todavia (ejecutar con --guardar)")
+        return 0
+
+    regresiones = comparar(medidas, linea_base, args.tolerancia)
+    for clave, ms_base, ms_actual in regresiones:
+        print(f"REGRESION {clave}: {ms_base:.2f} ms -> {ms_actual:.2f} ms (x{ms_actual / ms_base:.2f})")
+    if regresiones:
+        return 1
+    print(f"Sin regresiones respecto a la linea base (tolerancia {args.tolerancia:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
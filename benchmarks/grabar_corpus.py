@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Graba el corpus de paginas de busqueda para los benchmarks
+===========================================================
+Descarga (una vez, con el limitador y las cabeceras de los canales) la pagina
+de busqueda completa de cada categoria de CATEGORIAS_BEBE, CATEGORIAS_PS y
+CATEGORIAS_PRERESERVAS y la guarda en benchmarks/corpus/<canal>/<categoria>.html,
+junto con corpus/manifest.json (url, fecha, tamaño y sha256 de cada pagina).
+
+El corpus se versiona en git: bench_ruta_critica.py lo usa sin red y anota en
+sus lineas base el sha256 de cada pagina, de modo que solo se comparan tiempos
+medidos sobre las mismas paginas. Las paginas bloqueadas (captcha) no se guardan.
+
+Ejecutar:
+  python3 benchmarks/grabar_corpus.py                 # todas las categorias
+  python3 benchmarks/grabar_corpus.py --canal ps      # solo un canal
+  python3 benchmarks/grabar_corpus.py --solo-faltan   # no vuelve a grabar las que ya estan
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import unicodedata
+from datetime import datetime
+
+# Raiz del proyecto en el path para importar shared/ y los canales
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.amazon_ofertas_core import BASE_URL, PaginaBloqueada, obtener_pagina  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+MANIFEST_FILE = os.path.join(CORPUS_DIR, "manifest.json")
+
+
+def categorias_corpus():
+    """Lista de (canal, categoria) con todas las busquedas que hacen los canales."""
+    import bebe.amazon_bebe_ofertas as bebe
+    import ps.amazon_ps_ofertas as ps
+
+    return (
+        [('bebe', c) for c in bebe.CATEGORIAS_BEBE] +
+        [('ps', c) for c in ps.CATEGORIAS_PS] +
+        [('prereservas', c) for c in ps.CATEGORIAS_PRERESERVAS]
+    )
+
+
+def nombre_fichero(canal, categoria):
+    """Ruta relativa al corpus de la pagina de una categoria (p.ej. 'ps/juegos-ps5.html')."""
+    nombre = unicodedata.normalize('NFKD', categoria['nombre']).encode('ascii', 'ignore').decode()
+    return f"{canal}/{re.sub(r'[^a-z0-9]+', '-', nombre.lower()).strip('-')}.html"
+
+
+def cargar_manifest():
+    """Entradas del manifest indexadas por ruta relativa ({} si no hay corpus)."""
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return {e['archivo']: e for e in json.load(f)}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def guardar_manifest(entradas):
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    with open(MANIFEST_FILE, 'w', encoding='utf-8') as f:
+        json.dump(sorted(entradas.values(), key=lambda e: e['archivo']), f, indent=2, ensure_ascii=False)
+        f.write('\n')
+
+
+def sha256_texto(texto):
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Graba el corpus de paginas de busqueda para los benchmarks')
+    parser.add_argument('--canal', choices=['bebe', 'ps', 'prereservas'], help='Grabar solo un canal')
+    parser.add_argument('--solo-faltan', action='store_true', help='No volver a grabar las paginas ya guardadas')
+    args = parser.parse_args()
+
+    manifest = cargar_manifest()
+    fallos = 0
+    for canal, categoria in categorias_corpus():
+        if args.canal and canal != args.canal:
+            continue
+        archivo = nombre_fichero(canal, categoria)
+        ruta = os.path.join(CORPUS_DIR, archivo)
+        if args.solo_faltan and archivo in manifest and os.path.exists(ruta):
+            continue
+
+        url = f"{BASE_URL}{categoria['url']}"
+        # max_resultados=0: pagina completa, sin cortar el streaming
+        html_content = obtener_pagina(url, max_resultados=0)
+        if not html_content or isinstance(html_content, PaginaBloqueada):
+            print(f"  ✗ {archivo}: no se pudo descargar (fallo o bloqueo)")
+            fallos += 1
+            continue
+
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        manifest[archivo] = {
+            'archivo': archivo,
+            'canal': canal,
+            'categoria': categoria['nombre'],
+            'url': url,
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'bytes': len(html_content.encode('utf-8')),
+            'sha256': sha256_texto(html_content),
+        }
+        guardar_manifest(manifest)
+        print(f"  ✓ {archivo} ({manifest[archivo]['bytes'] // 1024} KB)")
+
+    return 1 if fallos else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,7 +11,6 @@ import sys
 import logging
 import html
 from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
 
 # Add project root to path so shared/ is importable
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -21,16 +20,47 @@ from shared.amazon_ofertas_core import (
     BASE_URL,
     PARTNER_TAG,
     obtener_pagina,
+    obtener_paginas,
+    descargar_paginas,
+    estado_limite_semanal,
+    recorrer_paginas_categoria,
+    ranking_reutilizable,
+    enriquecer_mejores,
+    log_resumen_transferencia,
+    ruta_cookies,
+    cargar_cookies,
+    guardar_cookies,
+    log_resumen_badges,
+    ruta_estadisticas_badges,
+    cargar_estadisticas_badges,
+    guardar_estadisticas_badges,
+    ruta_cache_items,
+    usar_cache_items,
+    ruta_huellas_categorias,
+    guardar_huellas_categorias,
+    cargar_cache_items,
+    guardar_cache_items,
+    PaginaBloqueada,
+    huella_resultados,
+    MAX_RESULTADOS_BUSQUEDA,
     extraer_productos_busqueda,
+    obtener_items_busqueda,
+    extraer_producto_item,
     normalizar_titulo,
     titulos_similares,
     titulo_similar_a_recientes,
+    IndiceTitulos,
+    DetectorReediciones,
+    DIAS_VENTANA_REEDICIONES,
+    MAX_TITULOS_RECIENTES,
     agrupar_variantes,
     format_telegram_message,
     obtener_prioridad_marca as _obtener_prioridad_marca_core,
     send_telegram_message as _send_telegram_message_core,
     send_telegram_photo as _send_telegram_photo_core,
     load_posted_deals as _load_posted_deals_core,
+    cargar_huellas_categorias as _cargar_huellas_categorias_core,
+    cargar_firmas_titulos as _cargar_firmas_titulos_core,
     save_posted_deals as _save_posted_deals_core,
 )
 
@@ -53,6 +83,18 @@ DEV_MODE = False
 # Archivo para guardar ofertas ya publicadas
 POSTED_PS_DEALS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "posted_ps_deals.json")
 
+# Cookies de la sesion con Amazon, conservadas entre ejecuciones
+COOKIES_PS_FILE = ruta_cookies("ps")
+
+# Aciertos acumulados de los selectores de badge
+BADGES_PS_FILE = ruta_estadisticas_badges("ps")
+
+# Productos ya extraidos por resultado de busqueda (no se re-extraen si no cambian)
+ITEMS_PS_FILE = ruta_cache_items("ps")
+
+# Huella y ranking de cada categoria en la ultima ejecucion (reutilizado si no cambia)
+HUELLAS_PS_FILE = ruta_huellas_categorias("ps")
+
 # Archivo para guardar preórdenes ya publicadas (ventana separada de 48h)
 POSTED_PS_PRERESERVAS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "posted_ps_prereservas.json")
 
@@ -134,9 +176,23 @@ def load_posted_deals():
     return _load_posted_deals_core(POSTED_PS_DEALS_FILE, horas_ventana=96)
 
 
-def save_posted_deals(deals_dict, ultimas_categorias=None, ultimos_titulos=None, categorias_semanales=None):
+def save_posted_deals(deals_dict, ultimas_categorias=None, ultimos_titulos=None, categorias_semanales=None,
+                      firmas_titulos=None):
     """Guarda el diccionario de ofertas publicadas en un archivo JSON."""
-    return _save_posted_deals_core(deals_dict, POSTED_PS_DEALS_FILE, ultimas_categorias, ultimos_titulos, categorias_semanales)
+    return _save_posted_deals_core(
+        deals_dict, POSTED_PS_DEALS_FILE, ultimas_categorias, ultimos_titulos, categorias_semanales,
+        firmas_titulos=firmas_titulos
+    )
+
+
+def cargar_huellas_categorias():
+    """Carga las huellas y rankings de la ultima ejecucion por categoria."""
+    return _cargar_huellas_categorias_core(HUELLAS_PS_FILE)
+
+
+def cargar_firmas_titulos():
+    """Carga del historial las firmas MinHash de los titulos publicados."""
+    return _cargar_firmas_titulos_core(POSTED_PS_DEALS_FILE)
 
 
 def load_posted_prereservas():
@@ -213,11 +269,16 @@ def format_prereserva_message(producto, categoria):
     return message
 
 
-def buscar_y_publicar_ofertas():
+def buscar_y_publicar_ofertas(descargar=None):
     """
     Busca la mejor oferta de cada categoria y publica la de mayor descuento.
     Prioriza siempre videojuegos sobre accesorios.
+
+    Args:
+        descargar: Funcion opcional lista de URLs -> lista de HTML. Por defecto se
+            usa obtener_paginas (los tests inyectan aqui su descargador).
     """
+    usar_cache_items("ps")
     if not _effective_token() or not _effective_chat_id():
         if DEV_MODE:
             log.error(
@@ -243,10 +304,17 @@ def buscar_y_publicar_ofertas():
     # En DEV_MODE se ignora el historial para no contaminar el JSON de produccion
     if DEV_MODE:
         posted_deals, ultimas_categorias, ultimos_titulos, categorias_semanales = {}, [], [], {}
+        huellas_categorias = {}
+        firmas_titulos = {}
         log.info("DEV_MODE: historial de publicaciones ignorado (posted_ps_deals.json no se leerá ni escribirá)")
     else:
         posted_deals, ultimas_categorias, ultimos_titulos, categorias_semanales = load_posted_deals()
+        huellas_categorias = cargar_huellas_categorias()
+        firmas_titulos = cargar_firmas_titulos()
     posted_asins = set(posted_deals.keys())
+    nuevas_huellas = {}
+    indice_titulos = IndiceTitulos(ultimos_titulos)
+    detector_reediciones = DetectorReediciones.desde_json(firmas_titulos)
 
     if ultimas_categorias:
         log.info(
@@ -282,6 +350,20 @@ def buscar_y_publicar_ofertas():
         except (ValueError, TypeError):
             pass
 
+    # Descargar de golpe las paginas de todas las categorias elegibles; el ritmo
+    # contra Amazon lo marca el limitador compartido del core
+    estados_semanales = {
+        c['nombre']: estado_limite_semanal(c, categorias_semanales, now, CATEGORIAS_LIMITE_SEMANAL)
+        for c in CATEGORIAS_PS
+    }
+    urls_elegibles = [
+        BASE_URL + c['url'] for c in CATEGORIAS_PS
+        if not (accesorios_bloqueados and c['tipo'] == 'accesorio')
+        and not (estados_semanales[c['nombre']] and estados_semanales[c['nombre']][0])
+    ]
+    # Las paginas 2..N de cada categoria salen por el mismo motor que la primera
+    paginas, obtener_extra = descargar_paginas(urls_elegibles, descargar, obtener_pagina, obtener_paginas)
+
     # Recopilar la mejor oferta de cada categoria
     mejores_por_categoria = []
     mejores_videojuegos = []  # Separar videojuegos para priorizarlos
@@ -296,53 +378,69 @@ def buscar_y_publicar_ofertas():
             continue
 
         # Verificar limite semanal para ciertas categorias
-        if categoria['nombre'] in CATEGORIAS_LIMITE_SEMANAL:
-            ultima_pub_str = categorias_semanales.get(categoria['nombre'])
-            if ultima_pub_str:
-                try:
-                    ultima_pub = datetime.fromisoformat(ultima_pub_str)
-                    tiempo_transcurrido = now - ultima_pub
-                    if tiempo_transcurrido < una_semana:
-                        dias_restantes = (una_semana - tiempo_transcurrido).days + 1
-                        log.info(
-                            "  SALTADA por limite semanal: ultima publicacion el %s (hace %d dias, faltan ~%d dias)",
-                            ultima_pub.strftime('%d/%m %H:%M'), tiempo_transcurrido.days, dias_restantes
-                        )
-                        continue
-                    else:
-                        log.debug(
-                            "  Limite semanal OK: ultima publicacion hace %d dias (supera los 7 requeridos)",
-                            tiempo_transcurrido.days
-                        )
-                except (ValueError, TypeError):
-                    pass
+        estado_semanal = estados_semanales[categoria['nombre']]
+        if estado_semanal:
+            bloqueada, ultima_pub, tiempo_transcurrido = estado_semanal
+            if bloqueada:
+                dias_restantes = (una_semana - tiempo_transcurrido).days + 1
+                log.info(
+                    "  SALTADA por limite semanal: ultima publicacion el %s (hace %d dias, faltan ~%d dias)",
+                    ultima_pub.strftime('%d/%m %H:%M'), tiempo_transcurrido.days, dias_restantes
+                )
+                continue
+            log.debug(
+                "  Limite semanal OK: ultima publicacion hace %d dias (supera los 7 requeridos)",
+                tiempo_transcurrido.days
+            )
 
         url = BASE_URL + categoria['url']
-        html_content = obtener_pagina(url)
+        html_content = paginas.get(url)
+
+        if isinstance(html_content, PaginaBloqueada):
+            log.warning("  Pagina bloqueada por Amazon (%s), saltando categoria", html_content.motivo)
+            continue
 
         if not html_content:
             log.warning("  No se pudo obtener la pagina, saltando categoria")
             continue
 
-        productos = extraer_productos_busqueda(html_content)
-        ofertas = [p for p in productos if p['tiene_oferta']]
-        sin_oferta = len(productos) - len(ofertas)
-        log.info(
-            "  Scraped: %d productos (%d con oferta, %d sin descuento)",
-            len(productos), len(ofertas), sin_oferta
-        )
+        # Si los resultados no han cambiado desde la ultima ejecucion, el ranking
+        # guardado sigue valiendo: no se extrae ni se ordena de nuevo
+        huella = huella_resultados(html_content)
+        es_candidato = lambda p: p['asin'] not in posted_asins
+        paginas_extra = []
+        ofertas_ordenadas = ranking_reutilizable(huellas_categorias.get(categoria['nombre']), huella, es_candidato)
+        if ofertas_ordenadas is not None:
+            log.info("  Resultados sin cambios desde la ultima ejecucion: ranking reutilizado (%d con oferta)", len(ofertas_ordenadas))
+        else:
+            productos = recorrer_paginas_categoria(
+                url, html_content, obtener_extra, extraer_productos_busqueda,
+                es_candidato=es_candidato, pedidas=paginas_extra
+            )
+            ofertas = [p for p in productos if p['tiene_oferta']]
+            sin_oferta = len(productos) - len(ofertas)
+            log.info(
+                "  Scraped: %d productos (%d con oferta, %d sin descuento)",
+                len(productos), len(ofertas), sin_oferta
+            )
+
+            # Ordenar ofertas: primero por mayor descuento, luego marca prioritaria, luego valoraciones, luego ventas
+            ofertas_ordenadas = sorted(
+                ofertas,
+                key=lambda x: (x['descuento'], obtener_prioridad_marca(x['titulo']), x['valoraciones'], x['ventas']),
+                reverse=True
+            )
+        if huella:
+            nuevas_huellas[categoria['nombre']] = {
+                'huella': huella,
+                'paginas': 1 + len(paginas_extra),
+                'ofertas': [dict(p) for p in ofertas_ordenadas],
+            }
 
-        if not ofertas:
+        if not ofertas_ordenadas:
             log.info("  No hay productos con descuento en esta categoria")
             continue
 
-        # Ordenar ofertas: primero por mayor descuento, luego marca prioritaria, luego valoraciones, luego ventas
-        ofertas_ordenadas = sorted(
-            ofertas,
-            key=lambda x: (x['descuento'], obtener_prioridad_marca(x['titulo']), x['valoraciones'], x['ventas']),
-            reverse=True
-        )
-
         # Log de los top candidatos antes de filtrar
         log.debug("  Top candidatos antes de filtros anti-duplicacion:")
         for i, p in enumerate(ofertas_ordenadas[:5], 1):
@@ -368,13 +466,23 @@ def buscar_y_publicar_ofertas():
                 )
                 continue
 
-            if verificar_titulos and titulo_similar_a_recientes(producto['titulo'], ultimos_titulos):
+            if verificar_titulos and titulo_similar_a_recientes(producto['titulo'], indice_titulos):
                 log.info(
                     "  DESCARTADO [titulo similar a reciente] %s... (%.0f%% dto)",
                     titulo_corto, producto['descuento']
                 )
                 continue
 
+            reedicion = verificar_titulos and detector_reediciones.reedicion_de(
+                producto['titulo'], desde=now - timedelta(days=DIAS_VENTANA_REEDICIONES), excluir_asin=asin
+            )
+            if reedicion:
+                log.info(
+                    "  DESCARTADO [reedicion de %s, publicado en <%dd] %s... (%.0f%% dto, ASIN: %s)",
+                    reedicion, DIAS_VENTANA_REEDICIONES, titulo_corto, producto['descuento'], asin
+                )
+                continue
+
             candidato_elegido = producto
             marca_flag = " [marca prioritaria]" if obtener_prioridad_marca(producto['titulo']) else ""
             log.info(
@@ -396,6 +504,21 @@ def buscar_y_publicar_ofertas():
         if candidato_elegido is None:
             log.info("  Sin candidatos validos: todos descartados por duplicacion o similitud de titulo")
 
+    # Las huellas se guardan aunque no haya nada que publicar; las categorias que no se
+    # han mirado en esta ejecucion conservan las suyas
+    if not DEV_MODE:
+        nombres = {c['nombre'] for c in CATEGORIAS_PS}
+        huellas_categorias.update(nuevas_huellas)
+        guardar_huellas_categorias(
+            HUELLAS_PS_FILE, {n: h for n, h in huellas_categorias.items() if n in nombres}
+        )
+
+    # Completar los ganadores con su pagina de producto (solo con ENRIQUECER_DETALLE);
+    # los que segun ella ya no son oferta salen de la lista
+    enriquecidos = enriquecer_mejores(mejores_videojuegos + mejores_por_categoria, descargar)
+    mejores_videojuegos = [e for e in enriquecidos if e['categoria']['tipo'] == 'videojuego']
+    mejores_por_categoria = [e for e in enriquecidos if e['categoria']['tipo'] != 'videojuego']
+
     # Priorizar videojuegos: agregar los videojuegos ordenados antes que accesorios
     # Combinar: primero videojuegos ordenados por descuento, luego accesorios
     mejores_videojuegos.sort(
@@ -490,6 +613,10 @@ def buscar_y_publicar_ofertas():
         # Guardar también ASINs de variantes agrupadas para evitar republicarlas
         for variante in producto.get('variantes_adicionales', []):
             posted_deals[variante['asin']] = datetime.now().isoformat()
+        # Firmas de los titulos publicados para descartar reediciones con otro ASIN
+        detector_reediciones.agregar(producto['asin'], producto['titulo'])
+        for variante in producto.get('variantes_adicionales', []):
+            detector_reediciones.agregar(variante['asin'], variante['titulo'])
         # Añadir categoria al inicio de la lista y mantener solo las ultimas 4
         ultimas_categorias.insert(0, categoria['nombre'])
         ultimas_categorias = ultimas_categorias[:4]
@@ -498,7 +625,7 @@ def buscar_y_publicar_ofertas():
         # Si es categoria con verificacion de titulos, guardar el titulo
         if categoria['nombre'] in CATEGORIAS_VERIFICAR_TITULOS:
             ultimos_titulos.insert(0, producto['titulo'])
-            ultimos_titulos = ultimos_titulos[:4]
+            ultimos_titulos = ultimos_titulos[:MAX_TITULOS_RECIENTES]
             log.debug("Titulo guardado en anti-similitud (total: %d)", len(ultimos_titulos))
 
         # Si es categoria con limite semanal, guardar el timestamp
@@ -520,7 +647,10 @@ def buscar_y_publicar_ofertas():
     if DEV_MODE:
         log.info("DEV_MODE: historial no guardado (posted_ps_deals.json sin cambios)")
     else:
-        save_posted_deals(posted_deals, ultimas_categorias, ultimos_titulos, categorias_semanales)
+        save_posted_deals(
+            posted_deals, ultimas_categorias, ultimos_titulos, categorias_semanales,
+            firmas_titulos=detector_reediciones.a_json()
+        )
 
     log.info("")
     log.info("=" * 60)
@@ -530,11 +660,16 @@ def buscar_y_publicar_ofertas():
     return ofertas_publicadas
 
 
-def buscar_prereservas_ps():
+def buscar_prereservas_ps(descargar=None):
     """
     Busca juegos en preorden para PS4/PS5 y publica hasta MAX_PRERESERVAS_POR_CICLO.
     Funciona de forma independiente de las ofertas normales (cada una con sus propios límites).
+
+    Args:
+        descargar: Funcion opcional lista de URLs -> lista de HTML. Por defecto se
+            usa obtener_paginas (los tests inyectan aqui su descargador).
     """
+    usar_cache_items("ps")
     if not _effective_token() or not _effective_chat_id():
         return 0
 
@@ -552,22 +687,28 @@ def buscar_prereservas_ps():
         posted_prereservas = load_posted_prereservas()
     posted_prereservas_asins = set(posted_prereservas.keys())
 
+    # Descargar de golpe todas las URLs de búsqueda de preórdenes
+    urls = [BASE_URL + c['url'] for c in CATEGORIAS_PRERESERVAS]
+    paginas, _ = descargar_paginas(urls, descargar, obtener_pagina, obtener_paginas)
+
     # Recopilar candidatos de todas las URLs de búsqueda de preórdenes
     candidatos = []
     for categoria in CATEGORIAS_PRERESERVAS:
         url = BASE_URL + categoria['url']
         log.info("Buscando preórdenes: %s", categoria['nombre'])
-        html_content = obtener_pagina(url)
+        html_content = paginas.get(url)
+        if isinstance(html_content, PaginaBloqueada):
+            log.warning("  Página bloqueada por Amazon (%s), saltando", html_content.motivo)
+            continue
         if not html_content:
             log.warning("  No se pudo obtener la página, saltando")
             continue
 
-        soup = BeautifulSoup(html_content, 'html.parser')
-        items = soup.select('[data-component-type="s-search-result"]')
+        items = obtener_items_busqueda(html_content)
 
         log.info("  Encontrados %d items, verificando si son preórdenes...", len(items))
         items_descartados = 0
-        for item in items[:20]:
+        for item in items[:MAX_RESULTADOS_BUSQUEDA]:
             asin = item.get('data-asin', '')
             if not asin or asin in posted_prereservas_asins:
                 continue
@@ -578,11 +719,9 @@ def buscar_prereservas_ps():
                 log.debug("    [DESCARTADO] ASIN %s: %s...", asin, texto_item)
                 continue
 
-            # Extraer datos básicos del producto del item individual
-            # Convertir el item BeautifulSoup a string para que extraer_productos_busqueda lo procese
-            productos = extraer_productos_busqueda(str(item))
-            if productos:
-                producto = productos[0]
+            # Extraer datos básicos del producto directamente del item ya parseado
+            producto = extraer_producto_item(item)
+            if producto:
                 candidatos.append({'producto': producto, 'categoria': categoria})
                 log.info("    [PREORDEN] %s (ASIN: %s)", producto['titulo'][:50], asin)
 
@@ -648,12 +787,23 @@ def main(modo_continuo=False):
     - modo_continuo=False: ejecuta una vez y termina (para cron)
     - modo_continuo=True: ejecuta cada 15 minutos en bucle infinito
     """
+    # Reutilizar la sesion de la ejecucion anterior evita las redirecciones de
+    # arranque de sesion de Amazon en las primeras peticiones
+    cargar_cookies(COOKIES_PS_FILE)
+    cargar_estadisticas_badges(BADGES_PS_FILE)
+    cargar_cache_items(ITEMS_PS_FILE, "ps")
+
     if modo_continuo:
         log.info("Modo continuo activado - Ejecutando cada 15 minutos (Ctrl+C para detener)")
         while True:
             try:
                 buscar_prereservas_ps()
                 buscar_y_publicar_ofertas()
+                log_resumen_transferencia()
+                log_resumen_badges()
+                guardar_cookies(COOKIES_PS_FILE)
+                guardar_estadisticas_badges(BADGES_PS_FILE)
+                guardar_cache_items(ITEMS_PS_FILE, "ps")
                 log.info("Proxima ejecucion en 15 minutos...")
                 log.info("-" * 60)
                 time.sleep(900)  # 15 minutos = 900 segundos
@@ -665,6 +815,11 @@ def main(modo_continuo=False):
         # Las preórdenes se publican primero (mayor prioridad)
         buscar_prereservas_ps()
         buscar_y_publicar_ofertas()
+        log_resumen_transferencia()
+        log_resumen_badges()
+        guardar_cookies(COOKIES_PS_FILE)
+        guardar_estadisticas_badges(BADGES_PS_FILE)
+        guardar_cache_items(ITEMS_PS_FILE, "ps")
 
 
 if __name__ == "__main__":
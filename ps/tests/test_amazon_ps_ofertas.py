@@ -22,6 +22,12 @@ import ps.amazon_ps_ofertas as bot
 import shared.amazon_ofertas_core as core
 
 
+@pytest.fixture(autouse=True)
+def huellas_en_tmp(tmp_path, monkeypatch):
+    """Las huellas por categoria van a CACHE_DIR: cada test usa las suyas."""
+    monkeypatch.setattr(bot, 'HUELLAS_PS_FILE', str(tmp_path / 'huellas.json'))
+
+
 # ---------------------------------------------------------------------------
 # Helpers de fixtures
 # ---------------------------------------------------------------------------
@@ -1257,6 +1263,57 @@ class TestBuscarPrereservasPS:
             # save_posted_deals NO debe ser llamado (preórdenes son independientes)
             assert not mock_save_deals.called
 
+    @patch('ps.amazon_ps_ofertas._effective_chat_id')
+    @patch('ps.amazon_ps_ofertas._effective_token')
+    @patch('ps.amazon_ps_ofertas.send_telegram_photo')
+    @patch('ps.amazon_ps_ofertas.obtener_pagina')
+    @patch('ps.amazon_ps_ofertas.load_posted_prereservas')
+    @patch('ps.amazon_ps_ofertas.save_posted_prereservas')
+    def test_usa_descargador_inyectado(self, mock_save_pre, mock_load_pre, mock_pagina, mock_foto, mock_token, mock_chat_id):
+        """Con `descargar` (motor asíncrono) no se llama a obtener_pagina."""
+        mock_load_pre.return_value = {}
+        mock_token.return_value = 'fake_token'
+        mock_chat_id.return_value = 'fake_chat_id'
+        mock_foto.return_value = True
+        urls_pedidas = []
+
+        def descargar(urls):
+            urls_pedidas.extend(urls)
+            return [self._html_prereserva(asin=f"B00PRE{i}") for i in range(len(urls))]
+
+        resultado = bot.buscar_prereservas_ps(descargar=descargar)
+
+        assert resultado == 2
+        assert urls_pedidas == [bot.BASE_URL + c['url'] for c in bot.CATEGORIAS_PRERESERVAS]
+        mock_pagina.assert_not_called()
+
+    @patch('ps.amazon_ps_ofertas._effective_chat_id')
+    @patch('ps.amazon_ps_ofertas._effective_token')
+    @patch('ps.amazon_ps_ofertas.send_telegram_photo')
+    @patch('ps.amazon_ps_ofertas.extraer_productos_busqueda')
+    @patch('ps.amazon_ps_ofertas.load_posted_prereservas')
+    @patch('ps.amazon_ps_ofertas.save_posted_prereservas')
+    def test_un_solo_parseo_por_pagina(self, mock_save_pre, mock_load_pre, mock_extraer, mock_foto, mock_token, mock_chat_id, monkeypatch):
+        """Clasificación y extracción comparten el parseo de la página: sin str(item) ni re-parseo por item."""
+        mock_load_pre.return_value = {}
+        mock_token.return_value = 'fake_token'
+        mock_chat_id.return_value = 'fake_chat_id'
+        mock_foto.return_value = True
+        html = self._html_prereserva(asin="B00PRE1").replace(
+            '</body>', self._html_prereserva(asin="B00PRE2", titulo="GTA VI PS5").split('<body>')[1]
+        )
+        parseos = []
+        original = bot.obtener_items_busqueda
+        monkeypatch.setattr(bot, 'obtener_items_busqueda', lambda h: parseos.append(h) or original(h))
+
+        resultado = bot.buscar_prereservas_ps(descargar=lambda urls: [html] * len(urls))
+
+        assert resultado >= 2
+        assert len(parseos) == len(bot.CATEGORIAS_PRERESERVAS)
+        mock_extraer.assert_not_called()
+        titulos = {c.kwargs.get('caption', c.args[1]) for c in mock_foto.call_args_list}
+        assert any('FIFA 26 PS5' in t for t in titulos) and any('GTA VI PS5' in t for t in titulos)
+
     @patch('ps.amazon_ps_ofertas._effective_chat_id')
     @patch('ps.amazon_ps_ofertas._effective_token')
     @patch('ps.amazon_ps_ofertas.send_telegram_photo')
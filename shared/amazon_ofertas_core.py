@@ -5,17 +5,50 @@ Importar desde aquí en amazon_bebe_ofertas.py y amazon_ps_ofertas.py.
 """
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+import asyncio
+import base64
+import codecs
+import contextvars
+import functools
 import re
 import time
 import random
 import json
 import os
 import html
+import hashlib
 import logging
 import logging.handlers
+import struct
 import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+from urllib3.util.request import ACCEPT_ENCODING
+
+# Cliente HTTP asincrono (opcional): sin httpx el motor asincrono delega en
+# obtener_pagina dentro de un hilo
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Backend lxml para BeautifulSoup (opcional): sin lxml se usa html.parser
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+# Extractor rapido con selectolax (opcional): sin el se extrae con BeautifulSoup
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
 
 # --- Configuracion de Logging ---
 
@@ -57,12 +90,29 @@ def setup_logging(log_file):
 PARTNER_TAG = "juegosenoferta-21"
 BASE_URL = "https://www.amazon.es"
 
+# Codificaciones de contenido de la mas compacta a la menos compacta
+PREFERENCIA_CODIFICACIONES = ('zstd', 'br', 'gzip', 'deflate')
+
+
+def _accept_encoding():
+    """
+    Cabecera Accept-Encoding con solo las codificaciones que se pueden descomprimir
+    aqui, ordenadas por preferencia con q-values decrecientes.
+
+    urllib3 solo incluye br y zstd en ACCEPT_ENCODING si estan instalados brotli y
+    zstandard, que son las mismas librerias que usa httpx para decodificarlos.
+    """
+    disponibles = {c.strip() for c in ACCEPT_ENCODING.split(',')}
+    ofrecidas = [c for c in PREFERENCIA_CODIFICACIONES if c in disponibles]
+    return ', '.join(c if i == 0 else f"{c};q={1 - i / 10:.1f}" for i, c in enumerate(ofrecidas))
+
+
 # Headers para simular un navegador moderno
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
     'Accept-Language': 'es-ES,es;q=0.9,en;q=0.8',
-    'Accept-Encoding': 'gzip, deflate, br, zstd',
+    'Accept-Encoding': _accept_encoding(),
     'Connection': 'keep-alive',
     'Upgrade-Insecure-Requests': '1',
     'Sec-Fetch-Dest': 'document',
@@ -115,10 +165,21 @@ def load_posted_deals(filepath, horas_ventana=48):
 
     # Extraer ultimos titulos publicados (para verificacion de similitud)
     ultimos_titulos = data.pop('_ultimos_titulos', [])
+    # Sus palabras clave ya normalizadas (lista paralela): no se vuelven a calcular
+    palabras_titulos = data.pop('_palabras_titulos', None)
+    if isinstance(palabras_titulos, list) and len(palabras_titulos) == len(ultimos_titulos):
+        for titulo, palabras in zip(ultimos_titulos, palabras_titulos):
+            if isinstance(titulo, str) and isinstance(palabras, list):
+                _recordar_palabras_titulo(titulo, frozenset(palabras))
 
     # Extraer timestamps de ultima publicacion de categorias con limite semanal
     categorias_semanales = data.pop('_categorias_semanales', {})
 
+    # Las firmas de titulos se leen con cargar_firmas_titulos. Las huellas de
+    # resultados por categoria ya no van en el historial (ver ruta_huellas_categorias)
+    data.pop('_huellas_categorias', None)
+    data.pop('_firmas_titulos', None)
+
     recent_deals = {}
     expired_count = 0
     now = datetime.now()
@@ -154,32 +215,161 @@ def load_posted_deals(filepath, horas_ventana=48):
     return recent_deals, ultimas_categorias, ultimos_titulos, categorias_semanales
 
 
-def save_posted_deals(deals_dict, filepath, ultimas_categorias=None, ultimos_titulos=None, categorias_semanales=None):
+def save_posted_deals(deals_dict, filepath, ultimas_categorias=None, ultimos_titulos=None, categorias_semanales=None,
+                      firmas_titulos=None):
     """Guarda el diccionario de ofertas publicadas en un archivo JSON."""
     data = deals_dict.copy()
     if ultimas_categorias:
         data['_ultimas_categorias'] = ultimas_categorias
     if ultimos_titulos:
         data['_ultimos_titulos'] = ultimos_titulos
+        data['_palabras_titulos'] = [sorted(_palabras_titulo(t)) for t in ultimos_titulos]
     if categorias_semanales:
         data['_categorias_semanales'] = categorias_semanales
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=4)
+    if firmas_titulos:
+        data['_firmas_titulos'] = firmas_titulos
+    _escribir_json_atomico(filepath, data, indent=4)
+
+
+def estado_limite_semanal(categoria, categorias_semanales, now, categorias_limite):
+    """
+    Consulta el limite semanal de una categoria.
+
+    Args:
+        categoria: Dict de la categoria (se usa 'nombre').
+        categorias_semanales: Dict {nombre: ISO de la ultima publicacion} del historial.
+        now: Instante de referencia.
+        categorias_limite: Nombres de las categorias con limite semanal del canal.
+
+    Retorna None si la categoria no tiene limite semanal o no hay fecha valida
+    de su ultima publicacion; si no, tupla (bloqueada, ultima_pub, tiempo_transcurrido).
+    """
+    if categoria['nombre'] not in categorias_limite:
+        return None
+    ultima_pub_str = categorias_semanales.get(categoria['nombre'])
+    if not ultima_pub_str:
+        return None
+    try:
+        ultima_pub = datetime.fromisoformat(ultima_pub_str)
+    except (ValueError, TypeError):
+        return None
+    tiempo_transcurrido = now - ultima_pub
+    return tiempo_transcurrido < timedelta(days=7), ultima_pub, tiempo_transcurrido
+
+
+def ruta_huellas_categorias(canal):
+    """
+    Fichero de las huellas y rankings por categoria de un canal dentro de CACHE_DIR.
+
+    No van en el historial posted_*_deals.json, que se versiona en cada ejecucion:
+    son varios KB por categoria que solo sirven a la ejecucion siguiente.
+    """
+    return os.path.join(CACHE_DIR, f"huellas_{canal}.json")
+
+
+def cargar_huellas_categorias(filepath):
+    """
+    Carga las huellas de resultados de cada categoria de la ultima ejecucion.
+
+    Retorna dict {nombre_categoria: {'huella': str, 'ofertas': [productos ordenados]}},
+    vacio si no hay fichero o no es valido.
+    """
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            huellas = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return huellas if isinstance(huellas, dict) else {}
+
+
+def _escribir_json_atomico(ruta, datos, indent=None):
+    """
+    Escribe `datos` como JSON en `ruta` de forma atomica: primero en un temporal
+    junto al destino y despues os.replace. El temporal lleva el pid y el id del
+    hilo para que dos escrituras simultaneas no se pisen. Propaga OSError.
+    """
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    ruta_tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(ruta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, indent=indent)
+        os.replace(ruta_tmp, ruta)
+    except BaseException:
+        try:
+            os.remove(ruta_tmp)
+        except OSError:
+            pass
+        raise
+
+
+def guardar_huellas_categorias(filepath, huellas):
+    """Guarda (de forma atomica) las huellas de resultados de cada categoria."""
+    try:
+        _escribir_json_atomico(filepath, huellas)
+    except OSError as e:
+        log.warning("No se pudieron guardar las huellas de resultados en %s: %s", filepath, e)
+
+
+def cargar_firmas_titulos(filepath):
+    """
+    Carga del historial las firmas MinHash de los titulos publicados.
+
+    Retorna dict {asin: [instante ISO, firma codificada, numeros]} (ver DetectorReediciones),
+    vacio si no hay historial o no tiene firmas.
+    """
+    try:
+        with open(filepath, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    firmas = data.get('_firmas_titulos') if isinstance(data, dict) else None
+    return firmas if isinstance(firmas, dict) else {}
+
+
+# Palabras comunes que no cuentan al comparar titulos
+PALABRAS_IGNORAR_TITULO = frozenset({
+    'de', 'para', 'con', 'sin', 'el', 'la', 'los', 'las', 'un', 'una',
+    'unos', 'unas', 'y', 'o', 'a', 'en', 'del', 'al', 'bebe', 'bebé',
+    'pack', 'set', 'unidades', 'meses', 'años', 'mese', 'ano',
+})
+_RE_PALABRA_TITULO = re.compile(r'\b[a-záéíóúñü]+\b')
+
+# Titulos normalizados que se recuerdan (LRU); cada titulo se normaliza una vez
+# por ejecucion aunque lo comparen titulos_similares, son_variantes, etc.
+CACHE_TITULOS_MAX = int(os.getenv('CACHE_TITULOS_MAX', '4096'))
+
+_palabras_titulos = OrderedDict()  # titulo -> frozenset de palabras clave
+_lock_palabras_titulos = threading.Lock()
+
+
+def _recordar_palabras_titulo(titulo, palabras):
+    with _lock_palabras_titulos:
+        _palabras_titulos[titulo] = palabras
+        _palabras_titulos.move_to_end(titulo)
+        while len(_palabras_titulos) > CACHE_TITULOS_MAX:
+            _palabras_titulos.popitem(last=False)
+
+
+def _palabras_titulo(titulo):
+    """Palabras clave de un titulo (frozenset compartido, no modificar)."""
+    with _lock_palabras_titulos:
+        palabras = _palabras_titulos.get(titulo)
+        if palabras is not None:
+            _palabras_titulos.move_to_end(titulo)
+            return palabras
+    # Extraer solo palabras alfanumericas y filtrar las comunes y muy cortas
+    palabras = frozenset(
+        p for p in _RE_PALABRA_TITULO.findall(titulo.lower())
+        if p not in PALABRAS_IGNORAR_TITULO and len(p) > 2
+    )
+    if CACHE_TITULOS_MAX > 0:
+        _recordar_palabras_titulo(titulo, palabras)
+    return palabras
 
 
 def normalizar_titulo(titulo):
     """Normaliza un titulo para comparacion: minusculas, sin palabras comunes."""
-    palabras_ignorar = {
-        'de', 'para', 'con', 'sin', 'el', 'la', 'los', 'las', 'un', 'una',
-        'unos', 'unas', 'y', 'o', 'a', 'en', 'del', 'al', 'bebe', 'bebé',
-        'pack', 'set', 'unidades', 'meses', 'años', 'mese', 'ano',
-    }
-    titulo_lower = titulo.lower()
-    # Extraer solo palabras alfanumericas
-    palabras = re.findall(r'\b[a-záéíóúñü]+\b', titulo_lower)
-    # Filtrar palabras comunes y muy cortas
-    palabras_clave = [p for p in palabras if p not in palabras_ignorar and len(p) > 2]
-    return set(palabras_clave)
+    return set(_palabras_titulo(titulo))
 
 
 def titulos_similares(titulo1, titulo2, umbral=0.5):
@@ -187,8 +377,8 @@ def titulos_similares(titulo1, titulo2, umbral=0.5):
     Compara dos titulos y determina si son similares.
     Retorna True si comparten mas del umbral (50%) de palabras clave.
     """
-    palabras1 = normalizar_titulo(titulo1)
-    palabras2 = normalizar_titulo(titulo2)
+    palabras1 = _palabras_titulo(titulo1)
+    palabras2 = _palabras_titulo(titulo2)
 
     if not palabras1 or not palabras2:
         return False
@@ -204,14 +394,231 @@ def titulos_similares(titulo1, titulo2, umbral=0.5):
     return similitud >= umbral
 
 
+# Titulos publicados que se guardan en el historial para el anti-titulo-similar.
+# Con IndiceTitulos el coste por candidato depende de las palabras que comparte,
+# no del numero de titulos guardados. 240 cubren al menos 4 semanas: solo se
+# guardan los de CATEGORIAS_VERIFICAR_TITULOS y se publica como mucho una vez
+# cada 3 horas
+MAX_TITULOS_RECIENTES = int(os.getenv('MAX_TITULOS_RECIENTES', '240'))
+
+
+class IndiceTitulos:
+    """
+    Indice invertido palabra clave -> titulos para buscar titulos similares entre
+    muchos: solo se calcula la similitud (la de titulos_similares) con los titulos
+    que comparten alguna palabra con el candidato.
+    """
+
+    def __init__(self, titulos=()):
+        self.titulos = []
+        self._palabras = []
+        self._indice = {}
+        for titulo in titulos:
+            self.agregar(titulo)
+
+    def __len__(self):
+        return len(self.titulos)
+
+    def __iter__(self):
+        return iter(self.titulos)
+
+    def agregar(self, titulo, palabras=None):
+        """Añade un titulo (palabras: su normalizar_titulo, si ya se tiene)."""
+        if palabras is None:
+            palabras = _palabras_titulo(titulo)
+        ident = len(self.titulos)
+        self.titulos.append(titulo)
+        self._palabras.append(frozenset(palabras))
+        for palabra in self._palabras[ident]:
+            self._indice.setdefault(palabra, []).append(ident)
+
+    def similares(self, titulo, umbral=0.5):
+        """Titulos del indice similares al dado (misma regla que titulos_similares), en orden de insercion."""
+        palabras = _palabras_titulo(titulo)
+        if not palabras:
+            return []
+        comunes = {}
+        for palabra in palabras:
+            for ident in self._indice.get(palabra, ()):
+                comunes[ident] = comunes.get(ident, 0) + 1
+        return [
+            self.titulos[ident] for ident in sorted(comunes)
+            if comunes[ident] / (len(palabras) + len(self._palabras[ident]) - comunes[ident]) >= umbral
+        ]
+
+
 def titulo_similar_a_recientes(titulo, ultimos_titulos):
-    """Verifica si un titulo es similar a alguno de los titulos recientes."""
+    """
+    Verifica si un titulo es similar a alguno de los titulos recientes
+    (lista de titulos o IndiceTitulos).
+    """
+    if isinstance(ultimos_titulos, IndiceTitulos):
+        return bool(ultimos_titulos.similares(titulo))
     for titulo_reciente in ultimos_titulos:
         if titulos_similares(titulo, titulo_reciente):
             return True
     return False
 
 
+# --- Deteccion de reediciones (MinHash + LSH) ---
+
+# Valores MinHash por titulo. La fraccion de valores iguales entre dos firmas
+# estima el Jaccard de sus palabras clave (la medida de titulos_similares)
+PERMUTACIONES_MINHASH = 64
+
+# Jaccard estimado a partir del cual un titulo nuevo es reedicion de uno publicado
+UMBRAL_REEDICION = float(os.getenv('UMBRAL_REEDICION', '0.8'))
+
+# Dias que se conservan las firmas en el historial
+HORIZONTE_FIRMAS_DIAS = int(os.getenv('HORIZONTE_FIRMAS_DIAS', '90'))
+
+# Dias en los que un titulo casi igual a otro publicado (con otro ASIN) se descarta
+DIAS_VENTANA_REEDICIONES = int(os.getenv('DIAS_VENTANA_REEDICIONES', '30'))
+
+_PRIMO_MINHASH = (1 << 61) - 1
+_generador_minhash = random.Random(PERMUTACIONES_MINHASH)
+# Permutaciones (a*x + b) mod p fijas: las firmas guardadas valen entre ejecuciones
+_COEFICIENTES_MINHASH = tuple(
+    (_generador_minhash.randrange(1, _PRIMO_MINHASH), _generador_minhash.randrange(0, _PRIMO_MINHASH))
+    for _ in range(PERMUTACIONES_MINHASH)
+)
+_FORMATO_FIRMA = f">{PERMUTACIONES_MINHASH}I"
+
+
+def firma_minhash(palabras):
+    """Firma MinHash (tupla de PERMUTACIONES_MINHASH enteros de 32 bits) de un conjunto de palabras, o None si esta vacio."""
+    if not palabras:
+        return None
+    bases = [int.from_bytes(hashlib.blake2b(p.encode('utf-8'), digest_size=8).digest(), 'big') for p in palabras]
+    return tuple(
+        min((a * x + b) % _PRIMO_MINHASH for x in bases) & 0xFFFFFFFF
+        for a, b in _COEFICIENTES_MINHASH
+    )
+
+
+def codificar_firma(firma):
+    """Firma -> texto base64 (256 bytes empaquetados) para el historial JSON."""
+    return base64.b64encode(struct.pack(_FORMATO_FIRMA, *firma)).decode('ascii')
+
+
+def decodificar_firma(texto):
+    return struct.unpack(_FORMATO_FIRMA, base64.b64decode(texto))
+
+
+def _parametros_lsh(umbral):
+    """
+    (bandas, filas) con bandas * filas = PERMUTACIONES_MINHASH cuyo umbral LSH
+    aproximado (1/bandas)^(1/filas) es el mayor que no supera el umbral pedido:
+    asi casi no se pierden parejas por encima del umbral.
+    """
+    opciones = [
+        (PERMUTACIONES_MINHASH // filas, filas)
+        for filas in range(1, PERMUTACIONES_MINHASH + 1) if PERMUTACIONES_MINHASH % filas == 0
+    ]
+    validas = [o for o in opciones if (1 / o[0]) ** (1 / o[1]) <= umbral]
+    return max(validas, key=lambda o: (1 / o[0]) ** (1 / o[1])) if validas else opciones[0]
+
+
+# Palabras con cifras de un titulo: talla, plataforma, año, capacidad ('3', 'ps5', '260ml')
+_RE_NUMERO_TITULO = re.compile(r'\b[a-záéíóúñü]*\d[a-záéíóúñü\d]*\b')
+
+
+def numeros_titulo(titulo):
+    """
+    Texto con las palabras con cifras del titulo, ordenadas ('25 ps5'). normalizar_titulo
+    las descarta, asi que dos titulos que solo difieren en ellas (Talla 3 / Talla 5,
+    PS4 / PS5, FC 25 / FC 26) tienen la misma firma: no son reedicion si esto difiere.
+    """
+    return ' '.join(sorted(set(_RE_NUMERO_TITULO.findall(titulo.lower()))))
+
+
+class DetectorReediciones:
+    """
+    Detecta titulos casi iguales a otros publicados (reediciones con otro ASIN)
+    entre meses de historial sin compararlos uno a uno.
+
+    Guarda una firma MinHash por ASIN publicado y las indexa por bandas (LSH):
+    un titulo solo se compara con los que coinciden con el en alguna banda, y
+    es reedicion si el Jaccard estimado con alguno llega a `umbral` y tienen
+    las mismas palabras con cifras (numeros_titulo).
+    """
+
+    def __init__(self, umbral=UMBRAL_REEDICION):
+        self.umbral = umbral
+        self.bandas, self.filas = _parametros_lsh(umbral)
+        self._firmas = {}   # asin -> (instante, firma, numeros)
+        self._cubos = {}    # (banda, valores de la banda) -> set de asins
+
+    def __len__(self):
+        return len(self._firmas)
+
+    def _claves_bandas(self, firma):
+        return [(b, firma[b * self.filas:(b + 1) * self.filas]) for b in range(self.bandas)]
+
+    def agregar(self, asin, titulo=None, instante=None, firma=None, numeros=None):
+        """Añade el titulo publicado de un ASIN (o su firma y numeros ya calculados)."""
+        if firma is None:
+            firma = firma_minhash(_palabras_titulo(titulo or ''))
+        if firma is None:
+            return
+        if numeros is None:
+            numeros = numeros_titulo(titulo or '')
+        self._firmas[asin] = (instante or datetime.now(), tuple(firma), numeros)
+        for clave in self._claves_bandas(firma):
+            self._cubos.setdefault(clave, set()).add(asin)
+
+    def reedicion_de(self, titulo, desde=None, excluir_asin=None):
+        """
+        ASIN publicado (despues de `desde`, si se indica) cuyo titulo es casi igual
+        al dado, o None.
+        """
+        firma = firma_minhash(_palabras_titulo(titulo))
+        if firma is None:
+            return None
+        numeros = numeros_titulo(titulo)
+        candidatos = set()
+        for clave in self._claves_bandas(firma):
+            candidatos |= self._cubos.get(clave, set())
+        for asin in sorted(candidatos):
+            if asin == excluir_asin:
+                continue
+            instante, firma_publicada, numeros_publicados = self._firmas[asin]
+            if (desde is not None and instante < desde) or numeros_publicados != numeros:
+                continue
+            iguales = sum(1 for x, y in zip(firma, firma_publicada) if x == y)
+            if iguales / PERMUTACIONES_MINHASH >= self.umbral:
+                return asin
+        return None
+
+    def a_json(self, horizonte_dias=HORIZONTE_FIRMAS_DIAS):
+        """
+        Firmas de los ultimos `horizonte_dias` para save_posted_deals:
+        {asin: [instante ISO, firma codificada, numeros_titulo]}.
+        """
+        limite = datetime.now() - timedelta(days=horizonte_dias)
+        return {
+            asin: [instante.isoformat(), codificar_firma(firma), numeros]
+            for asin, (instante, firma, numeros) in self._firmas.items()
+            if instante > limite
+        }
+
+    @classmethod
+    def desde_json(cls, firmas, umbral=UMBRAL_REEDICION, horizonte_dias=HORIZONTE_FIRMAS_DIAS):
+        """Detector con las firmas de cargar_firmas_titulos (ignora las invalidas o fuera de horizonte)."""
+        detector = cls(umbral)
+        limite = datetime.now() - timedelta(days=horizonte_dias)
+        for asin, valor in firmas.items():
+            try:
+                instante = datetime.fromisoformat(valor[0])
+                firma = decodificar_firma(valor[1])
+                numeros = valor[2]
+            except (ValueError, TypeError, IndexError, struct.error):
+                continue
+            if instante > limite and isinstance(numeros, str):
+                detector.agregar(asin, instante=instante, firma=firma, numeros=numeros)
+        return detector
+
+
 # Constante para detectar variantes (colores, tamaños, etc.)
 PALABRAS_VARIANTE = {
     'rojo', 'roja', 'azul', 'verde', 'rosa', 'negro', 'negra',
@@ -231,8 +638,8 @@ def son_variantes(titulo1, titulo2):
     Nota: identificadores de plataforma como PS4/PS5 son automáticamente
     invisibles porque el regex de normalizar_titulo extrae solo letras.
     """
-    palabras1 = normalizar_titulo(titulo1)
-    palabras2 = normalizar_titulo(titulo2)
+    palabras1 = _palabras_titulo(titulo1)
+    palabras2 = _palabras_titulo(titulo2)
 
     if not palabras1 or not palabras2:
         return False
@@ -330,19 +737,133 @@ def agrupar_variantes(mejores_por_categoria):
     return resultado
 
 
-def obtener_prioridad_marca(titulo, marcas):
+# --- Producto ---
+
+def precio_a_centimos(precio):
     """
-    Extrae la marca del titulo y retorna su prioridad según la lista de marcas.
-    - 1: marca prioritaria encontrada
-    - 0: sin marca prioritaria
+    Convierte un precio de Amazon.es ("29,99€", "1.299,00 €") a centimos enteros.
+    Retorna None si el texto no es un precio.
+    """
+    if not precio:
+        return None
+    texto = precio.replace('€', '').replace('\xa0', '').replace(' ', '')
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    try:
+        return int(round(float(texto) * 100))
+    except ValueError:
+        return None
+
+
+def centimos_a_texto(centimos):
+    """Formatea centimos como los precios de Amazon.es: 129999 -> "1.299,99€"."""
+    return f"{centimos // 100:,}".replace(',', '.') + f",{centimos % 100:02d}€"
+
+
+class Producto(Mapping):
+    """
+    Producto extraido de una busqueda, con los precios ya convertidos a centimos.
+
+    Se lee como un dict con las mismas claves que antes (asin, titulo, precio, ...),
+    asi que el formateador, los logs y los tests lo usan igual; compara igual que
+    el dict equivalente y dict(producto) lo convierte para guardarlo en JSON.
+    Admite asignar claves (producto['precio'] = ... recalcula sus centimos, como
+    hace _aplicar_detalle) pero no borrarlas. Los campos van en __slots__ y las
+    claves extra que se asignen despues (p.ej. 'variantes_adicionales') en un
+    dict aparte que solo se crea si hace falta.
     """
+
+    CAMPOS = (
+        'asin', 'titulo', 'precio', 'precio_anterior', 'descuento',
+        'valoraciones', 'ventas', 'imagen', 'url', 'tiene_oferta',
+    )
+    __slots__ = CAMPOS + ('precio_cent', 'precio_anterior_cent', '_extra')
+
+    def __init__(self, asin, titulo, precio, precio_anterior, descuento, valoraciones, ventas,
+                 imagen, url, tiene_oferta, precio_cent=None, precio_anterior_cent=None):
+        self.asin = asin
+        self.titulo = titulo
+        self.precio = precio
+        self.precio_anterior = precio_anterior
+        self.descuento = descuento
+        self.valoraciones = valoraciones
+        self.ventas = ventas
+        self.imagen = imagen
+        self.url = url
+        self.tiene_oferta = tiene_oferta
+        self.precio_cent = precio_cent if precio_cent is not None else precio_a_centimos(precio)
+        self.precio_anterior_cent = (
+            precio_anterior_cent if precio_anterior_cent is not None else precio_a_centimos(precio_anterior)
+        )
+        self._extra = None
+
+    def __getitem__(self, clave):
+        if clave in Producto.CAMPOS:
+            return getattr(self, clave)
+        if self._extra is not None and clave in self._extra:
+            return self._extra[clave]
+        raise KeyError(clave)
+
+    def __setitem__(self, clave, valor):
+        if clave in Producto.CAMPOS:
+            setattr(self, clave, valor)
+            if clave == 'precio':
+                self.precio_cent = precio_a_centimos(valor)
+            elif clave == 'precio_anterior':
+                self.precio_anterior_cent = precio_a_centimos(valor)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[clave] = valor
+
+    def __iter__(self):
+        yield from Producto.CAMPOS
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return len(Producto.CAMPOS) + (len(self._extra) if self._extra else 0)
+
+    def __repr__(self):
+        return f"Producto({dict(self)!r})"
+
+    def copy(self):
+        """Copia superficial, como dict.copy()."""
+        copia = Producto(*(getattr(self, c) for c in Producto.CAMPOS),
+                         precio_cent=self.precio_cent, precio_anterior_cent=self.precio_anterior_cent)
+        if self._extra:
+            copia._extra = dict(self._extra)
+        return copia
+
+
+def _centimos(producto, clave):
+    """Precio en centimos de un Producto (ya calculado) o de un dict (se parsea)."""
+    if isinstance(producto, Producto):
+        return getattr(producto, clave + '_cent')
+    return precio_a_centimos(producto.get(clave))
+
+
+@functools.lru_cache(maxsize=4096)
+def _prioridad_marca(titulo, marcas):
     titulo_lower = titulo.lower()
     for marca in marcas:
-        if marca.lower() in titulo_lower:
+        if marca in titulo_lower:
             return 1
     return 0
 
 
+def obtener_prioridad_marca(titulo, marcas):
+    """
+    Extrae la marca del titulo y retorna su prioridad según la lista de marcas.
+    - 1: marca prioritaria encontrada
+    - 0: sin marca prioritaria
+
+    El resultado se memoriza por (titulo, marcas): las ordenaciones y los logs de
+    cada ejecucion lo piden varias veces para el mismo producto.
+    """
+    return _prioridad_marca(titulo, tuple(marca.lower() for marca in marcas))
+
+
 def send_telegram_message(message, token, chat_id):
     """Envia un mensaje al canal de Telegram especificado."""
     url = f"https://api.telegram.org/bot{token}/sendMessage"
@@ -404,13 +925,11 @@ def format_telegram_message(producto, categoria):
     # Calcular descuento si hay precio anterior
     descuento_texto = ""
     if precio_anterior_raw:
-        try:
-            precio_num = float(producto['precio'].replace('€', '').replace(',', '.').strip())
-            precio_ant_num = float(precio_anterior_raw.replace('€', '').replace(',', '.').strip())
-            descuento = ((precio_ant_num - precio_num) / precio_ant_num) * 100
+        precio_cent = _centimos(producto, 'precio')
+        precio_ant_cent = _centimos(producto, 'precio_anterior')
+        if precio_cent is not None and precio_ant_cent:
+            descuento = ((precio_ant_cent - precio_cent) / precio_ant_cent) * 100
             descuento_texto = f" (-{descuento:.0f}%)"
-        except:
-            descuento_texto = ""
 
     variantes = producto.get('variantes_adicionales', [])
 
@@ -432,8 +951,8 @@ def format_telegram_message(producto, categoria):
                 return palabras_plataforma[0].upper()
 
             # Fallback: extraer palabras del título que no estén en la base
-            palabras_base = normalizar_titulo(titulo_base)
-            palabras_completo = normalizar_titulo(titulo_completo)
+            palabras_base = _palabras_titulo(titulo_base)
+            palabras_completo = _palabras_titulo(titulo_completo)
             diferencia = palabras_completo - palabras_base
             if diferencia:
                 return list(diferencia)[0].upper()
@@ -475,18 +994,538 @@ def format_telegram_message(producto, categoria):
     return message
 
 
-def obtener_pagina(url, reintentos=3):
-    """Obtiene el contenido HTML de una pagina con reintentos."""
+# --- Descarga de paginas ---
+
+# Numero maximo de descargas simultaneas en obtener_paginas
+MAX_DESCARGAS_PARALELAS = 4
+
+
+# Ritmo de peticiones a Amazon: media de ~3s entre peticiones (2.5s + jitter medio
+# de 0.5s), igual que el antiguo sleep aleatorio de 2-4s, pero sin esperar mientras
+# quede presupuesto (rafaga)
+TASA_PETICIONES = 0.4       # peticiones por segundo en regimen sostenido
+RAFAGA_PETICIONES = 2       # peticiones que pueden salir sin esperar
+JITTER_PETICIONES = 1.0     # segundos aleatorios extra (0..jitter) cuando hay que esperar
+
+
+class LimitadorTokens:
+    """
+    Limitador de peticiones tipo token bucket compartido por hilos y corrutinas.
+
+    El cubo se rellena a `tasa` tokens/s hasta `rafaga`. Cada peticion consume un
+    token; si no quedan, reserva el siguiente hueco (mas un jitter aleatorio) y
+    solo entonces espera. Asi la primera peticion de una ejecucion, o las que ya
+    llegan espaciadas por el parseo, salen sin esperar, y el ritmo medio contra
+    amazon.es sigue siendo el mismo.
+    """
+
+    def __init__(self, tasa=TASA_PETICIONES, rafaga=RAFAGA_PETICIONES, jitter=JITTER_PETICIONES, reloj=time.monotonic):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.jitter = jitter
+        self._reloj = reloj
+        self._lock = threading.Lock()
+        self._tokens = float(rafaga)
+        self._actualizado = reloj()
+
+    def _recargar(self):
+        ahora = self._reloj()
+        self._tokens = min(float(self.rafaga), self._tokens + (ahora - self._actualizado) * self.tasa)
+        self._actualizado = ahora
+
+    def reservar_turno(self):
+        """Consume un token y devuelve los segundos a esperar antes de la peticion (0 si hay presupuesto)."""
+        with self._lock:
+            self._recargar()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            # Sin presupuesto: el jitter tambien se reserva para que las esperas
+            # de varios hilos no se solapen
+            self._tokens -= random.uniform(0, self.jitter) * self.tasa
+            return -self._tokens / self.tasa
+
+    def esperar_turno(self):
+        """Bloquea el hilo actual hasta que le toque hacer su peticion."""
+        espera = self.reservar_turno()
+        if espera > 0:
+            time.sleep(espera)
+
+    def penalizar(self, segundos):
+        """Retrasa `segundos` el siguiente turno de todos los llamantes (p.ej. tras un error)."""
+        with self._lock:
+            self._recargar()
+            self._tokens = min(self._tokens, 0.0) - segundos * self.tasa
+
+
+# Limitador global compartido por todas las llamadas a obtener_pagina y
+# obtener_pagina_async. Se puede sustituir por cualquier objeto con
+# reservar_turno/esperar_turno/penalizar.
+limitador = LimitadorTokens()
+
+
+# --- Lectura en streaming de paginas de busqueda ---
+
+# Numero de resultados de busqueda que se procesan por pagina
+MAX_RESULTADOS_BUSQUEDA = 20
+
+# Tamaño de los bloques leidos de la respuesta en modo streaming
+TAMANO_BLOQUE_STREAMING = 16 * 1024
+
+
+class LectorResultados(HTMLParser):
+    """
+    Tokenizador HTML incremental que lee una pagina de busqueda por bloques y
+    avisa en cuanto se han cerrado `max_resultados` nodos s-search-result.
+
+    Solo sigue la profundidad de los <div> dentro de cada resultado, que es lo
+    que delimita el nodo, asi que etiquetas vacias o sin cerrar no le afectan.
+    El texto acumulado es un prefijo del documento: BeautifulSoup lo parsea
+    igual que la pagina completa en lo que respecta a esos primeros resultados.
+    """
+
+    def __init__(self, max_resultados=MAX_RESULTADOS_BUSQUEDA):
+        super().__init__(convert_charrefs=False)
+        self.max_resultados = max_resultados
+        self.resultados = 0
+        self._profundidad = 0
+        self._partes = []
+
+    @property
+    def completo(self):
+        return self.resultados >= self.max_resultados
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'div':
+            return
+        if self._profundidad:
+            self._profundidad += 1
+        elif ('data-component-type', 's-search-result') in attrs:
+            self._profundidad = 1
+
+    def handle_endtag(self, tag):
+        if tag == 'div' and self._profundidad:
+            self._profundidad -= 1
+            if not self._profundidad:
+                self.resultados += 1
+
+    def alimentar(self, texto):
+        """Añade un bloque de texto decodificado. Devuelve True cuando ya hay suficientes resultados."""
+        self._partes.append(texto)
+        if not self.completo:
+            self.feed(texto)
+        return self.completo
+
+    def texto(self):
+        return ''.join(self._partes)
+
+
+def _clave_cache_http(url, max_resultados):
+    """Clave de cache: las paginas leidas en streaming se guardan aparte de las completas."""
+    return f"{url}#resultados={max_resultados}" if max_resultados else url
+
+
+def _leer_respuesta(response, max_resultados):
+    """
+    Lee el cuerpo de una respuesta requests abierta con stream=True.
+
+    Con max_resultados, va pasando los bloques por LectorResultados y deja de leer
+    (el llamante cierra la conexion) en cuanto hay suficientes resultados completos.
+    Anota en las estadisticas de transferencia los bytes recibidos por la red
+    (comprimidos) y los bytes de HTML resultantes.
+    """
+    if not max_resultados:
+        texto = response.text
+        registrar_transferencia(response.url, response.raw.tell(), len(response.content),
+                                response.headers.get('Content-Encoding'))
+        return texto
+    decodificador = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    lector = LectorResultados(max_resultados)
+    bytes_html = 0
+    for bloque in response.iter_content(chunk_size=TAMANO_BLOQUE_STREAMING):
+        bytes_html += len(bloque)
+        if lector.alimentar(decodificador.decode(bloque)):
+            log.debug("Streaming cortado tras %d resultados: %s", lector.resultados, response.url)
+            break
+    else:
+        lector.alimentar(decodificador.decode(b'', final=True))
+    registrar_transferencia(response.url, response.raw.tell(), bytes_html, response.headers.get('Content-Encoding'))
+    return lector.texto()
+
+
+async def _leer_respuesta_async(response, max_resultados):
+    """Equivalente de _leer_respuesta para una respuesta httpx abierta con cliente.stream()."""
+    if not max_resultados:
+        await response.aread()
+        registrar_transferencia(str(response.url), response.num_bytes_downloaded, len(response.content),
+                                response.headers.get('Content-Encoding'))
+        return response.text
+    decodificador = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    lector = LectorResultados(max_resultados)
+    bytes_html = 0
+    async for bloque in response.aiter_bytes(TAMANO_BLOQUE_STREAMING):
+        bytes_html += len(bloque)
+        if lector.alimentar(decodificador.decode(bloque)):
+            log.debug("Streaming cortado tras %d resultados: %s", lector.resultados, response.url)
+            break
+    else:
+        lector.alimentar(decodificador.decode(b'', final=True))
+    registrar_transferencia(str(response.url), response.num_bytes_downloaded, bytes_html,
+                            response.headers.get('Content-Encoding'))
+    return lector.texto()
+
+
+# --- Estadisticas de transferencia ---
+
+# Acumulado desde el ultimo log_resumen_transferencia (compartido por hilos y corrutinas)
+_transferencia = {'peticiones': 0, 'bytes_red': 0, 'bytes_html': 0}
+_lock_transferencia = threading.Lock()
+
+
+def registrar_transferencia(url, bytes_red, bytes_html, codificacion=None):
+    """Suma una respuesta a las estadisticas: bytes_red son los recibidos (comprimidos), bytes_html los descomprimidos."""
+    with _lock_transferencia:
+        _transferencia['peticiones'] += 1
+        _transferencia['bytes_red'] += bytes_red
+        _transferencia['bytes_html'] += bytes_html
+    log.debug(
+        "Transferencia: %.1f KB por red -> %.1f KB de HTML (%s) | %s",
+        bytes_red / 1024, bytes_html / 1024, codificacion or 'sin comprimir', url
+    )
+
+
+def resumen_transferencia(reiniciar=False):
+    """Devuelve una copia de las estadisticas de transferencia acumuladas (y las pone a cero si reiniciar)."""
+    with _lock_transferencia:
+        resumen = dict(_transferencia)
+        if reiniciar:
+            for clave in _transferencia:
+                _transferencia[clave] = 0
+    return resumen
+
+
+def log_resumen_transferencia():
+    """Escribe en el log el ancho de banda consumido desde el ultimo resumen y reinicia los contadores."""
+    resumen = resumen_transferencia(reiniciar=True)
+    if not resumen['peticiones']:
+        return resumen
+    ahorro = 100 * (1 - resumen['bytes_red'] / resumen['bytes_html']) if resumen['bytes_html'] else 0
+    log.info(
+        "Transferencia: %d peticiones, %.1f KB por red, %.1f KB de HTML (compresion %.0f%%)",
+        resumen['peticiones'], resumen['bytes_red'] / 1024, resumen['bytes_html'] / 1024, ahorro
+    )
+    return resumen
+
+
+# --- Cache HTTP en disco ---
+
+# Directorio para caches locales (no se versiona)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+# Respuestas HTTP cacheadas, una entrada JSON por URL
+CACHE_HTTP_DIR = os.path.join(CACHE_DIR, "http")
+
+# Segundos durante los que una respuesta cacheada se sirve sin tocar la red.
+# Pasado el TTL se revalida con If-None-Match/If-Modified-Since si hay ETag/Last-Modified.
+# 0 desactiva la cache.
+CACHE_HTTP_TTL = int(os.getenv('CACHE_HTTP_TTL', '600'))
+
+# Tamaño maximo en bytes del directorio de la cache HTTP. Al guardar, si se supera,
+# se borran las entradas escritas hace mas tiempo
+CACHE_HTTP_MAX_BYTES = int(os.getenv('CACHE_HTTP_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# Reloj de pared de las caches y las cookies. Los tests lo sustituyen a el y no a
+# time.time, del que dependen los handlers de logging con rotacion por fecha
+reloj_pared = time.time
+
+
+def _ruta_cache_http(url):
+    return os.path.join(CACHE_HTTP_DIR, hashlib.sha1(url.encode('utf-8')).hexdigest() + ".json")
+
+
+def leer_cache_http(url):
+    """Devuelve la entrada cacheada de una URL (dict con cuerpo, obtenido, etag, last_modified) o None."""
+    if CACHE_HTTP_TTL <= 0:
+        return None
+    try:
+        with open(_ruta_cache_http(url), 'r', encoding='utf-8') as f:
+            entrada = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entrada, dict) or entrada.get('url') != url or 'cuerpo' not in entrada:
+        return None
+    return entrada
+
+
+def guardar_cache_http(url, cuerpo, etag=None, last_modified=None):
+    """Guarda (de forma atomica) la respuesta de una URL en la cache HTTP."""
+    if CACHE_HTTP_TTL <= 0:
+        return
+    entrada = {
+        'url': url,
+        'obtenido': reloj_pared(),
+        'etag': etag,
+        'last_modified': last_modified,
+        'cuerpo': cuerpo,
+    }
+    ruta = _ruta_cache_http(url)
+    try:
+        _escribir_json_atomico(ruta, entrada)
+    except OSError as e:
+        log.debug("No se pudo escribir la cache HTTP de %s: %s", url, e)
+        return
+    podar_cache_http()
+
+
+def podar_cache_http(max_bytes=None):
+    """Borra las entradas mas antiguas de la cache HTTP hasta dejarla por debajo de max_bytes."""
+    if max_bytes is None:
+        max_bytes = CACHE_HTTP_MAX_BYTES
+    entradas = []
+    try:
+        with os.scandir(CACHE_HTTP_DIR) as it:
+            for e in it:
+                if e.name.endswith('.json'):
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    entradas.append((st.st_mtime, st.st_size, e.path))
+    except OSError:
+        return
+    total = sum(tam for _, tam, _ in entradas)
+    if total <= max_bytes:
+        return
+    for _, tam, ruta in sorted(entradas):
+        try:
+            os.remove(ruta)
+        except OSError:
+            continue
+        total -= tam
+        if total <= max_bytes:
+            break
+
+
+def _cache_http_vigente(entrada):
+    return entrada is not None and reloj_pared() - entrada.get('obtenido', 0) < CACHE_HTTP_TTL
+
+
+def _cabeceras_revalidacion(entrada):
+    """Cabeceras condicionales para revalidar una entrada caducada de la cache."""
+    cabeceras = {}
+    if entrada:
+        if entrada.get('etag'):
+            cabeceras['If-None-Match'] = entrada['etag']
+        if entrada.get('last_modified'):
+            cabeceras['If-Modified-Since'] = entrada['last_modified']
+    return cabeceras
+
+
+# --- Cookies persistentes entre ejecuciones ---
+
+def ruta_cookies(canal):
+    """
+    Fichero de cookies de un canal dentro de CACHE_DIR. En GitHub Actions ese
+    directorio se conserva entre ejecuciones con actions/cache.
+    """
+    return os.path.join(CACHE_DIR, f"cookies_{canal}.json")
+
+
+def cargar_cookies(filepath, jar=None):
+    """
+    Carga en la sesion las cookies guardadas por una ejecucion anterior.
+
+    Las cookies caducadas se descartan. Un fichero inexistente o corrupto se
+    ignora (se empieza con la sesion vacia, como hasta ahora).
+
+    Retorna el numero de cookies cargadas.
+    """
+    if jar is None:
+        jar = session.cookies
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            guardadas = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as e:
+        log.warning("No se pudieron leer las cookies de %s: %s", filepath, e)
+        return 0
+
+    ahora = reloj_pared()
+    cargadas = 0
+    for datos in guardadas:
+        try:
+            if datos['expires'] <= ahora:
+                continue
+            jar.set_cookie(requests.cookies.create_cookie(
+                datos['name'], datos['value'],
+                domain=datos['domain'], path=datos['path'],
+                secure=datos['secure'], expires=datos['expires'],
+            ))
+        except (KeyError, TypeError) as e:
+            log.debug("Cookie guardada invalida (%s): %s", e, datos)
+            continue
+        cargadas += 1
+    log.debug("Cookies cargadas de %s: %d", filepath, cargadas)
+    return cargadas
+
+
+def guardar_cookies(filepath, jar=None):
+    """
+    Guarda (de forma atomica) las cookies persistentes de la sesion.
+
+    Solo se guardan las cookies con fecha de caducidad que sigan vigentes: las de
+    sesion (sin expires) no sobreviven al cierre, igual que en un navegador.
+
+    Retorna el numero de cookies guardadas.
+    """
+    if jar is None:
+        jar = session.cookies
+    ahora = reloj_pared()
+    cookies = [
+        {
+            'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+            'secure': c.secure, 'expires': c.expires,
+        }
+        for c in jar
+        if c.expires is not None and c.expires > ahora
+    ]
+    try:
+        _escribir_json_atomico(filepath, cookies)
+    except OSError as e:
+        log.warning("No se pudieron guardar las cookies en %s: %s", filepath, e)
+        return 0
+    log.debug("Cookies guardadas en %s: %d", filepath, len(cookies))
+    return len(cookies)
+
+
+# --- Deteccion de bloqueos (captcha / robot check) ---
+
+# Marcas (en minusculas) de las paginas de captcha y de "sorry" que Amazon
+# devuelve con 200 OK (o 503) en lugar de los resultados de busqueda
+MARCAS_BLOQUEO = (
+    ('/errors/validatecaptcha', 'captcha'),
+    ('introduce los caracteres que ves', 'captcha'),
+    ('enter the characters you see below', 'captcha'),
+    ('asegurarnos de que no eres un robot', 'robot check'),
+    ("make sure you're not a robot", 'robot check'),
+    ('api-services-support@amazon.com', 'robot check'),
+    ('sorry! something went wrong', 'sorry'),
+    ('lo sentimos. algo ha ido mal', 'sorry'),
+)
+
+# Las paginas de bloqueo son pequeñas: basta con mirar el principio del documento
+BYTES_DETECCION_BLOQUEO = 64 * 1024
+
+# Segundos que frena el limitador cuando Amazon devuelve una pagina de bloqueo
+ESPERA_TRAS_BLOQUEO = 120
+
+# Instante (time.monotonic) del ultimo bloqueo detectado
+_ultimo_bloqueo = None
+
+
+class PaginaBloqueada:
+    """
+    Resultado de obtener_pagina cuando Amazon responde con un captcha o una
+    pagina de "sorry" en lugar del HTML pedido.
+
+    Es falsy, asi que el codigo que hace `if not html_content` la trata como una
+    pagina fallida; quien quiera distinguirla usa isinstance().
+    """
+
+    __slots__ = ('url', 'motivo')
+
+    def __init__(self, url, motivo):
+        self.url = url
+        self.motivo = motivo
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return f"PaginaBloqueada({self.url!r}, {self.motivo!r})"
+
+
+def detectar_bloqueo(html_content):
+    """Devuelve el motivo ('captcha', 'robot check', 'sorry') si el HTML es una pagina de bloqueo, o None."""
+    if not html_content:
+        return None
+    inicio = html_content[:BYTES_DETECCION_BLOQUEO].lower()
+    for marca, motivo in MARCAS_BLOQUEO:
+        if marca in inicio:
+            return motivo
+    return None
+
+
+def _registrar_bloqueo(url, html_content):
+    """Si el HTML es una pagina de bloqueo, frena el limitador y devuelve PaginaBloqueada."""
+    global _ultimo_bloqueo
+    motivo = detectar_bloqueo(html_content)
+    if motivo is None:
+        return None
+    _ultimo_bloqueo = time.monotonic()
+    limitador.penalizar(ESPERA_TRAS_BLOQUEO)
+    log.warning("Amazon ha devuelto una pagina de bloqueo (%s): %s", motivo, url)
+    return PaginaBloqueada(url, motivo)
+
+
+def _bloqueado_desde(instante):
+    """True si se ha detectado un bloqueo despues de `instante` (time.monotonic)."""
+    return _ultimo_bloqueo is not None and _ultimo_bloqueo >= instante
+
+
+def obtener_pagina(url, reintentos=3, max_resultados=MAX_RESULTADOS_BUSQUEDA, usar_cache=True):
+    """
+    Obtiene el contenido HTML de una pagina con reintentos.
+
+    La respuesta se lee en streaming: en paginas de busqueda se corta la conexion
+    en cuanto se han recibido `max_resultados` nodos s-search-result completos y
+    se devuelve ese prefijo del documento. Paginas sin resultados (p.ej. /dp/) se
+    leen enteras; max_resultados=None fuerza la lectura completa.
+
+    Pasa por la cache HTTP en disco: dentro del TTL devuelve el cuerpo cacheado sin
+    peticion ni espera de cortesia; fuera del TTL revalida con ETag/Last-Modified
+    y un 304 reutiliza el cuerpo guardado. Con usar_cache=False ni la lee ni la
+    escribe (paginas grandes que ya tienen su propia cache, como /dp/).
+
+    Si Amazon responde con un captcha o una pagina de "sorry" devuelve
+    PaginaBloqueada sin reintentar, y las peticiones que estaban esperando turno
+    desde antes del bloqueo tambien se abandonan.
+    """
+    clave = _clave_cache_http(url, max_resultados)
+    entrada = leer_cache_http(clave) if usar_cache else None
+    if _cache_http_vigente(entrada):
+        log.debug("Cache HTTP vigente (hace %.0fs): %s", reloj_pared() - entrada['obtenido'], url)
+        return entrada['cuerpo']
+
     headers = HEADERS.copy()
     headers['Referer'] = 'https://www.amazon.es/'
+    headers.update(_cabeceras_revalidacion(entrada))
+    inicio = time.monotonic()
 
     for intento in range(reintentos):
         try:
-            # Delay aleatorio más largo para parecer humano
-            time.sleep(random.uniform(2, 4))
-            response = session.get(url, headers=headers, timeout=15)
+            # Turno del limitador compartido (solo espera si se agota la rafaga)
+            limitador.esperar_turno()
+            if _bloqueado_desde(inicio):
+                return PaginaBloqueada(url, 'omitida tras bloqueo')
+            response = session.get(url, headers=headers, timeout=15, stream=True)
+            try:
+                if response.status_code == 304 and entrada:
+                    log.debug("Cache HTTP revalidada (304): %s", url)
+                    registrar_transferencia(url, 0, 0)
+                    guardar_cache_http(clave, entrada['cuerpo'], entrada.get('etag'), entrada.get('last_modified'))
+                    return entrada['cuerpo']
+                cuerpo = _leer_respuesta(response, max_resultados)
+            finally:
+                response.close()
+            bloqueo = _registrar_bloqueo(url, cuerpo)
+            if bloqueo is not None:
+                return bloqueo
             response.raise_for_status()
-            return response.text
+            if usar_cache:
+                guardar_cache_http(clave, cuerpo, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return cuerpo
         except requests.RequestException as e:
             if intento < reintentos - 1:
                 wait_time = random.uniform(5, 10) * (intento + 1)
@@ -494,137 +1533,1288 @@ def obtener_pagina(url, reintentos=3):
                     "Error al obtener pagina (intento %d/%d): %s - Reintentando en %.0fs",
                     intento + 1, reintentos, e, wait_time
                 )
-                time.sleep(wait_time)
+                # La espera se aplica al limitador: todos los llamantes frenan, no solo este
+                limitador.penalizar(wait_time)
             else:
                 log.error("Fallo definitivo al obtener pagina tras %d intentos: %s | URL: %s", reintentos, e, url)
                 return None
 
 
-def extraer_productos_busqueda(html_content):
-    """Extrae productos de una pagina de busqueda de Amazon."""
-    productos = []
-    soup = BeautifulSoup(html_content, 'html.parser')
-    items = soup.select('[data-component-type="s-search-result"]')
+def obtener_paginas(urls, obtener=None, max_workers=MAX_DESCARGAS_PARALELAS):
+    """
+    Descarga varias paginas a la vez con un pool de hilos acotado.
+
+    El ritmo real contra Amazon lo marca el limitador compartido de obtener_pagina,
+    no el numero de hilos: el tiempo total pasa a ser el del limitador y no la suma
+    de esperas + descargas.
+
+    Args:
+        urls: Lista de URLs absolutas a descargar.
+        obtener: Funcion de descarga url -> HTML (por defecto obtener_pagina). Los
+            canales pasan la de su namespace para que los tests puedan parchearla.
+        max_workers: Numero maximo de descargas en vuelo.
+
+    Retorna lista con el HTML (None o PaginaBloqueada si falla) de cada URL, en el
+    mismo orden que `urls`.
+    """
+    if obtener is None:
+        obtener = obtener_pagina
+    if not urls:
+        return []
+
+    # En cuanto una descarga devuelve un bloqueo, las que aun no han empezado se
+    # abandonan sin gastar peticion
+    bloqueo = threading.Event()
+
+    def _obtener(url):
+        if bloqueo.is_set():
+            return PaginaBloqueada(url, 'omitida tras bloqueo')
+        resultado = obtener(url)
+        if isinstance(resultado, PaginaBloqueada):
+            bloqueo.set()
+        return resultado
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+        return list(executor.map(_obtener, urls))
+
+
+def descargar_paginas(urls, descargar=None, obtener=None, descargar_lote=None):
+    """
+    Descarga de golpe las paginas de `urls` con el motor del canal.
+
+    Args:
+        urls: Lista de URLs absolutas.
+        descargar: Funcion opcional lista de URLs -> lista de HTML (con max_resultados
+            opcional como obtener_pagina), p.ej. un envoltorio de obtener_paginas_async.
+        obtener, descargar_lote: obtener_pagina y obtener_paginas a usar sin `descargar`;
+            los canales pasan las de su namespace para que los tests puedan parchearlas.
+
+    Retorna tupla (dict url -> HTML, funcion url -> HTML para pedir las paginas
+    siguientes por el mismo motor).
+    """
+    if descargar is None:
+        obtener = obtener or obtener_pagina
+        descargar_lote = descargar_lote or obtener_paginas
+        return dict(zip(urls, descargar_lote(urls, obtener))), obtener
+
+    def obtener_extra(url):
+        return descargar([url])[0]
+
+    return dict(zip(urls, descargar(urls))), obtener_extra
+
+
+# --- Recorrido paginado de categorias ---
 
-    for item in items[:20]:  # Mas productos para encontrar ofertas
+# Paginas de resultados (&page=N) que se pueden recorrer por categoria, incluida la primera
+MAX_PAGINAS_CATEGORIA = int(os.getenv('MAX_PAGINAS_CATEGORIA', '3'))
+
+# Candidatos con descuento a partir de los cuales no merece la pena pedir mas paginas
+CANDIDATOS_POR_CATEGORIA = 5
+
+
+def url_pagina_busqueda(url, pagina):
+    """Devuelve la URL de la pagina `pagina` de una busqueda (la 1 es la URL original)."""
+    if pagina <= 1:
+        return url
+    separador = '&' if '?' in url else '?'
+    return f"{url}{separador}page={pagina}"
+
+
+def recorrer_paginas_categoria(url, html_primera, obtener=None, extraer=None, es_candidato=None,
+                               objetivo=CANDIDATOS_POR_CATEGORIA, max_paginas=MAX_PAGINAS_CATEGORIA, pedidas=None):
+    """
+    Extrae los productos de una categoria recorriendo sus paginas de resultados.
+
+    Parte del HTML de la primera pagina (ya descargado) y solo pide &page=2..N
+    mientras no se hayan reunido `objetivo` candidatos. Se detiene en cuanto una
+    pagina no aporta ninguna oferta nueva, falla o devuelve un bloqueo. Las
+    paginas extra pasan por `obtener`, y con ello por el limitador compartido.
+
+    Args:
+        url: URL de la primera pagina de la categoria.
+        html_primera: HTML de la primera pagina.
+        obtener: Funcion de descarga url -> HTML (por defecto obtener_pagina).
+        extraer: Funcion HTML -> productos (por defecto extraer_productos_busqueda).
+        es_candidato: Filtro opcional producto -> bool aplicado a las ofertas (p.ej.
+            descartar ASINs ya publicados) para decidir si hacen falta mas paginas.
+        objetivo: Numero de candidatos a partir del cual se deja de paginar.
+        max_paginas: Numero maximo de paginas, incluida la primera.
+        pedidas: Lista opcional a la que se añaden las URLs de las paginas extra pedidas.
+
+    Retorna la lista de productos de todas las paginas recorridas, sin ASINs repetidos.
+    """
+    if obtener is None:
+        obtener = obtener_pagina
+    if extraer is None:
+        extraer = extraer_productos_busqueda
+
+    def _candidatos(productos):
+        return [p for p in productos if p['tiene_oferta'] and (es_candidato is None or es_candidato(p))]
+
+    productos = extraer(html_primera)
+    vistos = {p['asin'] for p in productos}
+    candidatos = len(_candidatos(productos))
+
+    for pagina in range(2, max_paginas + 1):
+        if candidatos >= objetivo:
+            break
+        url_extra = url_pagina_busqueda(url, pagina)
+        if pedidas is not None:
+            pedidas.append(url_extra)
+        html_content = obtener(url_extra)
+        if isinstance(html_content, PaginaBloqueada):
+            log.warning("  Pagina %d bloqueada por Amazon (%s), fin del recorrido", pagina, html_content.motivo)
+            break
+        if not html_content:
+            log.debug("  No se pudo obtener la pagina %d, fin del recorrido", pagina)
+            break
+
+        nuevos = [p for p in extraer(html_content) if p['asin'] not in vistos]
+        vistos.update(p['asin'] for p in nuevos)
+        productos.extend(nuevos)
+        nuevos_candidatos = len(_candidatos(nuevos))
+        log.debug("  Pagina %d: %d productos nuevos (%d candidatos)", pagina, len(nuevos), nuevos_candidatos)
+        if not nuevos_candidatos:
+            break
+        candidatos += nuevos_candidatos
+
+    return productos
+
+
+def ranking_reutilizable(previa, huella, es_candidato=None, objetivo=CANDIDATOS_POR_CATEGORIA,
+                         max_paginas=MAX_PAGINAS_CATEGORIA):
+    """
+    Devuelve el ranking guardado de una categoria si sigue valiendo, o None.
+
+    La huella solo cubre la primera pagina, asi que solo se reutiliza un ranking que
+    salio de ella sola ('paginas' == 1) y que aun reune `objetivo` candidatos: en ese
+    caso recorrer_paginas_categoria tampoco pediria ahora la pagina 2.
+
+    Args:
+        previa: Entrada guardada de la categoria ({'huella', 'paginas', 'ofertas'}) o None.
+        huella: Huella de la primera pagina de esta ejecucion (huella_resultados).
+        es_candidato, objetivo, max_paginas: Los mismos que recorrer_paginas_categoria.
+    """
+    if not huella or not previa or previa.get('huella') != huella or previa.get('paginas') != 1:
+        return None
+    ofertas = previa.get('ofertas', [])
+    if max_paginas > 1:
+        candidatos = sum(1 for p in ofertas if es_candidato is None or es_candidato(p))
+        if candidatos < objetivo:
+            return None
+    return ofertas
+
+
+# --- Motor de descarga asincrono ---
+
+# Peticiones simultaneas maximas contra un mismo host en el motor asincrono
+MAX_PETICIONES_POR_HOST = 4
+
+# Cliente httpx compartido por todas las corrutinas (se crea bajo demanda)
+_cliente_async = None
+_semaforos_host = {}
+
+
+def _obtener_cliente_async():
+    """Devuelve el cliente httpx compartido, creandolo si aun no existe.
+
+    Comparte el cookie jar con `session`, asi las cookies de Amazon son las
+    mismas en el motor sincrono y en el asincrono.
+    """
+    global _cliente_async
+    if _cliente_async is None:
+        _cliente_async = httpx.AsyncClient(
+            headers=HEADERS,
+            cookies=session.cookies,
+            timeout=15,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=MAX_PETICIONES_POR_HOST * 2),
+        )
+    return _cliente_async
+
+
+def _semaforo_host(url):
+    """Semaforo que limita las peticiones simultaneas contra el host de la URL."""
+    host = urlsplit(url).netloc
+    semaforo = _semaforos_host.get(host)
+    if semaforo is None:
+        semaforo = _semaforos_host[host] = asyncio.Semaphore(MAX_PETICIONES_POR_HOST)
+    return semaforo
+
+
+async def cerrar_cliente_async():
+    """Cierra el cliente httpx compartido (llamar antes de cerrar el bucle de eventos)."""
+    global _cliente_async
+    if _cliente_async is not None:
+        await _cliente_async.aclose()
+        _cliente_async = None
+    _semaforos_host.clear()
+
+
+async def obtener_pagina_async(url, reintentos=3, max_resultados=MAX_RESULTADOS_BUSQUEDA, usar_cache=True):
+    """
+    Version asincrona de obtener_pagina (mismo streaming, cache y deteccion de bloqueos).
+
+    Usa el cliente httpx compartido, un limite de peticiones simultaneas por host
+    y el mismo limitador de cortesia que el motor sincrono. Sin httpx instalado,
+    ejecuta obtener_pagina en un hilo.
+    """
+    if httpx is None:
+        return await asyncio.to_thread(obtener_pagina, url, reintentos, max_resultados, usar_cache)
+
+    clave = _clave_cache_http(url, max_resultados)
+    entrada = leer_cache_http(clave) if usar_cache else None
+    if _cache_http_vigente(entrada):
+        log.debug("Cache HTTP vigente (hace %.0fs): %s", reloj_pared() - entrada['obtenido'], url)
+        return entrada['cuerpo']
+
+    cliente = _obtener_cliente_async()
+    headers = {'Referer': 'https://www.amazon.es/'}
+    headers.update(_cabeceras_revalidacion(entrada))
+    inicio = time.monotonic()
+
+    for intento in range(reintentos):
         try:
-            asin = item.get('data-asin', '')
-            if not asin:
+            async with _semaforo_host(url):
+                await asyncio.sleep(limitador.reservar_turno())
+                if _bloqueado_desde(inicio):
+                    return PaginaBloqueada(url, 'omitida tras bloqueo')
+                async with cliente.stream('GET', url, headers=headers) as response:
+                    if response.status_code == 304 and entrada:
+                        log.debug("Cache HTTP revalidada (304): %s", url)
+                        registrar_transferencia(url, 0, 0)
+                        guardar_cache_http(clave, entrada['cuerpo'], entrada.get('etag'), entrada.get('last_modified'))
+                        return entrada['cuerpo']
+                    cuerpo = await _leer_respuesta_async(response, max_resultados)
+            bloqueo = _registrar_bloqueo(url, cuerpo)
+            if bloqueo is not None:
+                return bloqueo
+            response.raise_for_status()
+            if usar_cache:
+                guardar_cache_http(clave, cuerpo, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return cuerpo
+        except httpx.HTTPError as e:
+            if intento < reintentos - 1:
+                wait_time = random.uniform(5, 10) * (intento + 1)
+                log.warning(
+                    "Error al obtener pagina (intento %d/%d): %s - Reintentando en %.0fs",
+                    intento + 1, reintentos, e, wait_time
+                )
+                limitador.penalizar(wait_time)
+            else:
+                log.error("Fallo definitivo al obtener pagina tras %d intentos: %s | URL: %s", reintentos, e, url)
+                return None
+
+
+async def obtener_paginas_async(urls, max_resultados=MAX_RESULTADOS_BUSQUEDA, usar_cache=True):
+    """
+    Descarga varias paginas de forma concurrente; mismo contrato que obtener_paginas.
+    max_resultados y usar_cache se pasan a obtener_pagina_async (0 y False para /dp/).
+    """
+    return list(await asyncio.gather(
+        *(obtener_pagina_async(url, max_resultados=max_resultados, usar_cache=usar_cache) for url in urls)
+    ))
+
+
+# Apertura de cada nodo de resultado y campos que cambian cuando cambia el ranking
+_RE_NODO_RESULTADO = re.compile(r'<div\b[^>]*data-component-type="s-search-result"[^>]*>')
+_RE_ASIN_NODO = re.compile(r'data-asin="([^"]*)"')
+_RE_PRECIO_NODO = re.compile(r'class="a-offscreen">([^<]*)<')
+_RE_PORCENTAJE_NODO = re.compile(r'-\s*(\d+)\s*%')
+
+
+def huella_resultados(html_content, max_resultados=MAX_RESULTADOS_BUSQUEDA):
+    """
+    Huella (sha1) de las tuplas ASIN/precios/descuento de los primeros resultados,
+    en orden, sacadas con expresiones regulares sin parsear el HTML.
+
+    Si la huella de una categoria coincide con la de la ejecucion anterior, el
+    ranking guardado entonces sigue siendo valido y no hace falta volver a
+    extraer ni ordenar. Incluye la configuracion de extraccion (como claves_items)
+    para que un cambio del extractor invalide los rankings guardados. Retorna None
+    si la pagina no tiene resultados.
+    """
+    if not html_content:
+        return None
+    # Se guarda un nodo de mas para acotar el fragmento del ultimo resultado
+    nodos = list(_RE_NODO_RESULTADO.finditer(html_content))[:max_resultados + 1]
+    if not nodos:
+        return None
+    huella = hashlib.sha1(
+        f"{VERSION_EXTRACCION}|{EXTRACCION_PEREZOSA:d}|{EXTRACCION_ESTRUCTURADA:d}\n".encode('utf-8')
+    )
+    for nodo, siguiente in zip(nodos[:max_resultados], nodos[1:] + [None]):
+        fragmento = html_content[nodo.end():siguiente.start() if siguiente else len(html_content)]
+        asin = _RE_ASIN_NODO.search(nodo.group(0))
+        porcentaje = _RE_PORCENTAJE_NODO.search(fragmento)
+        huella.update("{}|{}|{}\n".format(
+            asin.group(1) if asin else '',
+            '/'.join(_RE_PRECIO_NODO.findall(fragmento)[:2]),
+            porcentaje.group(1) if porcentaje else '',
+        ).encode('utf-8'))
+    return huella.hexdigest()
+
+
+# --- Parseo de HTML ---
+
+# Backend de BeautifulSoup para las paginas de Amazon. lxml es varias veces mas
+# rapido que html.parser en paginas de cientos de KB; PARSER_HTML=html.parser
+# fuerza el de la libreria estandar
+PARSER_HTML = os.getenv('PARSER_HTML') or ('lxml' if lxml is not None else 'html.parser')
+
+
+# Nodo de cada resultado de busqueda. Solo esos subarboles se convierten en Tags:
+# cabecera, menus, scripts, anuncios y pie se descartan durante el parseo
+SELECTOR_RESULTADO = '[data-component-type="s-search-result"]'
+FILTRO_RESULTADOS = SoupStrainer(attrs={'data-component-type': 's-search-result'})
+
+
+# Extraccion con selectolax cuando esta instalado; EXTRACCION_RAPIDA=0 fuerza BeautifulSoup
+EXTRACCION_RAPIDA = os.getenv('EXTRACCION_RAPIDA', '1') != '0'
+
+# En las busquedas, los resultados sin precio tachado o con cupon (que nunca son
+# oferta) se devuelven como esbozos sin valoraciones, ventas, imagen ni badge;
+# EXTRACCION_PEREZOSA=0 extrae todos los campos de todos
+EXTRACCION_PEREZOSA = os.getenv('EXTRACCION_PEREZOSA', '1') != '0'
+
+
+def parsear_html(html_content, parser=None, parse_only=None):
+    """Construye el BeautifulSoup de una pagina con el backend indicado (por defecto PARSER_HTML)."""
+    return BeautifulSoup(html_content, parser or PARSER_HTML, parse_only=parse_only)
+
+
+def obtener_items_busqueda(html_content, parser=None):
+    """Devuelve los nodos s-search-result de una pagina, construyendo solo esos subarboles."""
+    return parsear_html(html_content, parser, parse_only=FILTRO_RESULTADOS).select(SELECTOR_RESULTADO)
+
+
+# Selectores de los campos de cada resultado. Los usa tal cual la via rapida
+# (selectolax); en BeautifulSoup los resuelve _recorrer_item en una sola pasada.
+SEL_TITULO = 'h2 a span'
+SEL_TITULO_ALT = 'h2 span'
+# data-a-color="base" es el precio real del buy-box de Amazon.
+# Evitar data-a-color="secondary" (precio de marketplace, aparece primero en el DOM)
+# y data-a-strike="true" (precio antiguo tachado).
+SEL_PRECIO = '.a-price[data-a-color="base"] .a-offscreen'
+SEL_PRECIO_ALT = '.a-price:not([data-a-strike="true"]):not([data-a-color="secondary"]) .a-offscreen'
+SEL_PRECIO_ANTERIOR = '.a-price[data-a-strike="true"] .a-offscreen'
+SEL_CUPON = '.s-coupon-unclipped, .s-coupon-clipped'
+SEL_VALORACIONES = '.a-size-base.s-underline-text'
+SEL_VALORACIONES_ALT = '[aria-label*="estrellas"] + span'
+SEL_VENTAS = '.a-size-base.a-color-secondary'
+SEL_IMAGEN = 'img.s-image'
+
+# Badge de descuento oficial de Amazon. Intentamos varios selectores porque
+# Amazon cambia ocasionalmente los nombres de clase en su HTML.
+BADGE_SELECTORS = (
+    '.savingsPercentage',           # selector histórico (hasta ~mar 2026)
+    '.a-badge-text',                # variante de badge genérico
+    '[class*="savingsPercentage"]', # cualquier clase que contenga el nombre
+    '.s-coupon-highlight-color',    # badge de oferta flash/lightning
+)
+
+# Sin badge, precio tachado con al menos este descuento calculado = oferta real
+MIN_DESCUENTO_SIN_BADGE = 5.0
+
+# Datos estructurados de cada resultado: bloques JSON embebidos y aria-label del
+# enlace de valoraciones. El precio y el tachado del DOM van primero (son los que
+# ve el cliente); los del JSON solo cubren resultados sin precio en el DOM. Las
+# valoraciones si se toman primero de aqui (no dependen de los nombres de clase).
+EXTRACCION_ESTRUCTURADA = os.getenv('EXTRACCION_ESTRUCTURADA', '1') != '0'
+TIPOS_SCRIPT_JSON = ('application/json', 'a-state')
+SEL_DATOS_JSON = 'script[type="application/json"], script[type="a-state"]'
+SEL_ARIA_VALORACIONES = '[aria-label*="valoraci"]'
+
+# Rutas de la oferta principal dentro de cada bloque JSON, de la mas a la menos
+# fiable. Solo rutas fijas: las listas de ofertas de otros vendedores y los
+# precios de referencia (listPrice, PVP) no son el precio ni el tachado del resultado
+RUTAS_JSON_PRECIO = (('priceAmount',), ('offer', 'priceAmount'), ('displayPrice',), ('offer', 'displayPrice'))
+RUTAS_JSON_PRECIO_ANTERIOR = (('basisPrice',), ('offer', 'basisPrice'),
+                              ('strikethroughPrice',), ('offer', 'strikethroughPrice'))
+RUTAS_JSON_VALORACIONES = (('ratingCount',), ('totalReviewCount',), ('reviews', 'ratingCount'))
+
+_RE_PORCENTAJE = re.compile(r'(\d+)\s*%')
+_RE_VENTAS = re.compile(r'(\d+)[kK]?\+?')
+_RE_NO_DIGITOS = re.compile(r'[^\d]')
+_RE_ARIA_VALORACIONES = re.compile(r'^\s*([\d.,]+)\s+valoraci')
+
+
+def _valor_json(datos, rutas):
+    """Valor no vacio de la primera ruta (tupla de claves desde la raiz) que exista en el JSON."""
+    for ruta in rutas:
+        nodo = datos
+        for clave in ruta:
+            nodo = nodo.get(clave) if isinstance(nodo, dict) else None
+        if nodo not in (None, '', {}, []):
+            return nodo
+    return None
+
+
+def _centimos_json(valor):
+    """Precio de un bloque JSON (29.99, "29,99 €" o {"amount": 29.99}) en centimos."""
+    if isinstance(valor, dict):
+        valor = valor.get('amount', valor.get('value'))
+    if isinstance(valor, bool):
+        return None
+    if isinstance(valor, (int, float)):
+        return int(round(valor * 100))
+    if isinstance(valor, str):
+        return precio_a_centimos(valor)
+    return None
+
+
+def datos_estructurados(bloques_json, aria_valoraciones=None, asin=None):
+    """
+    Extrae de los datos estructurados de un resultado los campos que traigan:
+    {'precio_cent', 'precio_anterior_cent', 'valoraciones'} (solo los encontrados).
+
+    bloques_json: textos JSON embebidos en el resultado (los que no son JSON valido
+    se ignoran; una lista en la raiz cuenta como varios bloques). aria_valoraciones:
+    aria-label del enlace de valoraciones ("1.234 valoraciones"). asin: si se pasa,
+    se ignoran los bloques de otro ASIN.
+    """
+    datos = {}
+    for bloque in bloques_json:
+        try:
+            contenido = json.loads(bloque)
+        except (ValueError, TypeError):
+            continue
+        for nodo in contenido if isinstance(contenido, list) else (contenido,):
+            if not isinstance(nodo, dict) or (asin and nodo.get('asin', asin) != asin):
                 continue
+            for campo, rutas in (('precio_cent', RUTAS_JSON_PRECIO),
+                                 ('precio_anterior_cent', RUTAS_JSON_PRECIO_ANTERIOR)):
+                if campo not in datos:
+                    centimos = _centimos_json(_valor_json(nodo, rutas))
+                    if centimos:
+                        datos[campo] = centimos
+            if 'valoraciones' not in datos:
+                valor = _valor_json(nodo, RUTAS_JSON_VALORACIONES)
+                if isinstance(valor, int) and not isinstance(valor, bool):
+                    datos['valoraciones'] = valor
+                elif isinstance(valor, str) and _RE_NO_DIGITOS.sub('', valor):
+                    datos['valoraciones'] = int(_RE_NO_DIGITOS.sub('', valor))
+    if 'valoraciones' not in datos and aria_valoraciones:
+        m = _RE_ARIA_VALORACIONES.match(aria_valoraciones)
+        if m:
+            datos['valoraciones'] = int(_RE_NO_DIGITOS.sub('', m.group(1)) or 0)
+    return datos
+
+
+# --- Estadisticas de los selectores de badge ---
+
+# Al guardar, si se superan estos items se dividen a la mitad todos los contadores:
+# pesa mas lo observado recientemente que lo de hace semanas
+MAX_ITEMS_BADGES = 5000
+
+# Por debajo de estos items en una ejecucion no se avisa de que no hay badges
+MIN_ITEMS_AVISO_BADGES = 40
+
+# Acumuladas entre ejecuciones y de la ejecucion en curso (resumen)
+_estadisticas_badges = {'items': 0, 'aciertos': dict.fromkeys(BADGE_SELECTORS, 0)}
+_badges_ejecucion = {'items': 0, 'aciertos': dict.fromkeys(BADGE_SELECTORS, 0)}
+_lock_badges = threading.Lock()
+
+
+def ruta_estadisticas_badges(canal):
+    """Fichero de aciertos de los selectores de badge de un canal dentro de CACHE_DIR."""
+    return os.path.join(CACHE_DIR, f"badges_{canal}.json")
+
+
+def _anotar_badges(selector):
+    """
+    Cuenta un item en el que se ha buscado el badge y, si `selector` no esta vacio,
+    un acierto para el selector que ha dado el porcentaje.
+    """
+    with _lock_badges:
+        _estadisticas_badges['items'] += 1
+        _badges_ejecucion['items'] += 1
+        if selector:
+            _estadisticas_badges['aciertos'][selector] = _estadisticas_badges['aciertos'].get(selector, 0) + 1
+            _badges_ejecucion['aciertos'][selector] = _badges_ejecucion['aciertos'].get(selector, 0) + 1
+
+
+def resumen_badges(reiniciar=False):
+    """Copia de los aciertos por selector de la ejecucion en curso (y los pone a cero si reiniciar)."""
+    with _lock_badges:
+        resumen = {'items': _badges_ejecucion['items'], 'aciertos': dict(_badges_ejecucion['aciertos'])}
+        if reiniciar:
+            _badges_ejecucion['items'] = 0
+            _badges_ejecucion['aciertos'] = dict.fromkeys(BADGE_SELECTORS, 0)
+    return resumen
+
+
+def log_resumen_badges():
+    """
+    Escribe en el log los aciertos de cada selector de badge desde el ultimo resumen
+    y reinicia los contadores. Avisa si ningun selector ha encontrado un descuento:
+    es la señal de que Amazon ha cambiado el marcado del badge.
+    """
+    resumen = resumen_badges(reiniciar=True)
+    items = resumen['items']
+    if not items:
+        return resumen
+    log.info(
+        "Badges de descuento en %d items: %s", items,
+        ", ".join(f"{selector} {resumen['aciertos'].get(selector, 0)} "
+                  f"({100 * resumen['aciertos'].get(selector, 0) / items:.0f}%)" for selector in BADGE_SELECTORS)
+    )
+    if items >= MIN_ITEMS_AVISO_BADGES and not any(resumen['aciertos'].values()):
+        log.warning("⚠️  Ningun selector de badge ha encontrado descuentos en %d items: revisar BADGE_SELECTORS", items)
+    return resumen
+
+
+def cargar_estadisticas_badges(filepath):
+    """
+    Carga los aciertos acumulados por ejecuciones anteriores. Un fichero inexistente
+    o corrupto se ignora (se empieza de cero). Retorna los items cargados.
+    """
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+        items = int(datos['items'])
+        aciertos = {selector: int(datos['aciertos'].get(selector, 0)) for selector in BADGE_SELECTORS}
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        log.warning("No se pudieron leer las estadisticas de badges de %s: %s", filepath, e)
+        return 0
+    with _lock_badges:
+        _estadisticas_badges['items'] = items
+        _estadisticas_badges['aciertos'] = aciertos
+    log.debug("Estadisticas de badges cargadas de %s: %d items, aciertos %s", filepath, items, aciertos)
+    return items
+
+
+def guardar_estadisticas_badges(filepath):
+    """Guarda (de forma atomica) los aciertos acumulados. Retorna los items guardados."""
+    with _lock_badges:
+        if _estadisticas_badges['items'] > MAX_ITEMS_BADGES:
+            _estadisticas_badges['items'] //= 2
+            for selector in _estadisticas_badges['aciertos']:
+                _estadisticas_badges['aciertos'][selector] //= 2
+        datos = {'items': _estadisticas_badges['items'], 'aciertos': dict(_estadisticas_badges['aciertos'])}
+    try:
+        _escribir_json_atomico(filepath, datos)
+    except OSError as e:
+        log.warning("No se pudieron guardar las estadisticas de badges en %s: %s", filepath, e)
+        return 0
+    return datos['items']
+
 
-            titulo_elem = item.select_one('h2 a span') or item.select_one('h2 span')
-            titulo = titulo_elem.get_text(strip=True) if titulo_elem else "Sin titulo"
+def _recorrer_item(item):
+    """
+    Recorre una sola vez el subarbol de un resultado de BeautifulSoup y devuelve
+    {selector: primer Tag que lo cumple} para los selectores SEL_* y BADGE_SELECTORS,
+    con la misma semantica que item.select_one(selector). Para SEL_DATOS_JSON el
+    valor es la lista de todos los <script> JSON del resultado.
+    """
+    encontrados = {}
 
-            precio = "N/A"
-            # data-a-color="base" es el precio real del buy-box de Amazon.
-            # Evitar data-a-color="secondary" (precio de marketplace, aparece primero en el DOM)
-            # y data-a-strike="true" (precio antiguo tachado).
-            precio_elem = (
-                item.select_one('.a-price[data-a-color="base"] .a-offscreen') or
-                item.select_one('.a-price:not([data-a-strike="true"]):not([data-a-color="secondary"]) .a-offscreen')
+    def anotar(selector, tag):
+        if selector not in encontrados:
+            encontrados[selector] = tag
+
+    def visitar(padre, en_h2, en_h2_a, en_precio_base, en_precio_normal, en_precio_tachado):
+        previo = None
+        for tag in padre.children:
+            if not isinstance(tag, Tag):
+                continue
+            nombre = tag.name
+            clases = tag.get('class') or ()
+            if isinstance(clases, str):
+                clases = clases.split()
+
+            if nombre == 'span':
+                if en_h2_a:
+                    anotar(SEL_TITULO, tag)
+                if en_h2:
+                    anotar(SEL_TITULO_ALT, tag)
+                if previo is not None and 'estrellas' in (previo.get('aria-label') or ''):
+                    anotar(SEL_VALORACIONES_ALT, tag)
+            elif nombre == 'img' and 's-image' in clases:
+                anotar(SEL_IMAGEN, tag)
+            elif nombre == 'script':
+                if tag.get('type') in TIPOS_SCRIPT_JSON:
+                    encontrados.setdefault(SEL_DATOS_JSON, []).append(tag)
+            if 'valoraci' in (tag.get('aria-label') or ''):
+                anotar(SEL_ARIA_VALORACIONES, tag)
+
+            if clases:
+                if 'a-offscreen' in clases:
+                    if en_precio_base:
+                        anotar(SEL_PRECIO, tag)
+                    if en_precio_normal:
+                        anotar(SEL_PRECIO_ALT, tag)
+                    if en_precio_tachado:
+                        anotar(SEL_PRECIO_ANTERIOR, tag)
+                if 'savingsPercentage' in clases:
+                    anotar(BADGE_SELECTORS[0], tag)
+                if 'a-badge-text' in clases:
+                    anotar(BADGE_SELECTORS[1], tag)
+                if any('savingsPercentage' in c for c in clases):
+                    anotar(BADGE_SELECTORS[2], tag)
+                if 's-coupon-highlight-color' in clases:
+                    anotar(BADGE_SELECTORS[3], tag)
+                if 's-coupon-unclipped' in clases or 's-coupon-clipped' in clases:
+                    anotar(SEL_CUPON, tag)
+                if 'a-size-base' in clases:
+                    if 's-underline-text' in clases:
+                        anotar(SEL_VALORACIONES, tag)
+                    if 'a-color-secondary' in clases:
+                        anotar(SEL_VENTAS, tag)
+
+            hijo_base, hijo_normal, hijo_tachado = en_precio_base, en_precio_normal, en_precio_tachado
+            if 'a-price' in clases:
+                tachado = tag.get('data-a-strike') == 'true'
+                color = tag.get('data-a-color')
+                hijo_base = hijo_base or color == 'base'
+                hijo_tachado = hijo_tachado or tachado
+                hijo_normal = hijo_normal or (not tachado and color != 'secondary')
+            visitar(
+                tag, en_h2 or nombre == 'h2', en_h2_a or (en_h2 and nombre == 'a'),
+                hijo_base, hijo_normal, hijo_tachado
             )
-            if precio_elem:
-                precio = precio_elem.get_text(strip=True)
-
-            precio_anterior = None
-            precio_anterior_elem = item.select_one('.a-price[data-a-strike="true"] .a-offscreen')
-            if precio_anterior_elem:
-                precio_anterior = precio_anterior_elem.get_text(strip=True)
-
-            # Badge de descuento oficial de Amazon. Intentamos varios selectores porque
-            # Amazon cambia ocasionalmente los nombres de clase en su HTML.
-            descuento_badge = 0
-            BADGE_SELECTORS = [
-                '.savingsPercentage',           # selector histórico (hasta ~mar 2026)
-                '.a-badge-text',                # variante de badge genérico
-                '[class*="savingsPercentage"]', # cualquier clase que contenga el nombre
-                '.s-coupon-highlight-color',    # badge de oferta flash/lightning
-            ]
-            for selector in BADGE_SELECTORS:
-                badge_elem = item.select_one(selector)
-                if badge_elem:
-                    badge_text = badge_elem.get_text(strip=True)
-                    m = re.search(r'(\d+)\s*%', badge_text)
-                    if m:
-                        descuento_badge = int(m.group(1))
-                        break
-
-            # Detectar si el precio requiere cupón (el precio real es mayor hasta que se activa).
-            # En ese caso no lo contamos como oferta directa para evitar precios engañosos.
-            es_cupon = bool(item.select_one('.s-coupon-unclipped, .s-coupon-clipped'))
-
-            # Calcular descuento a partir de la comparación de precios
-            descuento_calculado = 0
-            if precio_anterior and precio != "N/A":
-                try:
-                    precio_num = float(precio.replace('€', '').replace(',', '.').strip())
-                    precio_ant_num = float(precio_anterior.replace('€', '').replace(',', '.').strip())
-                    if precio_ant_num > 0 and precio_num < precio_ant_num:
-                        descuento_calculado = ((precio_ant_num - precio_num) / precio_ant_num) * 100
-                except:
-                    descuento_calculado = 0
-
-            # Determinar descuento final y si hay oferta real:
-            # 1. Si hay badge oficial → fuente de verdad (más fiable)
-            # 2. Si no hay badge pero hay precio tachado con ≥5% de descuento calculado
-            #    → aceptamos como oferta real (Amazon puede haber cambiado el selector del badge)
-            MIN_DESCUENTO_SIN_BADGE = 5.0
-            if descuento_badge > 0:
-                descuento = float(descuento_badge)
-            elif descuento_calculado >= MIN_DESCUENTO_SIN_BADGE:
-                descuento = descuento_calculado
-                log.debug("  Badge no encontrado; usando descuento calculado %.0f%% para ASIN %s", descuento, asin)
-            else:
-                # Sin badge ni precio tachado significativo → no es oferta
-                precio_anterior = None
-                descuento = 0
+            previo = tag
+
+    visitar(item, False, False, False, False, False)
+    return encontrados
+
+
+def _producto_desde_item(asin, texto, atributo, estructurados=None, perezoso=False, badges=None):
+    """
+    Construye el Producto de un resultado de busqueda.
+
+    Es comun a los dos extractores: solo recibe dos funciones de consulta sobre el
+    nodo del resultado, texto(selector) -> texto sin espacios del primer elemento
+    (None si no existe) y atributo(selector, nombre) -> valor ('' si falta, None
+    si no existe el elemento). estructurados son los campos ya sacados de los
+    datos estructurados (datos_estructurados): valoraciones primero de ahi, precio y
+    tachado solo si el DOM no trae precio.
+
+    Con perezoso, si el resultado no puede ser oferta (sin precio tachado o con
+    cupon) se devuelve un esbozo con tiene_oferta=False y solo asin, titulo, precio
+    y url, sin extraer el resto de campos.
+
+    El selector de badge acertado ('' si ninguno) se anota en las estadisticas de
+    badges, o se añade a la lista `badges` si se pasa, para anotarlo despues.
+    """
+    estructurados = estructurados or {}
+
+    titulo = texto(SEL_TITULO)
+    if titulo is None:
+        titulo = texto(SEL_TITULO_ALT)
+    if titulo is None:
+        titulo = "Sin titulo"
+
+    # Precio y tachado del DOM; los del JSON solo si el resultado no trae precio
+    precio = texto(SEL_PRECIO)
+    if precio is None:
+        precio = texto(SEL_PRECIO_ALT)
+    precio_json = precio is None and 'precio_cent' in estructurados
+    if precio_json:
+        precio = centimos_a_texto(estructurados['precio_cent'])
+    elif precio is None:
+        precio = "N/A"
+
+    if precio_json and 'precio_anterior_cent' in estructurados:
+        precio_anterior = centimos_a_texto(estructurados['precio_anterior_cent'])
+    else:
+        precio_anterior = texto(SEL_PRECIO_ANTERIOR)
+
+    # Detectar si el precio requiere cupón (el precio real es mayor hasta que se activa).
+    # En ese caso no lo contamos como oferta directa para evitar precios engañosos.
+    es_cupon = texto(SEL_CUPON) is not None
+
+    url_afiliado = f"{BASE_URL}/dp/{asin}?tag={PARTNER_TAG}"
+
+    if perezoso and (precio_anterior is None or es_cupon):
+        return Producto(
+            asin=asin,
+            titulo=titulo[:100] + "..." if len(titulo) > 100 else titulo,
+            precio=precio,
+            precio_anterior=None,
+            descuento=0,
+            valoraciones=0,
+            ventas=0,
+            imagen="",
+            url=url_afiliado,
+            tiene_oferta=False,
+        )
 
-            # Extraer numero de valoraciones
+    # Badge de descuento oficial: el primer selector cuyo texto tenga un porcentaje
+    descuento_badge = 0
+    badge_acertado = ''
+    for selector in BADGE_SELECTORS:
+        badge_text = texto(selector)
+        if badge_text is not None:
+            m = _RE_PORCENTAJE.search(badge_text)
+            if m:
+                descuento_badge = int(m.group(1))
+                badge_acertado = selector
+                break
+    if badges is None:
+        _anotar_badges(badge_acertado)
+    else:
+        badges.append(badge_acertado)
+
+    # Calcular descuento a partir de la comparación de precios
+    precio_cent = precio_a_centimos(precio)
+    precio_ant_cent = precio_a_centimos(precio_anterior)
+    descuento_calculado = 0
+    if precio_cent is not None and precio_ant_cent and precio_cent < precio_ant_cent:
+        descuento_calculado = ((precio_ant_cent - precio_cent) / precio_ant_cent) * 100
+
+    # Determinar descuento final y si hay oferta real:
+    # 1. Si hay badge oficial → fuente de verdad (más fiable)
+    # 2. Si no hay badge pero hay precio tachado con ≥5% de descuento calculado
+    #    → aceptamos como oferta real (Amazon puede haber cambiado el selector del badge)
+    if descuento_badge > 0:
+        descuento = float(descuento_badge)
+    elif descuento_calculado >= MIN_DESCUENTO_SIN_BADGE:
+        descuento = descuento_calculado
+        log.debug("  Badge no encontrado; usando descuento calculado %.0f%% para ASIN %s", descuento, asin)
+    else:
+        # Sin badge ni precio tachado significativo → no es oferta
+        precio_anterior = None
+        precio_ant_cent = None
+        descuento = 0
+
+    # Extraer numero de valoraciones
+    valoraciones = estructurados.get('valoraciones', 0)
+    val_text = None
+    if 'valoraciones' not in estructurados:
+        val_text = texto(SEL_VALORACIONES)
+        if val_text is None:
+            val_text = texto(SEL_VALORACIONES_ALT)
+    if val_text is not None:
+        try:
+            val_text = val_text.replace('.', '').replace(',', '')
+            valoraciones = int(_RE_NO_DIGITOS.sub('', val_text) or 0)
+        except:
             valoraciones = 0
-            valoraciones_elem = item.select_one('.a-size-base.s-underline-text') or item.select_one('[aria-label*="estrellas"] + span')
-            if valoraciones_elem:
-                try:
-                    val_text = valoraciones_elem.get_text(strip=True).replace('.', '').replace(',', '')
-                    valoraciones = int(re.sub(r'[^\d]', '', val_text) or 0)
-                except:
-                    valoraciones = 0
-
-            # Extraer ventas (ej: "10K+ comprados el mes pasado")
-            ventas = 0
-            ventas_elem = item.select_one('.a-size-base.a-color-secondary')
-            if ventas_elem:
-                ventas_text = ventas_elem.get_text(strip=True).lower()
-                if 'compra' in ventas_text or 'vendido' in ventas_text:
-                    try:
-                        match = re.search(r'(\d+)[kK]?\+?', ventas_text)
-                        if match:
-                            ventas = int(match.group(1))
-                            if 'k' in ventas_text.lower():
-                                ventas *= 1000
-                    except:
-                        ventas = 0
-
-            imagen = ""
-            img_elem = item.select_one('img.s-image')
-            if img_elem:
-                imagen = img_elem.get('src', '')
-
-            url_afiliado = f"{BASE_URL}/dp/{asin}?tag={PARTNER_TAG}"
-
-            productos.append({
-                'asin': asin,
-                'titulo': titulo[:100] + "..." if len(titulo) > 100 else titulo,
-                'precio': precio,
-                'precio_anterior': precio_anterior,
-                'descuento': descuento,
-                'valoraciones': valoraciones,
-                'ventas': ventas,
-                'imagen': imagen,
-                'url': url_afiliado,
-                'tiene_oferta': precio_anterior is not None and not es_cupon
-            })
 
-        except Exception:
+    # Extraer ventas (ej: "10K+ comprados el mes pasado")
+    ventas = 0
+    ventas_text = texto(SEL_VENTAS)
+    if ventas_text is not None:
+        ventas_text = ventas_text.lower()
+        if 'compra' in ventas_text or 'vendido' in ventas_text:
+            try:
+                match = _RE_VENTAS.search(ventas_text)
+                if match:
+                    ventas = int(match.group(1))
+                    if 'k' in ventas_text.lower():
+                        ventas *= 1000
+            except:
+                ventas = 0
+
+    imagen = atributo(SEL_IMAGEN, 'src') or ""
+
+    return Producto(
+        asin=asin,
+        titulo=titulo[:100] + "..." if len(titulo) > 100 else titulo,
+        precio=precio,
+        precio_anterior=precio_anterior,
+        descuento=descuento,
+        valoraciones=valoraciones,
+        ventas=ventas,
+        imagen=imagen,
+        url=url_afiliado,
+        tiene_oferta=precio_anterior is not None and not es_cupon,
+        precio_cent=precio_cent,
+        precio_anterior_cent=precio_ant_cent,
+    )
+
+
+def extraer_producto_item(item, perezoso=False):
+    """
+    Extrae el producto de un nodo de resultado ya parseado (Tag de BeautifulSoup,
+    p.ej. de obtener_items_busqueda), sin volver a serializarlo ni parsearlo.
+    Con perezoso, los que no pueden ser oferta salen como esbozo (ver _producto_desde_item).
+
+    Retorna None si el nodo no tiene ASIN o no se puede extraer.
+    """
+    asin = item.get('data-asin', '')
+    if not asin:
+        return None
+
+    campos = _recorrer_item(item)
+
+    def texto(selector):
+        elem = campos.get(selector)
+        return elem.get_text(strip=True) if elem is not None else None
+
+    def atributo(selector, nombre):
+        elem = campos.get(selector)
+        return elem.get(nombre, '') if elem is not None else None
+
+    try:
+        estructurados = None
+        if EXTRACCION_ESTRUCTURADA:
+            estructurados = datos_estructurados(
+                [tag.string or '' for tag in campos.get(SEL_DATOS_JSON, ())],
+                atributo(SEL_ARIA_VALORACIONES, 'aria-label'),
+                asin,
+            )
+        return _producto_desde_item(asin, texto, atributo, estructurados, perezoso)
+    except Exception:
+        return None
+
+
+# --- Cache de resultados ya extraidos ---
+
+# Productos extraidos indexados por el hash del HTML de su resultado: una tarjeta
+# identica a la de una ejecucion anterior no se vuelve a extraer (tambien evita
+# re-extraer los ASIN que nunca tienen oferta). LRU con CACHE_ITEMS_MAX entradas;
+# CACHE_ITEMS_MAX=0 la desactiva
+CACHE_ITEMS_MAX = int(os.getenv('CACHE_ITEMS_MAX', '2000'))
+
+# Subir al cambiar la extraccion: invalida los productos cacheados con la anterior
+VERSION_EXTRACCION = 3
+
+# Partes del HTML de un resultado que cambian en cada respuesta sin que cambie el
+# producto: uuid del nodo y parametros de seguimiento de los enlaces
+_RE_VOLATIL_ITEM = re.compile(r'\s*data-uuid="[^"]*"|\b(?:qid|crid|sr|sprefix|dib|dib_tag)=[^&"\s]*')
+
+# Una cache por canal {canal: OrderedDict clave -> registro}: cargar la de un canal
+# no pisa la de otro que corra en el mismo proceso
+_caches_items = {}
+_lock_cache_items = threading.Lock()
+
+# Canal cuya cache usan las extracciones del hilo / corrutina actual (usar_cache_items)
+_canal_cache_items = contextvars.ContextVar('canal_cache_items', default='')
+
+
+def ruta_cache_items(canal):
+    """Fichero de la cache de resultados extraidos de un canal dentro de CACHE_DIR."""
+    return os.path.join(CACHE_DIR, f"items_{canal}.json")
+
+
+def usar_cache_items(canal):
+    """
+    Hace que las extracciones del hilo (o de la corrutina) actual lean y guarden en la
+    cache de resultados de `canal`. Cada funcion de busqueda de un canal la llama al
+    empezar.
+    """
+    _canal_cache_items.set(canal)
+
+
+def _cache_items_canal(canal=None):
+    """OrderedDict de la cache de un canal (por defecto el actual). Llamar con el lock."""
+    if canal is None:
+        canal = _canal_cache_items.get()
+    return _caches_items.setdefault(canal, OrderedDict())
+
+
+def claves_items(html_content, max_resultados=MAX_RESULTADOS_BUSQUEDA):
+    """
+    Lista de (asin, clave) de los primeros resultados de una pagina, en orden,
+    sacada con expresiones regulares (como huella_resultados) sin parsear el HTML.
+    La clave es el hash del fragmento del resultado sin las partes volatiles y con
+    la configuracion de extraccion, de modo que cambiarla invalida la cache.
+    """
+    nodos = list(_RE_NODO_RESULTADO.finditer(html_content))[:max_resultados + 1]
+    prefijo = f"{VERSION_EXTRACCION}|{EXTRACCION_PEREZOSA:d}|{EXTRACCION_ESTRUCTURADA:d}|"
+    claves = []
+    for nodo, siguiente in zip(nodos[:max_resultados], nodos[1:] + [None]):
+        fragmento = html_content[nodo.start():siguiente.start() if siguiente else len(html_content)]
+        asin = _RE_ASIN_NODO.search(nodo.group(0))
+        clave = hashlib.sha1((prefijo + _RE_VOLATIL_ITEM.sub('', fragmento)).encode('utf-8')).hexdigest()
+        claves.append((asin.group(1) if asin else '', clave))
+    return claves
+
+
+def leer_cache_item(clave):
+    """Producto nuevo a partir del registro cacheado con esa clave en el canal actual, o None."""
+    with _lock_cache_items:
+        cache = _cache_items_canal()
+        registro = cache.get(clave)
+        if registro is None:
+            return None
+        cache.move_to_end(clave)
+    return Producto(**registro)
+
+
+def guardar_cache_item(clave, producto):
+    """Guarda el producto extraido de un resultado, expulsando el menos usado si se pasa del maximo."""
+    if CACHE_ITEMS_MAX <= 0:
+        return
+    with _lock_cache_items:
+        cache = _cache_items_canal()
+        cache[clave] = {campo: producto[campo] for campo in Producto.CAMPOS}
+        cache.move_to_end(clave)
+        while len(cache) > CACHE_ITEMS_MAX:
+            cache.popitem(last=False)
+
+
+def _clave_item(claves, indice, asin):
+    """Clave del resultado indice si la de claves_items corresponde al mismo ASIN."""
+    if claves and indice < len(claves) and claves[indice][0] == asin:
+        return claves[indice][1]
+    return None
+
+
+def cargar_cache_items(filepath, canal=None):
+    """
+    Carga en la cache de `canal` (por defecto el actual) la guardada por una
+    ejecucion anterior; las de los demas canales no se tocan. Un fichero
+    inexistente o corrupto se ignora. Retorna el numero de resultados cargados.
+    """
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            guardados = json.load(f)
+        entradas = [
+            (clave, registro) for clave, registro in guardados.items()
+            if isinstance(registro, dict) and all(campo in registro for campo in Producto.CAMPOS)
+        ]
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError, AttributeError) as e:
+        log.warning("No se pudo leer la cache de resultados de %s: %s", filepath, e)
+        return 0
+    with _lock_cache_items:
+        cache = _cache_items_canal(canal)
+        cache.clear()
+        # Se guardan del menos al mas usado: los mas recientes quedan al final
+        for clave, registro in entradas[-CACHE_ITEMS_MAX:] if CACHE_ITEMS_MAX > 0 else ():
+            cache[clave] = registro
+        cargados = len(cache)
+    log.debug("Cache de resultados cargada de %s: %d", filepath, cargados)
+    return cargados
+
+
+def guardar_cache_items(filepath, canal=None):
+    """Guarda (de forma atomica) la cache de resultados de `canal` (por defecto el actual). Retorna el numero guardado."""
+    with _lock_cache_items:
+        datos = dict(_cache_items_canal(canal))
+    try:
+        _escribir_json_atomico(filepath, datos)
+    except OSError as e:
+        log.warning("No se pudo guardar la cache de resultados en %s: %s", filepath, e)
+        return 0
+    return len(datos)
+
+
+def extraer_productos_busqueda_bs4(html_content, parser=None, claves=None):
+    """
+    Extrae productos de una pagina de busqueda de Amazon con BeautifulSoup.
+
+    Con claves (de claves_items), los resultados que esten en la cache de resultados
+    se toman de ella y los demas se extraen y se guardan.
+    """
+    productos = []
+    items = obtener_items_busqueda(html_content, parser)
+
+    for indice, item in enumerate(items[:MAX_RESULTADOS_BUSQUEDA]):  # Mas productos para encontrar ofertas
+        clave = _clave_item(claves, indice, item.get('data-asin', ''))
+        producto = leer_cache_item(clave) if clave else None
+        if producto is None:
+            producto = extraer_producto_item(item, EXTRACCION_PEREZOSA)
+            if clave and producto is not None:
+                guardar_cache_item(clave, producto)
+        if producto is not None:
+            productos.append(producto)
+
+    return productos
+
+
+def extraer_productos_busqueda_rapido(html_content, claves=None):
+    """
+    Extrae productos de una pagina de busqueda con selectolax (parser Lexbor en C).
+
+    Devuelve los mismos productos que extraer_productos_busqueda_bs4. Los resultados en
+    los que la via rapida no encuentra titulo o precio, o en los que falla, se
+    vuelven a parsear uno a uno con BeautifulSoup. claves: como en extraer_productos_busqueda_bs4.
+    """
+    productos = []
+    arbol = LexborHTMLParser(html_content)
+    items = arbol.css(SELECTOR_RESULTADO)
+
+    for indice, item in enumerate(items[:MAX_RESULTADOS_BUSQUEDA]):
+        asin = item.attributes.get('data-asin') or ''
+        if not asin:
             continue
+        clave = _clave_item(claves, indice, asin)
+        if clave:
+            producto = leer_cache_item(clave)
+            if producto is not None:
+                productos.append(producto)
+                continue
+
+        def texto(selector, item=item):
+            elem = item.css_first(selector)
+            return elem.text(deep=True, separator='', strip=True) if elem is not None else None
+
+        def atributo(selector, nombre, item=item):
+            elem = item.css_first(selector)
+            return (elem.attributes.get(nombre) or '') if elem is not None else None
+
+        try:
+            estructurados = None
+            if EXTRACCION_ESTRUCTURADA:
+                estructurados = datos_estructurados(
+                    [nodo.text(deep=True) for nodo in item.css(SEL_DATOS_JSON)],
+                    atributo(SEL_ARIA_VALORACIONES, 'aria-label'),
+                    asin,
+                )
+            badges = []
+            producto = _producto_desde_item(asin, texto, atributo, estructurados, EXTRACCION_PEREZOSA, badges)
+            confiable = producto['titulo'] != "Sin titulo" and producto['precio'] != "N/A"
+        except Exception:
+            producto, confiable = None, False
+
+        # Si se repite con BeautifulSoup, el item se anota en esa segunda extraccion
+        if confiable:
+            for selector in badges:
+                _anotar_badges(selector)
+
+        if not confiable:
+            log.debug("  Extraccion rapida incompleta para ASIN %s, reintentando con BeautifulSoup", asin)
+            producto = None
+            for tag in obtener_items_busqueda(item.html)[:1]:
+                producto = extraer_producto_item(tag, EXTRACCION_PEREZOSA)
+        if producto is not None:
+            if clave:
+                guardar_cache_item(clave, producto)
+            productos.append(producto)
 
     return productos
+
+
+def extraer_productos_busqueda(html_content, parser=None):
+    """
+    Extrae productos de una pagina de busqueda de Amazon.
+
+    Usa la via rapida (selectolax) si esta instalada y activada con EXTRACCION_RAPIDA;
+    con un parser explicito, o sin selectolax, usa BeautifulSoup. Los resultados
+    identicos a otros ya extraidos salen de la cache de resultados.
+    """
+    claves = None
+    if CACHE_ITEMS_MAX > 0:
+        # Si todos los resultados estan en la cache no hace falta ni parsear la pagina
+        claves = claves_items(html_content)
+        con_asin = [clave for asin, clave in claves if asin]
+        if con_asin:
+            productos = [leer_cache_item(clave) for clave in con_asin]
+            if all(producto is not None for producto in productos):
+                log.debug("  Resultados sin cambios: %d productos desde la cache", len(productos))
+                return productos
+
+    if parser is None and EXTRACCION_RAPIDA and LexborHTMLParser is not None:
+        return extraer_productos_busqueda_rapido(html_content, claves)
+    return extraer_productos_busqueda_bs4(html_content, parser, claves)
+
+
+# --- Enriquecimiento con la pagina de producto ---
+
+# Completar los ganadores de cada categoria con su pagina /dp/ (badge, precio
+# tachado, ventas que a veces faltan en la tarjeta de busqueda). Desactivado por
+# defecto: cuesta hasta una peticion extra por categoria con la cache fria
+ENRIQUECER_DETALLE = os.getenv('ENRIQUECER_DETALLE', '0') == '1'
+
+# Cache de los datos extraidos de /dp/ por ASIN (no del HTML, que pesa ~1 MB)
+CACHE_DETALLE_DIR = os.path.join(CACHE_DIR, "detalle")
+CACHE_DETALLE_TTL = int(os.getenv('CACHE_DETALLE_TTL', str(6 * 3600)))
+
+# Selectores de la pagina de producto, del mas al menos especifico
+DET_PRECIO = (
+    '#corePriceDisplay_desktop_feature_div .priceToPay .a-offscreen',
+    '#corePrice_feature_div .a-price .a-offscreen',
+    '#corePrice_desktop .a-price .a-offscreen',
+)
+DET_PRECIO_ANTERIOR = (
+    '#corePriceDisplay_desktop_feature_div .basisPrice .a-offscreen',
+    '#corePrice_desktop .a-text-price[data-a-strike="true"] .a-offscreen',
+    '.a-price[data-a-strike="true"] .a-offscreen',
+)
+DET_DESCUENTO = (
+    '#corePriceDisplay_desktop_feature_div .savingsPercentage',
+    '.savingsPercentage',
+)
+DET_VALORACIONES = '#acrCustomerReviewText'
+DET_VENTAS = '#social-proofing-faceout-title-tk_bought'
+
+
+_RE_NO_ALFANUMERICO = re.compile(r'[^A-Za-z0-9]')
+
+
+def _ruta_cache_detalle(asin):
+    return os.path.join(CACHE_DETALLE_DIR, f"{_RE_NO_ALFANUMERICO.sub('', asin)}.json")
+
+
+def leer_cache_detalle(asin):
+    """Datos de detalle cacheados de un ASIN si siguen vigentes, o None."""
+    if CACHE_DETALLE_TTL <= 0:
+        return None
+    try:
+        with open(_ruta_cache_detalle(asin), 'r', encoding='utf-8') as f:
+            entrada = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entrada, dict) or entrada.get('asin') != asin or not isinstance(entrada.get('datos'), dict):
+        return None
+    if reloj_pared() - entrada.get('obtenido', 0) >= CACHE_DETALLE_TTL:
+        return None
+    return entrada['datos']
+
+
+def guardar_cache_detalle(asin, datos):
+    """Guarda (de forma atomica) los datos de detalle de un ASIN."""
+    if CACHE_DETALLE_TTL <= 0:
+        return
+    ruta = _ruta_cache_detalle(asin)
+    try:
+        _escribir_json_atomico(ruta, {'asin': asin, 'obtenido': reloj_pared(), 'datos': datos})
+    except OSError as e:
+        log.debug("No se pudo escribir la cache de detalle de %s: %s", asin, e)
+
+
+def extraer_detalle_producto(html_content):
+    """
+    Extrae de una pagina /dp/ los campos que encuentre: precio, precio_anterior,
+    descuento (badge), valoraciones y ventas. Retorna {} si no encuentra ninguno.
+    """
+    soup = parsear_html(html_content)
+
+    def primero(selectores):
+        for selector in selectores:
+            elem = soup.select_one(selector)
+            if elem is not None:
+                texto = elem.get_text(strip=True)
+                if texto:
+                    return texto
+        return None
+
+    datos = {}
+    precio = primero(DET_PRECIO)
+    if precio_a_centimos(precio) is not None:
+        datos['precio'] = precio
+    precio_anterior = primero(DET_PRECIO_ANTERIOR)
+    if precio_a_centimos(precio_anterior) is not None:
+        datos['precio_anterior'] = precio_anterior
+
+    badge = primero(DET_DESCUENTO)
+    m = _RE_PORCENTAJE.search(badge) if badge else None
+    if m:
+        datos['descuento'] = float(m.group(1))
+
+    val_text = primero((DET_VALORACIONES,))
+    if val_text and _RE_NO_DIGITOS.sub('', val_text):
+        datos['valoraciones'] = int(_RE_NO_DIGITOS.sub('', val_text))
+
+    ventas_text = primero((DET_VENTAS,))
+    m = _RE_VENTAS.search(ventas_text) if ventas_text else None
+    if m:
+        datos['ventas'] = int(m.group(1)) * (1000 if 'k' in ventas_text.lower() else 1)
+    return datos
+
+
+def _aplicar_detalle(producto, detalle):
+    """
+    Copia del producto completada con los datos de su pagina /dp/.
+
+    Precio y precio anterior se toman juntos de la pagina cuando trae los dos (son
+    coherentes entre si). Si los precios cambian, el descuento y tiene_oferta se
+    recalculan con las mismas reglas que en la busqueda: el badge de la pagina o,
+    sin badge, el calculado con esos precios si llega a MIN_DESCUENTO_SIN_BADGE;
+    si no llega, el producto deja de ser oferta. Valoraciones y ventas solo
+    rellenan huecos.
+    """
+    enriquecido = producto.copy()
+    precios_nuevos = False
+    if 'precio' in detalle and 'precio_anterior' in detalle:
+        enriquecido['precio'] = detalle['precio']
+        enriquecido['precio_anterior'] = detalle['precio_anterior']
+        precios_nuevos = True
+    elif 'precio_anterior' in detalle and not enriquecido.get('precio_anterior'):
+        enriquecido['precio_anterior'] = detalle['precio_anterior']
+        precios_nuevos = True
+
+    if detalle.get('descuento'):
+        enriquecido['descuento'] = detalle['descuento']
+    elif precios_nuevos:
+        precio_cent = precio_a_centimos(enriquecido.get('precio'))
+        precio_ant_cent = precio_a_centimos(enriquecido.get('precio_anterior'))
+        calculado = 0
+        if precio_cent is not None and precio_ant_cent and precio_cent < precio_ant_cent:
+            calculado = ((precio_ant_cent - precio_cent) / precio_ant_cent) * 100
+        if calculado >= MIN_DESCUENTO_SIN_BADGE:
+            enriquecido['descuento'] = calculado
+        else:
+            enriquecido['precio_anterior'] = None
+            enriquecido['descuento'] = 0
+            enriquecido['tiene_oferta'] = False
+
+    for campo in ('valoraciones', 'ventas'):
+        if not enriquecido.get(campo) and detalle.get(campo):
+            enriquecido[campo] = detalle[campo]
+    return enriquecido
+
+
+def enriquecer_mejores(mejores_por_categoria, descargar=None):
+    """
+    Completa el producto de cada entrada {'producto', 'categoria'} con los datos de
+    su pagina /dp/, si ENRIQUECER_DETALLE esta activado.
+
+    Los ASIN con datos vigentes en la cache no se descargan; el resto se piden a la
+    vez (obtener_paginas, al ritmo del limitador compartido) o con la funcion
+    descargar (lista de URLs, max_resultados, usar_cache -> lista de HTML), p.ej. el
+    motor asincrono. Las paginas /dp/ se piden enteras (max_resultados=0) y sin
+    pasar por la cache HTTP (usar_cache=False): pesan ~1 MB y de ellas solo se
+    guardan los datos extraidos. Si una pagina falla o esta bloqueada, esa
+    entrada se queda como estaba.
+
+    Retorna una lista nueva con las entradas en el mismo orden, sin las que han
+    dejado de ser oferta segun su pagina /dp/ (los canales ordenan despues).
+    """
+    if not ENRIQUECER_DETALLE or not mejores_por_categoria:
+        return mejores_por_categoria
+
+    detalles = {}
+    pendientes = []
+    for entrada in mejores_por_categoria:
+        asin = entrada['producto']['asin']
+        datos = leer_cache_detalle(asin)
+        if datos is not None:
+            detalles[asin] = datos
+        elif asin not in pendientes:
+            pendientes.append(asin)
+
+    desde_cache = len(detalles)
+    if pendientes:
+        urls = [f"{BASE_URL}/dp/{asin}" for asin in pendientes]
+        if descargar is None:
+            paginas = obtener_paginas(urls, functools.partial(obtener_pagina, max_resultados=0, usar_cache=False))
+        else:
+            paginas = descargar(urls, max_resultados=0, usar_cache=False)
+        for asin, html_content in zip(pendientes, paginas):
+            if not html_content or isinstance(html_content, PaginaBloqueada):
+                log.debug("  Detalle de %s no disponible, se usa la tarjeta de busqueda", asin)
+                continue
+            try:
+                datos = extraer_detalle_producto(html_content)
+            except Exception as e:
+                log.debug("  No se pudo extraer el detalle de %s: %s", asin, e)
+                continue
+            guardar_cache_detalle(asin, datos)
+            detalles[asin] = datos
+
+    log.info(
+        "Enriquecimiento con /dp/: %d candidatos, %d desde cache, %d descargados",
+        len(mejores_por_categoria), desde_cache, len(detalles) - desde_cache
+    )
+    enriquecidos = []
+    for entrada in mejores_por_categoria:
+        producto = entrada['producto']
+        if detalles.get(producto['asin']):
+            producto = _aplicar_detalle(producto, detalles[producto['asin']])
+            if not producto['tiene_oferta']:
+                log.info(
+                    "  DESCARTADO [sin descuento en su pagina /dp/] %s... (%s, ASIN: %s)",
+                    producto['titulo'][:50], producto['precio'], producto['asin']
+                )
+                continue
+            entrada = {**entrada, 'producto': producto}
+        enriquecidos.append(entrada)
+    return enriquecidos